@@ -0,0 +1,298 @@
+"""
+Busca vetorial local das receitas, alternativa ao $vectorSearch do Atlas (RECEITAS_VETORIAL=local|auto).
+
+Os vetores de cada empresa ficam numa matriz float32 normalizada, salva em RECEITAS_ANN_DIR e aberta
+com memory-map (compartilhada pelo page cache entre os workers e reaproveitada ao reiniciar). Partições
+pequenas são varridas por completo; a partir de RECEITAS_ANN_IVF_MIN vetores é montado um índice IVF
+(k-means) e só as RECEITAS_ANN_NPROBE listas mais próximas da consulta são varridas.
+
+A sincronização é incremental: compara _id/embeddingHash/embeddingModelo da empresa no Mongo com a partição
+e só baixa os vetores novos ou alterados. Receitas sem embeddingHash (vetor gravado fora de indexar_receitas)
+são baixadas uma vez e guardadas sem versão; voltam a ser baixadas quando o indexador gravar o hash.
+"""
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from bson import json_util
+from dotenv import load_dotenv
+
+from mongo_client import get_db
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+load_dotenv()
+
+RECEITAS_ANN_DIR = os.getenv("RECEITAS_ANN_DIR", ".ann_receitas")
+RECEITAS_ANN_SYNC = float(os.getenv("RECEITAS_ANN_SYNC", "60"))          # segundos até ressincronizar uma empresa
+RECEITAS_ANN_IVF_MIN = int(os.getenv("RECEITAS_ANN_IVF_MIN", "4096"))    # abaixo disso a busca é exata
+RECEITAS_ANN_NPROBE = int(os.getenv("RECEITAS_ANN_NPROBE", "8"))         # listas IVF varridas por consulta
+
+CAMPOS_RECEITA = ("nome", "descricao", "ingredientes", "modoPreparo")
+
+
+def _versao(doc):
+    # o hash é do texto; o modelo entra junto porque reindexar com outro modelo não muda o texto
+    hash_ = doc.get("embeddingHash")
+    return None if hash_ is None else f"{hash_}:{doc.get('embeddingModelo') or ''}"
+
+
+def _normalizar_linhas(matriz):
+    normas = np.linalg.norm(matriz, axis=1, keepdims=True)
+    normas[normas == 0] = 1.0
+    return matriz / normas
+
+
+def _kmeans(matriz, listas, iteracoes=10, semente=0):
+    rng = np.random.default_rng(semente)
+    centroides = matriz[rng.choice(len(matriz), listas, replace=False)].copy()
+    for _ in range(iteracoes):
+        atribuicao = np.argmax(matriz @ centroides.T, axis=1)  # vetores normalizados: produto = cosseno
+        for c in range(listas):
+            membros = matriz[atribuicao == c]
+            if len(membros):
+                centroides[c] = membros.mean(axis=0)
+        centroides = _normalizar_linhas(centroides)
+    return centroides, np.argmax(matriz @ centroides.T, axis=1)
+
+
+class Particao:
+    """Receitas de uma empresa: matriz (memory-map) + documentos na mesma ordem."""
+
+    def __init__(self, ids, hashes, docs, matriz):
+        self.ids = ids
+        self.hashes = dict(zip(ids, hashes))
+        self.posicao = {id_: i for i, id_ in enumerate(ids)}
+        self.docs = docs
+        self.matriz = matriz
+        self.sincronizada_em = time.monotonic()
+        self.ivf = None
+        if len(ids) >= RECEITAS_ANN_IVF_MIN:
+            centroides, atribuicao = _kmeans(np.asarray(matriz), int(np.sqrt(len(ids))))
+            self.ivf = (centroides, [np.flatnonzero(atribuicao == c) for c in range(len(centroides))])
+
+    def __len__(self):
+        return len(self.ids)
+
+    def compativel(self, vetor):
+        # vetores de modelos com outra dimensão não podem ser comparados
+        return not self.ids or len(vetor) == self.matriz.shape[1]
+
+    def buscar(self, vetor, k):
+        if not self.ids or k <= 0:
+            return []
+        consulta = np.asarray(vetor, dtype=np.float32)
+        consulta /= np.linalg.norm(consulta) or 1.0
+        if self.ivf is None:
+            candidatos = None
+            scores = self.matriz @ consulta
+        else:
+            centroides, listas = self.ivf
+            proximas = np.argsort(centroides @ consulta)[::-1][:RECEITAS_ANN_NPROBE]
+            candidatos = np.concatenate([listas[c] for c in proximas])
+            if not len(candidatos):
+                return []  # todas as listas varridas estão vazias
+            scores = self.matriz[candidatos] @ consulta
+        k = min(k, len(scores))
+        melhores = np.argpartition(-scores, k - 1)[:k]
+        melhores = melhores[np.argsort(-scores[melhores])]
+        linhas = melhores if candidatos is None else candidatos[melhores]
+        # mesma escala do vectorSearchScore do Atlas para similaridade cosine: (1 + cos) / 2
+        return [{**self.docs[i], "score": float((1 + s) / 2)} for i, s in zip(linhas, scores[melhores])]
+
+
+class IndiceReceitasLocal:
+    def __init__(self, collection="receitas", diretorio=RECEITAS_ANN_DIR, intervalo_sync=RECEITAS_ANN_SYNC):
+        if np is None:
+            raise RuntimeError("RECEITAS_VETORIAL=local|auto requer o pacote 'numpy'.")
+        self.collection = collection
+        self.diretorio = diretorio
+        self.intervalo_sync = intervalo_sync
+        self.pid = os.getpid()
+        self.particoes = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+        self._em_sync = set()
+        self.dimensao = None  # dimensão da última consulta (modelo de embedding em uso)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ann-sync")
+        self.contagem = {"buscas": 0, "sincronizacoes": 0, "vetores_baixados": 0, "carregadas_do_disco": 0}
+        os.makedirs(diretorio, exist_ok=True)
+
+    def _arquivos(self, empresa_id):
+        base = os.path.join(self.diretorio, f"{self.collection}_{empresa_id}")
+        return base + ".npy", base + ".json"
+
+    def _lock_empresa(self, empresa_id):
+        with self._lock:
+            return self._locks.setdefault(empresa_id, threading.Lock())
+
+    def _carregar_do_disco(self, empresa_id):
+        arquivo_matriz, arquivo_meta = self._arquivos(empresa_id)
+        if not (os.path.exists(arquivo_matriz) and os.path.exists(arquivo_meta)):
+            return None
+        try:
+            with open(arquivo_meta, encoding="utf-8") as f:
+                meta = json_util.loads(f.read())
+            matriz = np.load(arquivo_matriz, mmap_mode="r")
+        except Exception as e:
+            print(f"Partição local da empresa {empresa_id} ilegível, reconstruindo: {e}")
+            return None
+        if len(matriz) != len(meta["ids"]):
+            return None
+        self.contagem["carregadas_do_disco"] += 1
+        particao = Particao(meta["ids"], meta["hashes"], meta["docs"], matriz)
+        particao.sincronizada_em = 0.0  # o Mongo pode ter mudado desde que o arquivo foi salvo
+        return particao
+
+    def _salvar(self, empresa_id, ids, hashes, docs, matriz):
+        # grava em arquivos temporários e troca com os.replace: quem já abriu o memory-map antigo segue lendo
+        arquivo_matriz, arquivo_meta = self._arquivos(empresa_id)
+        sufixo = f".{os.getpid()}.tmp"
+        with open(arquivo_matriz + sufixo, "wb") as f:
+            np.save(f, matriz)
+        with open(arquivo_meta + sufixo, "w", encoding="utf-8") as f:
+            f.write(json_util.dumps({"ids": ids, "hashes": hashes, "docs": docs}))
+        os.replace(arquivo_matriz + sufixo, arquivo_matriz)
+        os.replace(arquivo_meta + sufixo, arquivo_meta)
+        return np.load(arquivo_matriz, mmap_mode="r")
+
+    def sincronizar(self, empresa_id):
+        collection = get_db()[self.collection]
+        atual = self.particoes.get(empresa_id)
+        remoto = {
+            str(d["_id"]): (d["_id"], _versao(d))
+            for d in collection.find({"empresaId": empresa_id, "embedding": {"$exists": True}}, {"embeddingHash": 1, "embeddingModelo": 1})
+        }
+        conhecidos = atual.hashes if atual else {}
+        baixar = [id_ for id_, (_, hash_) in remoto.items() if id_ not in conhecidos or conhecidos[id_] != hash_]
+        if atual is not None and not baixar and remoto.keys() == conhecidos.keys():
+            atual.sincronizada_em = time.monotonic()
+            return atual
+
+        projecao = {campo: 1 for campo in CAMPOS_RECEITA}
+        novos = {}
+        if baixar:
+            for doc in collection.find({"_id": {"$in": [remoto[id_][0] for id_ in baixar]}}, {**projecao, "embedding": 1}):
+                novos[str(doc["_id"])] = doc
+
+        ids, hashes, docs, linhas = [], [], [], []
+        for id_, (_, hash_) in remoto.items():
+            if id_ in novos:
+                doc = novos[id_]
+                vetor = doc.get("embedding")
+                if not vetor:
+                    continue
+                linhas.append(np.asarray(vetor, dtype=np.float32))
+                docs.append({campo: doc.get(campo) for campo in CAMPOS_RECEITA})
+            elif atual is not None and id_ in atual.posicao:
+                i = atual.posicao[id_]
+                linhas.append(np.asarray(atual.matriz[i]))
+                docs.append(atual.docs[i])
+            else:
+                continue  # apagada entre as duas consultas
+            ids.append(id_)
+            hashes.append(hash_)
+
+        # descarta vetores de outro modelo/dimensão; na dúvida, fica a dimensão das consultas
+        dim = self.dimensao or max((len(l) for l in linhas), default=0)
+        validos = [i for i, l in enumerate(linhas) if len(l) == dim]
+        matriz = _normalizar_linhas(np.stack([linhas[i] for i in validos])) if validos else np.zeros((0, 1), np.float32)
+        ids, hashes, docs = [ids[i] for i in validos], [hashes[i] for i in validos], [docs[i] for i in validos]
+
+        particao = Particao(ids, hashes, docs, self._salvar(empresa_id, ids, hashes, docs, matriz.astype(np.float32)))
+        with self._lock:
+            self.particoes[empresa_id] = particao
+            self.contagem["sincronizacoes"] += 1
+            self.contagem["vetores_baixados"] += len(novos)
+        return particao
+
+    def _sincronizar_em_segundo_plano(self, empresa_id):
+        with self._lock:
+            if empresa_id in self._em_sync:
+                return
+            self._em_sync.add(empresa_id)
+
+        def tarefa():
+            try:
+                with self._lock_empresa(empresa_id):
+                    self.sincronizar(empresa_id)
+            except Exception as e:
+                print(f"Falha ao sincronizar a busca local da empresa {empresa_id}: {e}")
+            finally:
+                with self._lock:
+                    self._em_sync.discard(empresa_id)
+
+        self._executor.submit(tarefa)
+
+    def particao(self, empresa_id):
+        particao = self.particoes.get(empresa_id)
+        if particao is None:
+            with self._lock_empresa(empresa_id):
+                particao = self.particoes.get(empresa_id)
+                if particao is None:
+                    particao = self._carregar_do_disco(empresa_id)
+                    if particao is not None:
+                        with self._lock:
+                            self.particoes[empresa_id] = particao
+                    else:
+                        particao = self.sincronizar(empresa_id)  # primeira carga: bloqueia esta consulta
+        if time.monotonic() - particao.sincronizada_em >= self.intervalo_sync:
+            # a consulta usa a partição atual; a atualização fica para a próxima
+            self._sincronizar_em_segundo_plano(empresa_id)
+        return particao
+
+    def buscar(self, empresa_id, vetor, k):
+        """Top-k receitas da empresa por cosseno, no formato do pipeline do Atlas (campos da receita + score)."""
+        with self._lock:
+            self.contagem["buscas"] += 1
+            self.dimensao = len(vetor)
+        particao = self.particao(empresa_id)
+        if not particao.compativel(vetor) and time.monotonic() - particao.sincronizada_em >= self.intervalo_sync:
+            # consulta de outro modelo que a partição (ex.: receitas reindexadas): ressincroniza antes de desistir
+            with self._lock_empresa(empresa_id):
+                particao = self.sincronizar(empresa_id)
+        if not particao.compativel(vetor):
+            print(f"Busca local da empresa {empresa_id}: consulta com {len(vetor)} dimensões, partição com {particao.matriz.shape[1]}; sem resultados.")
+            return []
+        return particao.buscar(vetor, k)
+
+    def stats(self):
+        return {
+            **self.contagem,
+            "empresas": len(self.particoes),
+            "vetores": sum(len(p) for p in self.particoes.values()),
+            "ivf": sum(1 for p in self.particoes.values() if p.ivf is not None),
+        }
+
+
+_indice = None
+_indice_lock = threading.Lock()
+
+
+def get_indice_local() -> IndiceReceitasLocal:
+    # Um índice por processo; a thread de sincronização não sobrevive a fork
+    global _indice
+    if _indice is None or _indice.pid != os.getpid():
+        with _indice_lock:
+            if _indice is None or _indice.pid != os.getpid():
+                _indice = IndiceReceitasLocal()
+    return _indice
+
+
+def _reset_apos_fork():
+    global _indice, _indice_lock
+    _indice_lock = threading.Lock()
+    _indice = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_apos_fork)
+
+
+def indice_local_stats() -> dict:
+    if _indice is None or _indice.pid != os.getpid():
+        return {}
+    return _indice.stats()
@@ -9,14 +9,28 @@ from langchain_core.prompts import (
 from datetime import datetime
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.runnables.history import RunnableWithMessageHistory
-from langchain_community.chat_message_histories import ChatMessageHistory
+from langchain_core.runnables import RunnableLambda, RunnablePassthrough
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import HumanMessage, AIMessage
 from langchain.agents import create_tool_calling_agent, AgentExecutor
 import os
+import asyncio
 from dotenv import load_dotenv
 from pytz import timezone
-from mongo_tools import RECEITAS_TOOLS
+from mongo_tools import RECEITAS_TOOLS, memo_receitas_stats
 from pg_tools import TAREFAS_TOOLS
-from flask import Flask, request, jsonify
+from pg_pool import pool_stats
+from referencias import referencias_stats
+from ann_receitas import indice_local_stats
+from cache_respostas import get_cache_respostas, respostas_stats, RESPOSTAS_CACHE
+from especulacao import PreBusca, ESPECULACAO_RECEITAS, SEM_CANDIDATAS
+from historico import criar_store_historico, session_id_da_requisicao, GerenciadorHistorico
+from embeddings import get_embedding_cache
+from roteamento import ClassificadorIntencao, montar_encaminhamento, rota_da_resposta, ROTEADOR_LOCAL
+from orquestrador import renderizar_resposta, texto_saida, ExtratorResposta, ORQUESTRADOR_LOCAL
+from prompt_cache import PrefixoEstatico, uso_tokens
+from telemetria import medir, medido, metricas, TelemetriaAgente, CONTENT_TYPE_METRICAS
+from flask import Flask, request, jsonify, Response
 from flask_cors import CORS
 
 load_dotenv()
@@ -24,17 +38,14 @@ load_dotenv()
 app = Flask(__name__)
 CORS(app)
 
-# Dicionário para armazenar o histórico de mensgens
-store = {}
+# Histórico de mensagens por sessão: LRU limitado em memória ou Redis compartilhado (HISTORICO_BACKEND)
+store = criar_store_historico()
 
-def get_session_history(session_id) -> ChatMessageHistory:
+def get_session_history(session_id) -> BaseChatMessageHistory:
     # Função que retorna o histórico de uma sessão específica.
-    if session_id not in store:
-        store[session_id] = ChatMessageHistory()
-    return store[session_id]
+    return store.get(session_id)
 
 TZ = timezone("America/Sao_Paulo")
-today = datetime.now(TZ).date()
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 
 llm = ChatGoogleGenerativeAI(
@@ -50,6 +61,35 @@ llm_fast = ChatGoogleGenerativeAI(
     api_key=GEMINI_API_KEY
 )
 
+# Resumo acumulado das mensagens que saem da janela de histórico (gerado em segundo plano)
+prompt_resumo = ChatPromptTemplate.from_messages([
+    ("system", "Atualize o resumo de uma conversa entre um gestor de cozinha e o ChefIA. Escreva no máximo 5 frases, mantendo nomes de pessoas, receitas, ingredientes, datas e tarefas citadas. Responda apenas com o resumo."),
+    ("human", "RESUMO ATUAL:\n{resumo}\n\nNOVAS MENSAGENS:\n{mensagens}"),
+])
+resumo_chain = (prompt_resumo | llm_fast | StrOutputParser()).with_config(callbacks=[uso_tokens.para("resumo"), TelemetriaAgente("resumo")])
+
+def resumir_historico(resumo, mensagens):
+    texto = "\n".join(f"{'Gestor' if m.type == 'human' else 'ChefIA'}: {texto_saida(m.content)}" for m in mensagens)
+    return resumo_chain.invoke({"resumo": resumo or "(vazio)", "mensagens": texto})
+
+# Cada etapa recebe só a sua janela do histórico (HISTORICO_JANELAS) + o resumo do que ficou fora dela
+gerenciador_historico = GerenciadorHistorico(store, resumidor=resumir_historico)
+
+def historico_da_etapa(etapa):
+    return lambda session_id: gerenciador_historico.historico(session_id, etapa)
+
+def resumo_da_sessao(_, config):
+    return gerenciador_historico.resumo(config["configurable"]["session_id"])
+
+def hoje(_):
+    # calculada a cada chamada (o processo pode ficar de pé por vários dias)
+    return datetime.now(TZ).date().isoformat()
+
+# Variáveis do sufixo dinâmico dos prompts
+com_contexto = RunnablePassthrough.assign(resumo_historico=RunnableLambda(resumo_da_sessao), today=RunnableLambda(hoje))
+# candidatas da pré-busca especulativa (ESPECULACAO_RECEITAS), quando houver
+com_candidatas = RunnablePassthrough.assign(candidatas=lambda x: x.get("candidatas") or SEM_CANDIDATAS)
+
 # prompt do agente roteador
 system_prompt_roteador = ("system",
     """
@@ -59,7 +99,7 @@ system_prompt_roteador = ("system",
     - Evite ser prolixo.
     - Não invente dados.
     - Respostas não precisam ser necessariamente curtas, mas procure não falar demais.
-    - Hoje é {today} (America/Sao_Paulo). Interprete datas relativas a partir desta data.
+    - Interprete datas relativas a partir da data de hoje informada no CONTEXTO.
 
 
     ### PAPEL
@@ -93,13 +133,9 @@ system_prompt_roteador = ("system",
     - Encaminhamento ao especialista usando exatamente o protocolo acima.
 
 
-    ### HISTÓRICO DA CONVERSA
-    {chat_history}
-
-
     ### CONTEXTO
-    - ID da empresa: {empresa_id}
-    - 
+    - Cada mensagem do usuário chega com um bloco CONTEXTO (data de hoje, ID da empresa e resumo da conversa anterior) seguido da MENSAGEM.
+    - Responda apenas à MENSAGEM; em PERGUNTA_ORIGINAL copie somente o texto da MENSAGEM.
     """
 )
 
@@ -141,6 +177,9 @@ fewshots_roteador = FewShotChatMessagePromptTemplate(
     example_prompt=example_prompt_base
 )
 
+# Pré-roteador local: decide as rotas óbvias sem chamar o roteador LLM (ver roteamento.py)
+classificador_rota = ClassificadorIntencao.from_shots(shots_roteador)
+
 # -------------------
 # - PROMPTS ESPECIALISTAS --------------------
 system_prompt_receitas = ("system",
@@ -157,19 +196,21 @@ system_prompt_receitas = ("system",
 
 
     ### CONTEXTO
-    - Hoje é {today} (America/Sao_Paulo). Interprete datas relativas a partir desta data.
-    - Entrada vem do Roteador via protocolo:
+    - Cada mensagem chega com um bloco CONTEXTO (data de hoje, ID da empresa e resumo da conversa anterior) seguido da MENSAGEM. Interprete datas relativas a partir da data de hoje.
+    - A MENSAGEM vem do Roteador via protocolo:
     - ROUTE=especialista
     - PERGUNTA_ORIGINAL=...
     - PERSONA=...   (use como diretriz de concisão/objetividade)
     - CLARIFY=...   (se preenchido, priorize responder esta dúvida antes de prosseguir)
-    - ID da empresa: {empresa_id}
 
     
     ### REGRAS
-    - Use o {chat_history} para resolver referências ao contexto recente.
+    - Use o histórico da conversa e o resumo da conversa anterior para resolver referências ao contexto recente.
     - Todas as queries ao MongoDB devem ter como filtro obrigatório o ID da empresa.
     - Ao invocar ferramentas de consulta, SEMPRE utilize os valores de 'empresa_id' fornecidos no contexto para filtrar os dados.
+    - query_receitas retorna só um resumo de cada receita (sem o modo de preparo). Para o passo a passo ou os detalhes de uma receita, chame detalhar_receita com o nome exato retornado.
+    - Não repita query_receitas com os mesmos termos no mesmo turno; os resultados anteriores continuam válidos.
+    - O CONTEXTO pode trazer receitas candidatas, buscadas com a mensagem inteira do usuário (mesmo formato de query_receitas). Se elas respondem à pergunta, use-as sem chamar query_receitas; se não, consulte normalmente.
 
 
     ### SAÍDA (JSON)
@@ -183,10 +224,6 @@ system_prompt_receitas = ("system",
     - acompanhamento : texto curto de follow-up/próximo passo
     - esclarecer     : pergunta mínima de clarificação (usar OU 'acompanhamento')
     - indicadores    : {{chaves livres e numéricas úteis ao log}}
-
-
-    ### HISTÓRICO DA CONVERSA
-    {chat_history}                                
     """
 )
 
@@ -233,22 +270,23 @@ system_prompt_tarefas = ("system",
 
 
     ### CONTEXTO
-    - Hoje é {today} (America/Sao_Paulo). Interprete datas relativas a partir desta data.
-    - Entrada do Roteador:
+    - Cada mensagem chega com um bloco CONTEXTO (data de hoje, ID da empresa, ID do gestor e resumo da conversa anterior) seguido da MENSAGEM. Interprete datas relativas a partir da data de hoje.
+    - A MENSAGEM vem do Roteador:
     - ROUTE=tarefas
     - PERGUNTA_ORIGINAL=...
     - PERSONA=...   (use como diretriz de concisão/objetividade)
     - CLARIFY=...   (se preenchido, responda primeiro)
-    - ID da empresa: {empresa_id}
-    - ID do gestor: {gestor_id}
 
 
     ### REGRAS
-    - Use o {chat_history} para resolver referências ao contexto recente.
+    - Use o histórico da conversa e o resumo da conversa anterior para resolver referências ao contexto recente.
     - Todas as queries feitas no PostgreSQL devem ter como filtro obrigatório o ID da empresa.
     - Ao invocar ferramentas de consulta, SEMPRE utilize os valor de 'empresa_id' fornecido no contexto para filtrar os dados.
     - No JSON de resposta, apenas use como 'intencao' as opções mencionadas.
     - Em hipótese NENHUMA pergunte pelo nome da tarefa. A tarefa NÃO tem nome.
+    - Se uma tool retornar status "ambiguo", não escolha por conta própria: use 'esclarecer' para perguntar qual dos candidatos (pelo nome) o usuário quis dizer.
+    - Para criar várias tarefas de uma vez (vários responsáveis, várias datas, vários ingredientes ou repetição como "toda segunda do mês"), faça UMA única chamada a 'add_tarefas_lote' em vez de repetir 'add_tarefa'.
+    - Para perguntas sobre tarefas existentes (quantas, quais, de quem, para quando), use 'consultar_tarefas' e responda a partir do 'resumo'; só peça a 'proxima_pagina' se o usuário quiser ver mais tarefas.
 
     ### SAÍDA (JSON)
     # Obrigatórios:
@@ -260,10 +298,6 @@ system_prompt_tarefas = ("system",
      - acompanhamento : texto curto de follow-up/próximo passo
      - esclarecer     : pergunta mínima de clarificação
      - janela_tempo   : {{"de":"YYYY-MM-DD","ate":"YYYY-MM-DD","rotulo":"ex.: semana que vem"}}
-
-
-     ### HISTÓRICO DA CONVERSA
-    {chat_history}
     """
 )
 
@@ -303,7 +337,8 @@ system_prompt_orquestrador = ("system",
 
 
     ### ENTRADA
-    - ESPECIALISTA_JSON contendo chaves como: dominio, intencao, resposta, recomendacao, acompanhamento (opcional), esclarecer (opcional), indicadores (opcional)
+    - Bloco CONTEXTO com o resumo da conversa anterior, seguido da MENSAGEM.
+    - MENSAGEM: ESPECIALISTA_JSON contendo chaves como: dominio, intencao, resposta, recomendacao, acompanhamento (opcional), esclarecer (opcional), indicadores (opcional)
 
 
     ### REGRAS
@@ -320,10 +355,6 @@ system_prompt_orquestrador = ("system",
     <ação prática e imediata>     # omita esta seção se não houver recomendação
     - *Acompanhamento* (opcional):
     <pergunta/mini próximo passo>  # omita se nada for necessário
-
-
-    ### HISTÓRICO DA CONVERSA
-    {chat_history}
 """
 )
 
@@ -352,35 +383,43 @@ fewshots_orquestrador = FewShotChatMessagePromptTemplate(
     example_prompt=example_prompt_base,
 )
 
+# Prefixos estáticos (system prompt + few-shots) renderizados uma vez: enviados idênticos em toda chamada,
+# o que permite o cache de contexto do Gemini (ver prompt_cache.py). O que muda a cada chamada vai no sufixo.
+prefixo_roteador = PrefixoEstatico("roteador", system_prompt_roteador, fewshots_roteador)
+prefixo_receitas = PrefixoEstatico("receitas", system_prompt_receitas, fewshots_receitas)
+prefixo_tarefas = PrefixoEstatico("tarefas", system_prompt_tarefas, fewshots_tarefas)
+prefixo_orquestrador = PrefixoEstatico("orquestrador", system_prompt_orquestrador, fewshots_orquestrador)
+
+CONTEXTO_RESUMO = "- Resumo da conversa anterior: {resumo_historico}\n"
+CONTEXTO_DATA = "- Hoje é {today} (America/Sao_Paulo).\n"
+CONTEXTO_CANDIDATAS = "- Receitas candidatas: {candidatas}\n"
+MENSAGEM = "\n### MENSAGEM\n{input}"
+
 prompt_roteador = ChatPromptTemplate.from_messages([
-    system_prompt_roteador,                 # system prompt
-    fewshots_roteador,                      # Shots human/ai 
+    *prefixo_roteador.mensagens,            # system prompt + shots human/ai (fixos)
     MessagesPlaceholder("chat_history"),    # memória
-    ("human", "{input}"),                   # user prompt
-]).partial(today=today.isoformat(), empresa_id="{empresa_id}", gestor_id="{gestor_id}")   # Com partial(), você injeta valores fixos que ficam pré-preenchidos no template.
+    ("human", "### CONTEXTO\n" + CONTEXTO_DATA + "- ID da empresa: {empresa_id}\n" + CONTEXTO_RESUMO + MENSAGEM),   # user prompt
+])
 
 prompt_orquestrador = ChatPromptTemplate.from_messages([
-    system_prompt_orquestrador,             # system prompt
-    fewshots_orquestrador,                  # Shots human/ai 
+    *prefixo_orquestrador.mensagens,        # system prompt + shots human/ai (fixos)
     MessagesPlaceholder("chat_history"),    # memória
-    ("human", "{input}"),                   # user prompt
-]).partial(today=today.isoformat())   # Com partial(), você injeta valores fixos que ficam pré-preenchidos no template.
+    ("human", "### CONTEXTO\n" + CONTEXTO_RESUMO + MENSAGEM),   # user prompt
+])
 
 prompt_receitas = ChatPromptTemplate.from_messages([
-    system_prompt_receitas,                 # system prompt
-    fewshots_receitas,                      # Shots human/ai 
+    *prefixo_receitas.mensagens,            # system prompt + shots human/ai (fixos)
     MessagesPlaceholder("chat_history"),    # memória
-    ("human", "{input}"),                   # user prompt
+    ("human", "### CONTEXTO\n" + CONTEXTO_DATA + "- ID da empresa: {empresa_id}\n" + CONTEXTO_RESUMO + CONTEXTO_CANDIDATAS + MENSAGEM),   # user prompt
     MessagesPlaceholder("agent_scratchpad") # espaço reservado para pensamentos internos do LLM (chain of thought)
-]).partial(today=today.isoformat(), empresa_id="{empresa_id}")   # Com partial(), você injeta valores fixos que ficam pré-preenchidos no template.
+])
 
 prompt_tarefas = ChatPromptTemplate.from_messages([
-    system_prompt_tarefas,                  # system prompt
-    fewshots_tarefas,                       # Shots human/ai 
+    *prefixo_tarefas.mensagens,             # system prompt + shots human/ai (fixos)
     MessagesPlaceholder("chat_history"),    # memória
-    ("human", "{input}"),                   # user prompt
+    ("human", "### CONTEXTO\n" + CONTEXTO_DATA + "- ID da empresa: {empresa_id}\n- ID do gestor: {gestor_id}\n" + CONTEXTO_RESUMO + MENSAGEM),   # user prompt
     MessagesPlaceholder("agent_scratchpad") # espaço reservado para pensamentos internos do LLM (chain of thought)
-]).partial(today=today.isoformat(), empresa_id="{empresa_id}", gestor_id="{empresa_id}")   # Com partial(), você injeta valores fixos que ficam pré-preenchidos no template.
+])
 
 # Instanciamento de agentes COM acesso A TOOLS
 receitas_agent = create_tool_calling_agent(llm, RECEITAS_TOOLS, prompt_receitas)
@@ -392,80 +431,233 @@ receitas_executor_base = AgentExecutor(
     return_intermediate_steps=False
 )
 receitas_executor = RunnableWithMessageHistory(
-    receitas_executor_base,
-    get_session_history=get_session_history,
+    (com_contexto | com_candidatas | receitas_executor_base).with_config(callbacks=[uso_tokens.para("receitas"), TelemetriaAgente("receitas")]),
+    get_session_history=historico_da_etapa("receitas"),
     input_messages_key='input',
     history_messages_key='chat_history'
 )
 
 tarefas_agent = create_tool_calling_agent(llm, TAREFAS_TOOLS, prompt_tarefas)
-tarefas_executor_base = AgentExecutor(agent=tarefas_agent, tools=TAREFAS_TOOLS, verbose=True, handle_parsing_errors=True, return_intermediate_steps=False)
+tarefas_executor_base = AgentExecutor(agent=tarefas_agent, tools=TAREFAS_TOOLS, verbose=False, handle_parsing_errors=True, return_intermediate_steps=False)
 tarefas_executor = RunnableWithMessageHistory(
-    tarefas_executor_base,
-    get_session_history=get_session_history,
+    (com_contexto | tarefas_executor_base).with_config(callbacks=[uso_tokens.para("tarefas"), TelemetriaAgente("tarefas")]),
+    get_session_history=historico_da_etapa("tarefas"),
     input_messages_key='input',
     history_messages_key='chat_history'
 )
 
 # Instanciamento de agentes SEM acesso A TOOLS
 roteador_chain = RunnableWithMessageHistory(
-    prompt_roteador | llm_fast | StrOutputParser(),
-    get_session_history=get_session_history,
+    (com_contexto | prompt_roteador | prefixo_roteador.llm(llm_fast) | StrOutputParser()).with_config(callbacks=[uso_tokens.para("roteador"), TelemetriaAgente("roteador")]),
+    get_session_history=historico_da_etapa("roteador"),
     input_messages_key="input",
     history_messages_key="chat_history"
 )
 
 orquestrador_chain = RunnableWithMessageHistory(
-    prompt_orquestrador | llm_fast | StrOutputParser(),
-    get_session_history=get_session_history,
+    (com_contexto | prompt_orquestrador | prefixo_orquestrador.llm(llm_fast) | StrOutputParser()).with_config(callbacks=[uso_tokens.para("orquestrador"), TelemetriaAgente("orquestrador")]),
+    get_session_history=historico_da_etapa("orquestrador"),
     input_messages_key="input",
     history_messages_key="chat_history"
 )
 
-def executar_fluxo_chefia(pergunta_usuario, session_id, empresa_id, gestor_id):
-    resp_roteador = roteador_chain.invoke(
-            {
-                "input": pergunta_usuario,
-                "empresa_id": empresa_id,
-                "gestor_id": gestor_id
-            },
+def classificar_rota(session_id, pergunta_usuario):
+    # Pré-roteador local; com conversa em andamento, só cortesias são decididas sem o roteador LLM
+    return classificador_rota.classificar(pergunta_usuario, com_historico=gerenciador_historico.tem_historico(session_id))
+
+def registrar_no_historico(session_id, entrada, saida, etapa="orquestrador"):
+    # Para etapas resolvidas sem LLM: mantém no histórico o mesmo par que a chain registraria
+    gerenciador_historico.historico(session_id, etapa).add_messages(
+        [HumanMessage(content=entrada), AIMessage(content=saida)]
+    )
+
+def registrar_roteamento(session_id, pergunta_usuario, resp_roteador):
+    # Decisão do pré-roteador (ou do cache): a mensagem do usuário entra como entrada do roteador e abre o turno
+    registrar_no_historico(session_id, pergunta_usuario, resp_roteador, etapa="roteador")
+
+def responder_do_cache(session_id, pergunta_usuario, acerto):
+    # Resposta reaproveitada do cache semântico: registra nos históricos o que roteador, especialista e orquestrador registrariam
+    encaminhamento = montar_encaminhamento("receitas", pergunta_usuario)
+    registrar_roteamento(session_id, pergunta_usuario, encaminhamento)
+    registrar_no_historico(session_id, encaminhamento, texto_saida(acerto["especialista"]), etapa="receitas")
+    registrar_no_historico(session_id, texto_saida(acerto["especialista"]), acerto["resposta"])
+    return acerto["resposta"]
+
+def registrar_decisao(span, decisao):
+    # Origem e rota da decisão no span do pré-roteador (a mensagem em si não vai para a telemetria)
+    span.set_attribute("origem", decisao.origem if decisao else "llm")
+    span.set_attribute("rota", (decisao.rota or ("resposta" if decisao.resposta else "llm")) if decisao else "llm")
+
+def consultar_cache(session_id, decisao):
+    # Só perguntas que podem ser de receitas; saudações e rotas de tarefas nem geram consulta. Com conversa em
+    # andamento a pergunta pode depender do contexto ("e com frango?") e a resposta não serve a outra sessão:
+    # nem consulta nem grava. Vale para o turno todo, então é decidido antes de ele entrar no histórico.
+    return (RESPOSTAS_CACHE and not (decisao and (decisao.resposta or decisao.rota == "tarefas"))
+            and not gerenciador_historico.tem_historico(session_id))
+
+def especular(decisao):
+    # Pré-busca de receitas em paralelo ao roteador LLM (ou já certa, se o pré-roteador decidiu receitas)
+    return ESPECULACAO_RECEITAS and not (decisao and (decisao.resposta or decisao.rota == "tarefas"))
+
+@medido("orquestrador")
+def orquestrar(saida_especialista, session_id):
+    # Formata o JSON do especialista localmente; o orquestrador LLM só entra se o JSON vier malformado
+    resposta = renderizar_resposta(saida_especialista) if ORQUESTRADOR_LOCAL else None
+    if resposta is None:
+        return orquestrador_chain.invoke(
+            {"input": saida_especialista},
             config={'configurable': {'session_id': session_id}} # Aqui, entraria o ID do usuário e histórico.
         )
-    print(f"Roteador: {resp_roteador}")
-    
+
+    registrar_no_historico(session_id, texto_saida(saida_especialista), resposta)
+    return resposta
+
+@medido("requisicao")
+def executar_fluxo_chefia(pergunta_usuario, session_id, empresa_id, gestor_id):
+    with medir("pre_roteador") as span:
+        decisao = classificar_rota(session_id, pergunta_usuario) if ROTEADOR_LOCAL else None
+        registrar_decisao(span, decisao)
+
+    if decisao and decisao.resposta:
+        # Saudação respondida localmente, sem passar pelo roteador LLM
+        registrar_roteamento(session_id, pergunta_usuario, decisao.resposta)
+        return decisao.resposta
+
+    usar_cache = consultar_cache(session_id, decisao)
+    if usar_cache:
+        with medir("cache_respostas"):
+            acerto = get_cache_respostas().buscar(empresa_id, pergunta_usuario)
+        if acerto:
+            return responder_do_cache(session_id, pergunta_usuario, acerto)
+
+    pre_busca = PreBusca.iniciar(empresa_id, pergunta_usuario) if especular(decisao) else None
+    try:
+        if decisao and decisao.rota:
+            resp_roteador = montar_encaminhamento(decisao.rota, pergunta_usuario)
+            registrar_roteamento(session_id, pergunta_usuario, resp_roteador)
+        else:
+            with medir("roteador") as span:
+                resp_roteador = roteador_chain.invoke(
+                        {
+                            "input": pergunta_usuario,
+                            "empresa_id": empresa_id,
+                            "gestor_id": gestor_id
+                        },
+                        config={'configurable': {'session_id': session_id}} # Aqui, entraria o ID do usuário e histórico.
+                    )
+                span.set_attribute("rota", rota_da_resposta(resp_roteador))
+            classificador_rota.registrar(pergunta_usuario, resp_roteador)
+        if pre_busca and "ROUTE=receitas" not in resp_roteador:
+            pre_busca.descartar()
+        candidatas = pre_busca.usar() if pre_busca and "ROUTE=receitas" in resp_roteador else None
+    finally:
+        # roteador com erro: a pré-busca também precisa de um desfecho (no-op se já foi usada ou descartada)
+        if pre_busca:
+            pre_busca.descartar()
+
     if "ROUTE=" not in resp_roteador:
         return resp_roteador
     elif "ROUTE=receitas" in resp_roteador:
-        resp_receitas = receitas_executor.invoke(
-            {
-                "input": resp_roteador,
-                "empresa_id": empresa_id
-            },
-            config={'configurable': {'session_id': session_id}} # Aqui, entraria o ID do usuário e histórico.
-        )
-
-        resp_orquestrador = orquestrador_chain.invoke(
-            {"input": resp_receitas["output"]},
-            config={'configurable': {'session_id': session_id}} # Aqui, entraria o ID do usuário e histórico.
-        )
-
-        return resp_orquestrador
+        with medir("receitas"):
+            resp_receitas = receitas_executor.invoke(
+                {
+                    "input": resp_roteador,
+                    "empresa_id": empresa_id,
+                    "candidatas": candidatas
+                },
+                config={'configurable': {'session_id': session_id}} # Aqui, entraria o ID do usuário e histórico.
+            )
+
+        resposta = orquestrar(resp_receitas["output"], session_id)
+        if usar_cache:
+            get_cache_respostas().guardar(empresa_id, pergunta_usuario, resp_receitas["output"], resposta)
+        return resposta
     elif "ROUTE=tarefas" in resp_roteador:
-        resp_tarefas = tarefas_executor.invoke(
-            {
-                "input": resp_roteador,
-                "empresa_id": empresa_id,
-                "gestor_id": gestor_id
-            },
-            config={'configurable': {'session_id': session_id}} # Aqui, entraria o ID do usuário e histórico.
+        with medir("tarefas"):
+            resp_tarefas = tarefas_executor.invoke(
+                {
+                    "input": resp_roteador,
+                    "empresa_id": empresa_id,
+                    "gestor_id": gestor_id
+                },
+                config={'configurable': {'session_id': session_id}} # Aqui, entraria o ID do usuário e histórico.
+            )
+
+        return orquestrar(resp_tarefas["output"], session_id)
+
+# Versões async do fluxo (modo ASGI, ver asgi.py): usam ainvoke nas chains/agentes, então um único
+# processo atende várias conversas enquanto espera Gemini, Hugging Face, Mongo e Postgres.
+# Tools sem coroutine própria (pg_tools) são executadas em threads pelo próprio LangChain.
+@medido("orquestrador")
+async def aorquestrar(saida_especialista, session_id):
+    resposta = renderizar_resposta(saida_especialista) if ORQUESTRADOR_LOCAL else None
+    if resposta is None:
+        return await orquestrador_chain.ainvoke(
+            {"input": saida_especialista},
+            config={'configurable': {'session_id': session_id}}
         )
 
-        resp_orquestrador = orquestrador_chain.invoke(
-            {"input": resp_tarefas["output"]},
-            config={'configurable': {'session_id': session_id}} # Aqui, entraria o ID do usuário e histórico.
-        )
+    registrar_no_historico(session_id, texto_saida(saida_especialista), resposta)
+    return resposta
+
+@medido("requisicao")
+async def executar_fluxo_chefia_async(pergunta_usuario, session_id, empresa_id, gestor_id):
+    # o pré-roteador pode gerar embedding (HTTP síncrono), então roda numa thread
+    with medir("pre_roteador") as span:
+        decisao = await asyncio.to_thread(classificar_rota, session_id, pergunta_usuario) if ROTEADOR_LOCAL else None
+        registrar_decisao(span, decisao)
+
+    if decisao and decisao.resposta:
+        registrar_roteamento(session_id, pergunta_usuario, decisao.resposta)
+        return decisao.resposta
+
+    usar_cache = consultar_cache(session_id, decisao)
+    if usar_cache:
+        with medir("cache_respostas"):
+            acerto = await get_cache_respostas().abuscar(empresa_id, pergunta_usuario)
+        if acerto:
+            return responder_do_cache(session_id, pergunta_usuario, acerto)
+
+    config = {'configurable': {'session_id': session_id}}
+    pre_busca = PreBusca.ainiciar(empresa_id, pergunta_usuario) if especular(decisao) else None
+    try:
+        if decisao and decisao.rota:
+            resp_roteador = montar_encaminhamento(decisao.rota, pergunta_usuario)
+            registrar_roteamento(session_id, pergunta_usuario, resp_roteador)
+        else:
+            with medir("roteador") as span:
+                resp_roteador = await roteador_chain.ainvoke(
+                    {"input": pergunta_usuario, "empresa_id": empresa_id, "gestor_id": gestor_id},
+                    config=config
+                )
+                span.set_attribute("rota", rota_da_resposta(resp_roteador))
+            classificador_rota.registrar(pergunta_usuario, resp_roteador)
+        if pre_busca and "ROUTE=receitas" not in resp_roteador:
+            pre_busca.descartar()
+        candidatas = await pre_busca.ausar() if pre_busca and "ROUTE=receitas" in resp_roteador else None
+    finally:
+        if pre_busca:
+            pre_busca.descartar()
 
-        return resp_orquestrador
+    if "ROUTE=" not in resp_roteador:
+        return resp_roteador
+    elif "ROUTE=receitas" in resp_roteador:
+        with medir("receitas"):
+            resp_receitas = await receitas_executor.ainvoke(
+                {"input": resp_roteador, "empresa_id": empresa_id, "candidatas": candidatas},
+                config=config
+            )
+        resposta = await aorquestrar(resp_receitas["output"], session_id)
+        if usar_cache:
+            get_cache_respostas().guardar(empresa_id, pergunta_usuario, resp_receitas["output"], resposta)
+        return resposta
+    elif "ROUTE=tarefas" in resp_roteador:
+        with medir("tarefas"):
+            resp_tarefas = await tarefas_executor.ainvoke(
+                {"input": resp_roteador, "empresa_id": empresa_id, "gestor_id": gestor_id},
+                config=config
+            )
+        return await aorquestrar(resp_tarefas["output"], session_id)
 
 @app.route("/chat", methods=["POST"])
 def chat():
@@ -484,7 +676,7 @@ def chat():
     try:
         resposta = executar_fluxo_chefia(
             pergunta_usuario=user_message,
-            session_id="",
+            session_id=session_id_da_requisicao(data),
             empresa_id=empresa_id,
             gestor_id=gestor_id
         )
@@ -494,12 +686,184 @@ def chat():
         print(f"Erro no fluxo: {e}")
         return jsonify({"status": "error", "resposta": "Erro ao processar a solicitação."}), 500
 
+async def executar_fluxo_chefia_stream(pergunta_usuario, session_id, empresa_id, gestor_id):
+    """
+    Versão em streaming do fluxo (SSE em /chat/stream): gera eventos (nome, dados) assim que acontecem
+    (rota decidida, tool iniciada/finalizada) e os trechos da resposta final à medida que o LLM os gera.
+    O evento "fim" traz sempre a resposta completa, que prevalece sobre os trechos já enviados.
+    """
+    with medir("pre_roteador") as span:
+        decisao = await asyncio.to_thread(classificar_rota, session_id, pergunta_usuario) if ROTEADOR_LOCAL else None
+        registrar_decisao(span, decisao)
+    origem = decisao.origem if decisao else "llm"
+
+    if decisao and decisao.resposta:
+        registrar_roteamento(session_id, pergunta_usuario, decisao.resposta)
+        yield "rota", {"rota": None, "origem": origem}
+        yield "token", {"texto": decisao.resposta}
+        yield "fim", {"resposta": decisao.resposta}
+        return
+
+    usar_cache = consultar_cache(session_id, decisao)
+    if usar_cache:
+        with medir("cache_respostas", contexto=False):
+            acerto = await get_cache_respostas().abuscar(empresa_id, pergunta_usuario)
+        if acerto:
+            resposta = responder_do_cache(session_id, pergunta_usuario, acerto)
+            yield "rota", {"rota": "receitas", "origem": "cache"}
+            yield "token", {"texto": resposta}
+            yield "fim", {"resposta": resposta}
+            return
+
+    config = {'configurable': {'session_id': session_id}}
+    pre_busca = PreBusca.ainiciar(empresa_id, pergunta_usuario) if especular(decisao) else None
+    try:
+        if decisao and decisao.rota:
+            resp_roteador = montar_encaminhamento(decisao.rota, pergunta_usuario)
+            registrar_roteamento(session_id, pergunta_usuario, resp_roteador)
+        else:
+            # A resposta do roteador só é transmitida quando não é um encaminhamento (ROUTE=...)
+            partes, transmitindo = [], False
+            with medir("roteador", contexto=False) as span:
+                async for trecho in roteador_chain.astream(
+                    {"input": pergunta_usuario, "empresa_id": empresa_id, "gestor_id": gestor_id},
+                    config=config
+                ):
+                    partes.append(trecho)
+                    if transmitindo:
+                        yield "token", {"texto": trecho}
+                        continue
+                    inicio = "".join(partes).lstrip()
+                    if len(inicio) >= len("ROUTE=") and not inicio.startswith("ROUTE="):
+                        transmitindo = True
+                        yield "token", {"texto": inicio}
+                resp_roteador = "".join(partes)
+                span.set_attribute("rota", rota_da_resposta(resp_roteador))
+            classificador_rota.registrar(pergunta_usuario, resp_roteador)
+
+            if "ROUTE=" not in resp_roteador:
+                if pre_busca:
+                    pre_busca.descartar()
+                yield "rota", {"rota": None, "origem": origem}
+                if not transmitindo:
+                    yield "token", {"texto": resp_roteador}
+                yield "fim", {"resposta": resp_roteador}
+                return
+
+        rota = rota_da_resposta(resp_roteador)
+        if pre_busca and rota != "receitas":
+            pre_busca.descartar()
+        yield "rota", {"rota": rota, "origem": origem}
+        candidatas = await pre_busca.ausar() if pre_busca and rota == "receitas" else None
+    finally:
+        # erro no roteador ou cliente desconectado durante o streaming: a pré-busca não fica sem desfecho
+        if pre_busca:
+            pre_busca.descartar()
+    if rota == "receitas":
+        executor, entrada = receitas_executor, {"input": resp_roteador, "empresa_id": empresa_id, "candidatas": candidatas}
+    else:
+        executor, entrada = tarefas_executor, {"input": resp_roteador, "empresa_id": empresa_id, "gestor_id": gestor_id}
+
+    # Com o orquestrador local, a 1ª linha da resposta final é o campo "resposta" do JSON do especialista,
+    # então ele é transmitido enquanto o especialista ainda está gerando.
+    extrator = ExtratorResposta()
+    saida = None
+    with medir(rota, contexto=False):
+        async for evento in executor.astream_events(entrada, config=config, version="v2"):
+            tipo = evento["event"]
+            if tipo == "on_tool_start":
+                yield "tool_inicio", {"tool": evento["name"], "args": evento["data"].get("input")}
+            elif tipo == "on_tool_end":
+                yield "tool_fim", {"tool": evento["name"]}
+            elif tipo == "on_chat_model_stream" and ORQUESTRADOR_LOCAL:
+                trecho = extrator.feed(texto_saida(evento["data"]["chunk"].content))
+                if trecho:
+                    yield "token", {"texto": trecho}
+            elif tipo == "on_chain_end" and not evento.get("parent_ids"):
+                saida = evento["data"]["output"]["output"]
+
+    with medir("orquestrador", contexto=False):
+        resposta = renderizar_resposta(saida) if ORQUESTRADOR_LOCAL else None
+        if resposta is not None:
+            registrar_no_historico(session_id, texto_saida(saida), resposta)
+            if resposta.startswith(extrator.texto):
+                yield "token", {"texto": resposta[len(extrator.texto):]}
+            else:
+                yield "reinicio", {}
+                yield "token", {"texto": resposta}
+        else:
+            # O extrator pode já ter transmitido o campo "resposta" antes de o JSON se mostrar malformado: do
+            # orquestrador LLM só vai o que passar desse começo; se ele começar diferente, "reinicio" avisa o
+            # cliente para descartar os trechos recebidos e a resposta é transmitida do início.
+            enviado, partes = extrator.texto, []
+            async for trecho in orquestrador_chain.astream({"input": saida}, config=config):
+                partes.append(trecho)
+                if enviado is None:
+                    yield "token", {"texto": trecho}
+                    continue
+                texto = "".join(partes)
+                if texto.startswith(enviado):
+                    yield "token", {"texto": texto[len(enviado):]}
+                    enviado = None
+                elif not enviado.startswith(texto):
+                    yield "reinicio", {}
+                    yield "token", {"texto": texto}
+                    enviado = None
+            resposta = "".join(partes)
+            if enviado:
+                # terminou antes de alcançar o que já tinha sido transmitido
+                yield "reinicio", {}
+                yield "token", {"texto": resposta}
+
+    if rota == "receitas" and usar_cache:
+        get_cache_respostas().guardar(empresa_id, pergunta_usuario, saida, resposta)
+    yield "fim", {"resposta": resposta}
+
+def status_servico():
+    return {
+        "status": "ok",
+        "timestamp": datetime.now().isoformat(),
+        "postgres_pool": pool_stats(),
+        "referencias": referencias_stats(),
+        "embedding_cache": get_embedding_cache().stats(),
+        "busca_local_receitas": indice_local_stats(),
+        "cache_respostas": respostas_stats(),
+        "memo_receitas": memo_receitas_stats(),
+        "roteador": classificador_rota.stats(),
+        "historico": store.stats(),
+        "prompts": {
+            "prefixos": {p.etapa: p.stats() for p in (prefixo_roteador, prefixo_receitas, prefixo_tarefas, prefixo_orquestrador)},
+            "tokens": uso_tokens.stats()
+        }
+    }
+
+@metricas.coletor
+def metricas_de_cache():
+    # contadores que os caches e o pool já mantêm, lidos a cada scrape
+    amostras = []
+    caches = {"embedding": get_embedding_cache().stats(), "referencias": referencias_stats(), "respostas": respostas_stats(),
+              "query_receitas": memo_receitas_stats()}
+    for cache, stats in caches.items():
+        for resultado, campo in (("acerto", "hits"), ("falha", "misses")):
+            if campo in stats:
+                amostras.append(("chefia_cache_consultas_total", "Consultas aos caches em memória.", "counter",
+                                 {"cache": cache, "resultado": resultado}, stats[campo]))
+    for origem, total in classificador_rota.stats().items():
+        if origem not in ("total", "hit_rate"):
+            amostras.append(("chefia_roteamento_total", "Mensagens por origem da decisão de rota (llm = roteador LLM).", "counter", {"origem": origem}, total))
+    pool = pool_stats()
+    for campo in ("em_uso", "ociosas", "timeouts"):
+        if campo in pool:
+            amostras.append((f"chefia_postgres_pool_{campo}", "Estado do pool de conexões do Postgres.", "gauge", {}, pool[campo]))
+    return amostras
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return Response(metricas.exportar(), mimetype=CONTENT_TYPE_METRICAS)
+
 @app.route("/health", methods=["GET"])
 def health_check():
-    return jsonify({
-        "status": "ok",
-        "timestamp": datetime.now().isoformat()
-    })
+    return jsonify(status_servico())
 
 if __name__ == "__main__":
     app.run(debug=True)
\ No newline at end of file
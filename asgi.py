@@ -0,0 +1,119 @@
+"""
+Modo de execução ASGI com o mesmo contrato de /chat, /health e /metrics do app Flask, mais /chat/stream (SSE).
+
+    uvicorn asgi:app --workers 2
+    gunicorn asgi:app -k uvicorn.workers.UvicornWorker -w 2
+"""
+import json
+import contextlib
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, StreamingResponse, Response
+from starlette.routing import Route
+
+from app import executar_fluxo_chefia_async, executar_fluxo_chefia_stream, status_servico
+from telemetria import metricas, CONTENT_TYPE_METRICAS
+from historico import session_id_da_requisicao
+from embeddings import get_embedder
+from mongo_client import aclose_client
+
+
+async def ler_payload(request):
+    # Retorna (dados, resposta de erro) com as mesmas validações do /chat do Flask
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+
+    if not data:
+        return None, JSONResponse({"error": "Dados não fornecidos ou formato inválido!"}, status_code=400)
+
+    if not data.get("user_message", ""):
+        return None, JSONResponse({"error": "A mensagem do usuário está vazia!"}, status_code=400)
+
+    return data, None
+
+
+async def chat(request):
+    data, erro = await ler_payload(request)
+    if erro:
+        return erro
+
+    user_message = data.get("user_message", "")
+    empresa_id = data.get("empresa_id", "")
+    gestor_id = data.get("gestor_id", "")
+
+    try:
+        resposta = await executar_fluxo_chefia_async(
+            pergunta_usuario=user_message,
+            session_id=session_id_da_requisicao(data),
+            empresa_id=empresa_id,
+            gestor_id=gestor_id
+        )
+        return JSONResponse({"status": "ok", "resposta": resposta}, status_code=200)
+
+    except Exception as e:
+        print(f"Erro no fluxo: {e}")
+        return JSONResponse({"status": "error", "resposta": "Erro ao processar a solicitação."}, status_code=500)
+
+
+def evento_sse(nome, dados):
+    return f"event: {nome}\ndata: {json.dumps(dados, ensure_ascii=False, default=str)}\n\n"
+
+
+async def chat_stream(request):
+    """
+    Server-Sent Events: rota, tool_inicio, tool_fim, token (trechos da resposta), reinicio (descarte os
+    trechos recebidos; a resposta recomeça nos próximos), fim (resposta completa) ou erro.
+    """
+    data, erro = await ler_payload(request)
+    if erro:
+        return erro
+
+    async def eventos():
+        try:
+            async for nome, dados in executar_fluxo_chefia_stream(
+                pergunta_usuario=data.get("user_message", ""),
+                session_id=session_id_da_requisicao(data),
+                empresa_id=data.get("empresa_id", ""),
+                gestor_id=data.get("gestor_id", "")
+            ):
+                if nome == "token" and not dados["texto"]:
+                    continue
+                yield evento_sse(nome, dados)
+        except Exception as e:
+            print(f"Erro no fluxo: {e}")
+            yield evento_sse("erro", {"status": "error", "resposta": "Erro ao processar a solicitação."})
+
+    # X-Accel-Buffering desliga o buffer de proxies nginx, senão os eventos chegam todos no final
+    return StreamingResponse(eventos(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+async def health_check(request):
+    return JSONResponse(status_servico())
+
+
+async def metrics(request):
+    return Response(metricas.exportar(), headers={"Content-Type": CONTENT_TYPE_METRICAS})
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    yield
+    # fecha as conexões async abertas por este worker
+    await get_embedder().aclose()
+    await aclose_client()
+
+
+app = Starlette(
+    routes=[
+        Route("/chat", chat, methods=["POST"]),
+        Route("/chat/stream", chat_stream, methods=["POST"]),
+        Route("/health", health_check, methods=["GET"]),
+        Route("/metrics", metrics, methods=["GET"]),
+    ],
+    middleware=[Middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])],
+    lifespan=lifespan,
+)
@@ -0,0 +1,177 @@
+"""
+Recall@k e latência da busca de receitas: pipeline antigo ($vectorSearch sem filtro + $match empresaId),
+busca vetorial pré-filtrada por empresa e busca híbrida (vetorial + Atlas Search, RRF).
+
+Semeia a collection `receitas` do banco informado (padrão bench_receitas) com receitas sintéticas de
+várias empresas, em que a empresa 1 tem só uma pequena fração do catálogo, e cria os índices de
+mongo_tools.INDICES_BUSCA. Precisa de um deployment com Atlas Search/Vector Search, por exemplo o
+local do Atlas CLI (`atlas deployments setup --type local`) ou a imagem mongodb/mongodb-atlas-local.
+Os vetores vêm do StubEmbedder (determinístico, offline). Uso (a partir da raiz do repositório):
+    python -m benchmarks.busca_receitas --url mongodb://localhost:27017/?directConnection=true
+    python -m benchmarks.busca_receitas --receitas 50000 --fracao 0.002 --manter
+"""
+import os
+import time
+import random
+import argparse
+import statistics
+from pymongo import MongoClient
+from dotenv import load_dotenv
+
+from embeddings import StubEmbedder, gerar_texto_embedding
+from mongo_tools import garantir_indices_busca, montar_pipeline_receitas, gerar_texto_embedding_receita, texto_lexico_receita
+
+load_dotenv()
+
+COLLECTION = "receitas"  # mesmo nome usado no $unionWith de montar_pipeline_receitas
+
+PRATOS = ["Arroz", "Risoto", "Torta", "Sopa", "Creme", "Salada", "Escondidinho", "Farofa", "Bolo", "Quiche",
+          "Lasanha", "Panqueca", "Omelete", "Moqueca", "Caldo", "Purê", "Suflê", "Empadão", "Nhoque", "Strogonoff"]
+PRINCIPAIS = ["Abóbora", "Frango", "Brócolis", "Camarão", "Palmito", "Cenoura", "Mandioca", "Espinafre", "Milho", "Cogumelos",
+              "Bacalhau", "Carne Seca", "Queijo", "Banana", "Lentilha", "Grão-de-Bico", "Berinjela", "Abobrinha", "Tomate", "Batata Doce"]
+ESTILOS = ["", "Caseiro", "Cremoso", "Assado", "Light", "Gratinado", "da Casa", "Rústico", "Especial", "Tradicional"]
+INGREDIENTES = ["alho", "cebola", "azeite", "sal", "pimenta-do-reino", "manteiga", "leite", "creme de leite", "ovos", "farinha de trigo",
+                "queijo parmesão", "salsinha", "cebolinha", "coentro", "tomate", "pimentão", "arroz", "caldo de legumes", "vinho branco", "noz-moscada",
+                "açafrão", "cominho", "páprica", "limão", "leite de coco", "azeite de dendê", "batata", "cenoura", "ervilha", "milho verde",
+                "requeijão", "mussarela", "presunto", "bacon", "linguiça", "frango desfiado", "carne moída", "camarão", "palmito", "espinafre"]
+
+
+def gerar_receitas(total, empresas, fracao, rng):
+    # empresa 1 recebe `fracao` do catálogo; o resto é dividido entre as demais
+    nomes = [f"{p} de {i} {e}".strip() for p in PRATOS for i in PRINCIPAIS for e in ESTILOS]
+    alvo = max(10, int(total * fracao))
+    por_empresa = {1: alvo}
+    for empresa in range(2, empresas + 1):
+        por_empresa[empresa] = (total - alvo) // (empresas - 1)
+    for empresa, quantidade in por_empresa.items():
+        for nome in rng.sample(nomes, min(quantidade, len(nomes))):  # nomes únicos por empresa
+            principal = nome.split(" de ", 1)[1]
+            ingredientes = [principal.lower()] + rng.sample(INGREDIENTES, rng.randint(4, 8))
+            yield {
+                "empresaId": empresa,
+                "nome": nome,
+                "descricao": f"{nome} servido no almoço.",
+                "ingredientes": [{"nome": i} for i in ingredientes],
+                "modoPreparo": [{"passo": f"Prepare {i}."} for i in ingredientes[:3]],
+            }
+
+
+def com_erro_de_digitacao(texto, rng):
+    # troca duas letras vizinhas de uma palavra longa, como um usuário apressado
+    palavras = texto.split()
+    longas = [i for i, p in enumerate(palavras) if len(p) > 4]
+    if not longas:
+        return texto
+    i = rng.choice(longas)
+    p = palavras[i]
+    j = rng.randrange(1, len(p) - 2)
+    palavras[i] = p[:j] + p[j + 1] + p[j] + p[j + 2:]
+    return " ".join(palavras)
+
+
+def semear(db, total, empresas, fracao, rng, embedder):
+    db.drop_collection(COLLECTION)
+    collection = db[COLLECTION]
+    lote = []
+    for doc in gerar_receitas(total, empresas, fracao, rng):
+        doc["embedding"] = embedder.embed(gerar_texto_embedding(doc))
+        lote.append(doc)
+        if len(lote) == 1000:
+            collection.insert_many(lote)
+            lote = []
+    if lote:
+        collection.insert_many(lote)
+    return collection
+
+
+def montar_consultas(collection, empresa_id, quantidade, rng):
+    receitas = list(collection.find({"empresaId": empresa_id}, {"nome": 1, "ingredientes": 1}))
+    consultas = []
+    for receita in rng.sample(receitas, min(quantidade, len(receitas))):
+        extras = [i["nome"] for i in receita["ingredientes"][1:]]
+        consultas.append({
+            "nome_receita": com_erro_de_digitacao(receita["nome"], rng),
+            "ingrediente": ", ".join(rng.sample(extras, min(2, len(extras)))),
+            "esperado": receita["nome"],
+        })
+    return consultas
+
+
+def pipeline_antigo(vetor, empresa_id, texto, k):
+    # montar_pipeline_receitas antes do filtro no índice: o $match roda depois dos 3 vizinhos globais
+    return [
+        {"$vectorSearch": {"queryVector": vetor, "path": "embedding", "numCandidates": 100, "limit": k, "index": "receita_embedding_index"}},
+        {"$match": {"empresaId": empresa_id}},
+        {"$project": {"_id": 0, "nome": 1}},
+    ]
+
+
+def pipeline_vetorial(vetor, empresa_id, texto, k):
+    return montar_pipeline_receitas(vetor, empresa_id, None, k, collection=COLLECTION)
+
+
+def pipeline_hibrido(vetor, empresa_id, texto, k):
+    return montar_pipeline_receitas(vetor, empresa_id, texto, k, collection=COLLECTION)
+
+
+def medir(collection, montar, empresa_id, consultas, k, embedder):
+    tempos, acertos, incompletas = [], 0, 0
+    for consulta in consultas:
+        vetor = embedder.embed(gerar_texto_embedding_receita(consulta["nome_receita"], consulta["ingrediente"], None, None))
+        texto = texto_lexico_receita(consulta["nome_receita"], consulta["ingrediente"])
+        inicio = time.perf_counter()
+        nomes = [doc["nome"] for doc in collection.aggregate(montar(vetor, empresa_id, texto, k))]
+        tempos.append((time.perf_counter() - inicio) * 1000)
+        acertos += consulta["esperado"] in nomes
+        incompletas += len(nomes) < k
+    tempos.sort()
+    return {
+        "recall": acertos / len(consultas),
+        "incompletas": incompletas,
+        "p50_ms": statistics.median(tempos),
+        "p95_ms": tempos[max(0, int(len(tempos) * 0.95) - 1)],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=os.getenv("MONGO_URL"))
+    parser.add_argument("--db", default="bench_receitas")
+    parser.add_argument("--receitas", type=int, default=20000)
+    parser.add_argument("--empresas", type=int, default=20)
+    parser.add_argument("--fracao", type=float, default=0.005, help="fração do catálogo que pertence à empresa 1")
+    parser.add_argument("--consultas", type=int, default=100)
+    parser.add_argument("-k", type=int, default=3)
+    parser.add_argument("--semente", type=int, default=42)
+    parser.add_argument("--manter", action="store_true", help="não remove o banco de benchmark ao final")
+    args = parser.parse_args()
+
+    rng = random.Random(args.semente)
+    embedder = StubEmbedder()
+    client = MongoClient(args.url)
+    db = client[args.db]
+    try:
+        inicio = time.perf_counter()
+        collection = semear(db, args.receitas, args.empresas, args.fracao, rng, embedder)
+        print(f"{collection.estimated_document_count()} receitas em {args.empresas} empresas semeadas em {time.perf_counter() - inicio:.1f}s")
+
+        inicio = time.perf_counter()
+        garantir_indices_busca(collection, esperar=True)
+        print(f"índices de busca prontos em {time.perf_counter() - inicio:.1f}s")
+
+        estrategias = {"antes (pós-filtro)": pipeline_antigo, "vetorial filtrada": pipeline_vetorial, "híbrida (RRF)": pipeline_hibrido}
+        for empresa_id, rotulo in ((1, "empresa pequena"), (2, "empresa grande")):
+            consultas = montar_consultas(collection, empresa_id, args.consultas, rng)
+            print(f"\n{rotulo} (empresa {empresa_id}, {len(consultas)} consultas, k={args.k})")
+            print(f"{'busca':<22}{'recall@k':>10}{'< k':>6}{'p50 (ms)':>10}{'p95 (ms)':>10}")
+            for nome, montar in estrategias.items():
+                r = medir(collection, montar, empresa_id, consultas, args.k, embedder)
+                print(f"{nome:<22}{r['recall']:>10.2f}{r['incompletas']:>6}{r['p50_ms']:>10.2f}{r['p95_ms']:>10.2f}")
+    finally:
+        if not args.manter:
+            client.drop_database(args.db)
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,513 @@
+"""
+Benchmark ponta a ponta do /chat sem serviços externos: o Gemini é trocado por um modelo roteirizado com
+latência configurável, os embeddings pelo StubEmbedder e Atlas/Postgres remotos por um MongoDB e um
+Postgres locais semeados com receitas, funcionários e tarefas sintéticos.
+
+Mede requisições/s, percentis de latência e o tempo por etapa (métricas de telemetria.py) chamando
+executar_fluxo_chefia direto (threads), a versão async, ou o endpoint HTTP (Flask ou ASGI). Com
+--salvar/--baseline o resultado vira referência e a execução falha (código 1) se piorar além da tolerância.
+
+Cria o schema bench_chefia no Postgres e o banco bench_chefia no Mongo; use instâncias de teste.
+Uso (a partir da raiz do repositório):
+    python -m benchmarks.chat_e2e --dsn postgresql://localhost/codcoz_bench --mongo mongodb://localhost:27017
+    python -m benchmarks.chat_e2e --modo http-asgi --concorrencia 32 --requisicoes 2000 --salvar base.json
+    python -m benchmarks.chat_e2e --baseline base.json --tolerancia 0.1
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import threading
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+SCHEMA = "bench_chefia"
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MIGRACOES = [os.path.join(RAIZ, "migrations", m) for m in ("0001_busca_aproximada.sql", "0003_indices_tarefa.sql")]
+
+# pergunta -> item do roteiro (rota e tool que o modelo falso deve chamar); preenchido por montar_carga
+ROTEIRO = {}
+
+
+# ---------------------------------------------------------------- modelo falso
+
+def criar_modelo_falso(primeiro_token, por_token):
+    """Substituto do ChatGoogleGenerativeAI: responde pelo ROTEIRO, com latência e uso de tokens simulados."""
+    from langchain_core.language_models import BaseChatModel
+    from langchain_core.messages import AIMessage, AIMessageChunk, ToolMessage
+    from langchain_core.outputs import ChatGeneration, ChatResult, ChatGenerationChunk
+
+    def pergunta_em(texto, marcador):
+        achado = re.search(re.escape(marcador) + r"(.*)", texto)
+        return achado.group(1).strip() if achado else ""
+
+    def responder(mensagens, ferramentas):
+        ultima = mensagens[-1]
+        texto = ultima.content if isinstance(ultima.content, str) else json.dumps(ultima.content)
+        if isinstance(ultima, ToolMessage):
+            try:
+                total = json.loads(texto).get("count") or json.loads(texto).get("total")
+            except (ValueError, AttributeError):
+                total = None
+            return AIMessage(content=json.dumps({
+                "dominio": "receitas" if "query_receitas" in ferramentas else "tarefas",
+                "intencao": "consultar",
+                "resposta": f"Encontrei {total if total is not None else 'os'} resultado(s) para o seu pedido.",
+                "recomendacao": "Quer ver mais detalhes?",
+            }, ensure_ascii=False))
+        if ferramentas:
+            item = ROTEIRO.get(pergunta_em(texto, "PERGUNTA_ORIGINAL="), {})
+            empresa = int(pergunta_em(texto, "- ID da empresa:") or item.get("empresa_id") or 1)
+            tool = item.get("tool") if item.get("tool") in ferramentas else ferramentas[0]
+            args = {**item.get("args", {}), "empresa_id": empresa}
+            return AIMessage(content="", tool_calls=[{"name": tool, "args": args, "id": f"call_{random.getrandbits(32)}"}])
+        sistema = mensagens[0].content if isinstance(mensagens[0].content, str) else ""
+        if "ESPECIALISTA_JSON" in sistema:
+            return AIMessage(content="Aqui está o que encontrei. Quer ver mais detalhes?")
+        if "PROTOCOLO DE ENCAMINHAMENTO" in sistema:
+            pergunta = texto.split("### MENSAGEM", 1)[1].strip()
+            rota = ROTEIRO.get(pergunta, {}).get("rota", "receitas")
+            return AIMessage(content=f"ROUTE={rota}\nPERGUNTA_ORIGINAL={pergunta}\nPERSONA={{PERSONA_SISTEMA}}\nCLARIFY=")
+        return AIMessage(content="Resumo: o gestor consultou receitas e tarefas da cozinha.")
+
+    def uso(mensagens, resposta):
+        entrada = sum(len(m.content) if isinstance(m.content, str) else 0 for m in mensagens) // 4
+        saida = max(1, len(resposta.content) // 4 + 20 * len(resposta.tool_calls))
+        return {"input_tokens": entrada, "output_tokens": saida, "total_tokens": entrada + saida,
+                "input_token_details": {"cache_read": 0}}
+
+    class ModeloRoteirizado(BaseChatModel):
+        model: str = "falso"
+        ferramentas: list = []
+        latencia_inicial: float = primeiro_token
+        latencia_token: float = por_token
+
+        @property
+        def _llm_type(self):
+            return "roteirizado"
+
+        def bind_tools(self, tools, **kwargs):
+            return self.model_copy(update={"ferramentas": [getattr(t, "name", str(t)) for t in tools]})
+
+        def _resposta(self, mensagens):
+            resposta = responder(mensagens, self.ferramentas)
+            resposta.usage_metadata = uso(mensagens, resposta)
+            return resposta
+
+        def _duracao(self, resposta):
+            return self.latencia_inicial + self.latencia_token * (len(resposta.content) // 4)
+
+        def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+            resposta = self._resposta(messages)
+            time.sleep(self._duracao(resposta))
+            return ChatResult(generations=[ChatGeneration(message=resposta)])
+
+        async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+            resposta = self._resposta(messages)
+            await asyncio.sleep(self._duracao(resposta))
+            return ChatResult(generations=[ChatGeneration(message=resposta)])
+
+        def _trechos(self, resposta):
+            if resposta.tool_calls:
+                chamada = resposta.tool_calls[0]
+                yield AIMessageChunk(content="", tool_call_chunks=[{"name": chamada["name"], "args": json.dumps(chamada["args"]), "id": chamada["id"], "index": 0}])
+            else:
+                for i in range(0, len(resposta.content), 16):
+                    yield AIMessageChunk(content=resposta.content[i:i + 16])
+            yield AIMessageChunk(content="", usage_metadata=resposta.usage_metadata)
+
+        def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+            resposta = self._resposta(messages)
+            time.sleep(self.latencia_inicial)
+            for trecho in self._trechos(resposta):
+                time.sleep(self.latencia_token * 4)
+                yield ChatGenerationChunk(message=trecho)
+
+        async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+            resposta = self._resposta(messages)
+            await asyncio.sleep(self.latencia_inicial)
+            for trecho in self._trechos(resposta):
+                await asyncio.sleep(self.latencia_token * 4)
+                yield ChatGenerationChunk(message=trecho)
+
+    def fabrica(model="falso", **kwargs):
+        return ModeloRoteirizado(model=model)
+
+    return fabrica
+
+
+# ---------------------------------------------------------------- dados
+
+def semear_postgres(dsn, empresas, funcionarios, tarefas):
+    import psycopg2
+    from benchmarks.resolver_nomes import NOMES, SOBRENOMES, executar_migracao
+    from benchmarks.busca_receitas import INGREDIENTES
+
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True  # CREATE INDEX CONCURRENTLY não roda dentro de transação
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+            cur.execute(f"CREATE SCHEMA {SCHEMA}")
+            cur.execute(f"SET search_path = {SCHEMA}, public")
+            cur.execute("CREATE TABLE funcionario (id bigserial PRIMARY KEY, empresa_id int NOT NULL, nome text NOT NULL, sobrenome text)")
+            cur.execute("CREATE TABLE ingrediente (id bigserial PRIMARY KEY, empresa_id int NOT NULL, nome text NOT NULL)")
+            cur.execute("CREATE TABLE tipo_tarefa (id bigserial PRIMARY KEY, nome text NOT NULL, descricao text)")
+            cur.execute(
+                """
+                CREATE TABLE tarefa (id bigserial PRIMARY KEY, empresa_id int NOT NULL, tipo_tarefa_id int, ingrediente_id int,
+                                     relator_id int, responsavel_id int, pedido_id int, situacao text NOT NULL,
+                                     data_limite date, data_conclusao date, data_criacao date NOT NULL DEFAULT CURRENT_DATE)
+                """
+            )
+            cur.execute("INSERT INTO tipo_tarefa (nome, descricao) VALUES ('Conferência de Estoque', 'Contagem do estoque'), "
+                        "('Padrão', 'Tarefa geral'), ('Limpeza', 'Limpeza da cozinha'), ('Recebimento', 'Recebimento de mercadorias')")
+            cur.execute(
+                """
+                INSERT INTO funcionario (empresa_id, nome, sobrenome)
+                SELECT e, (%(nomes)s::text[])[1 + (e * 7 + f) %% %(n_nomes)s], (%(sobrenomes)s::text[])[1 + (e * 13 + f) %% %(n_sobrenomes)s]
+                  FROM generate_series(1, %(empresas)s) e, generate_series(1, %(funcionarios)s) f
+                """,
+                {"nomes": NOMES, "sobrenomes": SOBRENOMES, "n_nomes": len(NOMES), "n_sobrenomes": len(SOBRENOMES),
+                 "empresas": empresas, "funcionarios": funcionarios},
+            )
+            cur.execute(
+                "INSERT INTO ingrediente (empresa_id, nome) SELECT e, i FROM generate_series(1, %s) e, unnest(%s::text[]) i",
+                (empresas, INGREDIENTES),
+            )
+            cur.execute(
+                """
+                INSERT INTO tarefa (empresa_id, tipo_tarefa_id, responsavel_id, situacao, data_limite, data_criacao)
+                SELECT f.empresa_id, 1 + g %% 4, f.id, (ARRAY['PENDENTE', 'CONCLUÍDA', 'CANCELADA'])[1 + g %% 3],
+                       CURRENT_DATE + (g %% 60) - 30, CURRENT_DATE - (g %% 30)
+                  FROM generate_series(1, %s) g
+                  JOIN funcionario f ON f.id = 1 + g %% (SELECT count(*) FROM funcionario)
+                """,
+                (tarefas,),
+            )
+            for migracao in MIGRACOES:
+                executar_migracao(cur, migracao)
+            cur.execute("ANALYZE")
+            cur.execute("SELECT empresa_id, nome || ' ' || sobrenome FROM funcionario")
+            return cur.fetchall()
+    finally:
+        conn.close()
+
+
+def semear_mongo(url, banco, empresas, receitas, semente):
+    from pymongo import MongoClient
+    from embeddings import StubEmbedder, gerar_texto_embedding, hash_texto_embedding
+    from benchmarks.busca_receitas import gerar_receitas
+
+    embedder = StubEmbedder()
+    client = MongoClient(url)
+    try:
+        client.drop_database(banco)
+        collection = client[banco]["receitas"]
+        lote, nomes = [], []
+        for doc in gerar_receitas(receitas, empresas, 1 / empresas, random.Random(semente)):
+            texto = gerar_texto_embedding(doc)
+            doc.update(embedding=embedder.embed(texto), embeddingHash=hash_texto_embedding(texto), embeddingModelo=embedder.model_id)
+            lote.append(doc)
+            nomes.append((doc["empresaId"], doc["nome"]))
+            if len(lote) == 1000:
+                collection.insert_many(lote)
+                lote = []
+        if lote:
+            collection.insert_many(lote)
+        return nomes
+    finally:
+        client.close()
+
+
+def montar_carga(total, funcionarios, receitas, rng):
+    """Mensagens (pergunta, empresa) com o mix de um dia típico; registra no ROTEIRO a tool de cada uma."""
+    carga = []
+    for _ in range(total):
+        sorteio = rng.random()
+        if sorteio < 0.1:
+            empresa = rng.randint(1, max(e for e, _ in funcionarios))
+            pergunta = rng.choice(["Olá!", "bom dia", "Oi, tudo bem?"])
+        elif sorteio < 0.55:
+            empresa, receita = rng.choice(receitas)
+            principal = receita.split(" de ", 1)[1].split()[0]
+            pergunta = rng.choice([f"Quais receitas com {principal.lower()} temos?", f"Me passa a receita de {receita}",
+                                   f"O que dá para fazer com {principal.lower()}?"])
+            ROTEIRO[pergunta] = {"rota": "receitas", "tool": "query_receitas", "args": {"nome_receita": receita}}
+        elif sorteio < 0.9:
+            empresa, nome = rng.choice(funcionarios)
+            pergunta = rng.choice([f"Quais são as tarefas de {nome} para esta semana?", f"Quantas tarefas pendentes o {nome} tem?"])
+            ROTEIRO[pergunta] = {"rota": "tarefas", "tool": "consultar_tarefas",
+                                 "args": {"responsavel": nome, "situacao": "PENDENTE"}}
+        else:
+            empresa, nome = rng.choice(funcionarios)
+            pergunta = f"Adicione uma tarefa de Conferência de Estoque para {nome} amanhã."
+            ROTEIRO[pergunta] = {"rota": "tarefas", "tool": "add_tarefa",
+                                 "args": {"responsavel": nome, "situacao": "PENDENTE", "tipo_tarefa": "Conferência de Estoque"}}
+        carga.append((pergunta, empresa))
+    return carga
+
+
+# ---------------------------------------------------------------- execução
+
+def percentis(tempos):
+    tempos = sorted(tempos)
+    if not tempos:
+        return {}
+    def p(q):
+        return tempos[min(len(tempos) - 1, int(q * len(tempos)))]
+    return {"p50": p(0.5), "p90": p(0.9), "p95": p(0.95), "p99": p(0.99), "max": tempos[-1], "media": statistics.fmean(tempos)}
+
+
+def rodar_threads(funcao, carga, concorrencia):
+    # concorrencia usuários em loop fechado, cada um com a sua sessão
+    tempos, erros, fila, lock = [], [0], list(reversed(carga)), threading.Lock()
+
+    def usuario(indice):
+        while True:
+            with lock:
+                if not fila:
+                    return
+                pergunta, empresa = fila.pop()
+            inicio = time.perf_counter()
+            try:
+                funcao(pergunta, f"{empresa}:bench-{indice}", empresa, indice)
+            except Exception as e:
+                with lock:
+                    erros[0] += 1
+                print(f"erro: {e}", file=sys.stderr)
+            with lock:
+                tempos.append(time.perf_counter() - inicio)
+
+    with ThreadPoolExecutor(max_workers=concorrencia) as executor:
+        list(executor.map(usuario, range(concorrencia)))
+    return tempos, erros[0]
+
+
+async def rodar_async(funcao, carga, concorrencia):
+    tempos, erros, fila = [], [0], list(reversed(carga))
+
+    async def usuario(indice):
+        while fila:
+            pergunta, empresa = fila.pop()
+            inicio = time.perf_counter()
+            try:
+                await funcao(pergunta, f"{empresa}:bench-{indice}", empresa, indice)
+            except Exception as e:
+                erros[0] += 1
+                print(f"erro: {e}", file=sys.stderr)
+            tempos.append(time.perf_counter() - inicio)
+
+    await asyncio.gather(*(usuario(i) for i in range(concorrencia)))
+    return tempos, erros[0]
+
+
+def iniciar_servidor(modo, porta):
+    if modo == "http-asgi":
+        import uvicorn
+        import asgi
+        servidor = uvicorn.Server(uvicorn.Config(asgi.app, host="127.0.0.1", port=porta, log_level="warning"))
+        threading.Thread(target=servidor.run, daemon=True).start()
+        while not servidor.started:
+            time.sleep(0.05)
+
+        def parar():
+            servidor.should_exit = True
+        return parar
+    from werkzeug.serving import make_server
+    import app
+    servidor = make_server("127.0.0.1", porta, app.app, threaded=True)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor.shutdown
+
+
+def cliente_http(porta):
+    import aiohttp
+    sessao = {}
+
+    async def chamar(pergunta, session_id, empresa, gestor):
+        if "http" not in sessao:
+            sessao["http"] = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=120))
+        payload = {"user_message": pergunta, "empresa_id": empresa, "gestor_id": gestor, "session_id": session_id.split(":", 1)[1]}
+        async with sessao["http"].post(f"http://127.0.0.1:{porta}/chat", json=payload) as resposta:
+            corpo = await resposta.json()
+            if resposta.status != 200:
+                raise RuntimeError(f"HTTP {resposta.status}: {corpo}")
+
+    async def fechar():
+        if "http" in sessao:
+            await sessao["http"].close()
+
+    return chamar, fechar
+
+
+def executar(modo, carga, concorrencia, porta):
+    import app
+    if modo == "direto":
+        return rodar_threads(app.executar_fluxo_chefia, carga, concorrencia)
+    if modo == "async":
+        return asyncio.run(rodar_async(app.executar_fluxo_chefia_async, carga, concorrencia))
+    chamar, fechar = cliente_http(porta)
+
+    async def rodar():
+        try:
+            return await rodar_async(chamar, carga, concorrencia)
+        finally:
+            await fechar()
+    return asyncio.run(rodar())
+
+
+def resultado_etapas():
+    from telemetria import DURACAO_ETAPA, DURACAO_TOOL, POSTGRES, TOKENS, CHAMADAS_LLM
+
+    def em_ms(resumo):
+        return {",".join(r): {"total": v["total"], "media_ms": v["media"] * 1000, "p50_ms": v["p50"] * 1000, "p95_ms": v["p95"] * 1000}
+                for r, v in sorted(resumo.items())}
+    return {
+        "etapas": em_ms(DURACAO_ETAPA.resumo()),
+        "tools": em_ms(DURACAO_TOOL.resumo()),
+        "postgres": em_ms(POSTGRES.resumo()),
+        "llm_chamadas": {r[0]: v for r, v in CHAMADAS_LLM.valores().items()},
+        "llm_tokens": {",".join(r): v for r, v in TOKENS.valores().items()},
+    }
+
+
+def comparar(atual, base, tolerancia):
+    """Lista de regressões (texto) do resultado atual em relação à base."""
+    regressoes = []
+    if atual["rps"] < base["rps"] * (1 - tolerancia):
+        regressoes.append(f"rps {base['rps']:.1f} -> {atual['rps']:.1f}")
+    for q in ("p50", "p95", "p99"):
+        if atual["latencia_ms"][q] > base["latencia_ms"][q] * (1 + tolerancia):
+            regressoes.append(f"latência {q} {base['latencia_ms'][q]:.0f}ms -> {atual['latencia_ms'][q]:.0f}ms")
+    for etapa, valores in atual["etapas"].items():
+        anterior = base["etapas"].get(etapa)
+        if anterior and valores["p95_ms"] > anterior["p95_ms"] * (1 + tolerancia) and valores["p95_ms"] - anterior["p95_ms"] > 1:
+            regressoes.append(f"etapa {etapa} p95 {anterior['p95_ms']:.1f}ms -> {valores['p95_ms']:.1f}ms")
+    return regressoes
+
+
+def imprimir(resultado):
+    lat = resultado["latencia_ms"]
+    print(f"\n{resultado['modo']}, concorrência {resultado['concorrencia']}: {resultado['requisicoes']} requisições "
+          f"em {resultado['duracao_s']:.1f}s, {resultado['rps']:.1f} req/s, {resultado['erros']} erro(s)")
+    print("latência (ms): " + "  ".join(f"{q}={lat[q]:.0f}" for q in ("media", "p50", "p90", "p95", "p99", "max")))
+    for grupo in ("etapas", "tools", "postgres"):
+        if resultado[grupo]:
+            print(f"\n{grupo:<32}{'total':>8}{'média':>10}{'p50':>10}{'p95':>10}")
+            for nome, v in resultado[grupo].items():
+                print(f"{nome[:32]:<32}{v['total']:>8}{v['media_ms']:>10.1f}{v['p50_ms']:>10.1f}{v['p95_ms']:>10.1f}")
+    print(f"\nchamadas ao LLM por etapa: {resultado['llm_chamadas']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dsn", default=os.getenv("SQL_URL"), help="Postgres de teste (schema bench_chefia)")
+    parser.add_argument("--mongo", default=os.getenv("MONGO_URL"), help="MongoDB de teste (banco bench_chefia)")
+    parser.add_argument("--mongo-db", default="bench_chefia")
+    parser.add_argument("--modo", choices=("direto", "async", "http-flask", "http-asgi"), default="direto")
+    parser.add_argument("--concorrencia", type=int, default=8)
+    parser.add_argument("--requisicoes", type=int, default=500)
+    parser.add_argument("--aquecimento", type=int, default=20, help="requisições antes da medição (não entram no resultado)")
+    parser.add_argument("--latencia-llm", type=float, default=0.3, help="segundos até o 1º token do modelo falso")
+    parser.add_argument("--latencia-token", type=float, default=0.004, help="segundos por token gerado")
+    parser.add_argument("--empresas", type=int, default=20)
+    parser.add_argument("--funcionarios", type=int, default=40, help="por empresa")
+    parser.add_argument("--tarefas", type=int, default=200000)
+    parser.add_argument("--receitas", type=int, default=20000)
+    parser.add_argument("--vetorial", choices=("local", "auto", "atlas"), default="local", help="RECEITAS_VETORIAL durante o benchmark")
+    parser.add_argument("--porta", type=int, default=8765)
+    parser.add_argument("--semente", type=int, default=42)
+    parser.add_argument("--sem-semear", action="store_true", help="reaproveita os dados de uma execução anterior (--manter)")
+    parser.add_argument("--manter", action="store_true", help="não remove schema/banco de benchmark ao final")
+    parser.add_argument("--salvar", help="grava o resultado em JSON (para usar como --baseline)")
+    parser.add_argument("--baseline", help="resultado JSON anterior para comparação")
+    parser.add_argument("--tolerancia", type=float, default=0.1, help="piora relativa aceita em relação à baseline")
+    args = parser.parse_args()
+
+    # Ambiente dos módulos do app: precisa estar pronto antes do primeiro import deles
+    os.environ.update({
+        "EMBEDDER": "stub",
+        "GEMINI_API_KEY": "falsa",
+        "HISTORICO_BACKEND": "memoria",
+        "SQL_URL": args.dsn,
+        "MONGO_URL": args.mongo,
+        "MONGO_DB": args.mongo_db,
+        "RECEITAS_VETORIAL": args.vetorial,
+        "RECEITAS_ANN_DIR": os.path.join(RAIZ, ".ann_receitas", "bench"),
+        "PGOPTIONS": f"-c search_path={SCHEMA},public",
+    })
+    rng = random.Random(args.semente)
+
+    if args.sem_semear:
+        funcionarios = receitas = None
+    else:
+        inicio = time.perf_counter()
+        funcionarios = semear_postgres(args.dsn, args.empresas, args.funcionarios, args.tarefas)
+        receitas = semear_mongo(args.mongo, args.mongo_db, args.empresas, args.receitas, args.semente)
+        print(f"dados semeados em {time.perf_counter() - inicio:.1f}s")
+    if funcionarios is None:
+        import psycopg2
+        from pymongo import MongoClient
+        with psycopg2.connect(args.dsn) as conn, conn.cursor() as cur:
+            cur.execute("SELECT empresa_id, nome || ' ' || sobrenome FROM funcionario")
+            funcionarios = cur.fetchall()
+        with MongoClient(args.mongo) as client:
+            receitas = [(d["empresaId"], d["nome"]) for d in client[args.mongo_db]["receitas"].find({}, {"empresaId": 1, "nome": 1})]
+
+    import langchain_google_genai
+    langchain_google_genai.ChatGoogleGenerativeAI = criar_modelo_falso(args.latencia_llm, args.latencia_token)
+    import app  # noqa: F401  (monta as chains já com o modelo falso)
+    from telemetria import metricas
+
+    carga = montar_carga(args.aquecimento + args.requisicoes, funcionarios, receitas, rng)
+    parar = iniciar_servidor(args.modo, args.porta) if args.modo.startswith("http") else None
+    try:
+        executar(args.modo, carga[:args.aquecimento], args.concorrencia, args.porta)
+        metricas.zerar()
+        inicio = time.perf_counter()
+        tempos, erros = executar(args.modo, carga[args.aquecimento:], args.concorrencia, args.porta)
+        duracao = time.perf_counter() - inicio
+    finally:
+        if parar:
+            parar()
+
+    resultado = {
+        "modo": args.modo,
+        "concorrencia": args.concorrencia,
+        "requisicoes": len(tempos),
+        "erros": erros,
+        "duracao_s": duracao,
+        "rps": len(tempos) / duracao if duracao else 0.0,
+        "latencia_ms": {q: v * 1000 for q, v in percentis(tempos).items()},
+        "parametros": {"latencia_llm": args.latencia_llm, "latencia_token": args.latencia_token, "vetorial": args.vetorial},
+        **resultado_etapas(),
+    }
+    imprimir(resultado)
+
+    if args.salvar:
+        with open(args.salvar, "w", encoding="utf-8") as f:
+            json.dump(resultado, f, ensure_ascii=False, indent=2)
+    codigo = 0
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressoes = comparar(resultado, json.load(f), args.tolerancia)
+        print("\nsem regressões em relação à baseline" if not regressoes else "\nREGRESSÕES:\n  " + "\n  ".join(regressoes))
+        codigo = 1 if regressoes else 0
+
+    if not args.manter:
+        import psycopg2
+        from pymongo import MongoClient
+        with psycopg2.connect(args.dsn) as conn, conn.cursor() as cur:
+            cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        with MongoClient(args.mongo) as client:
+            client.drop_database(args.mongo_db)
+    sys.exit(codigo)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+Compara a busca antiga de funcionário (ILIKE '%a%b%' LIMIT 1, sem empresa) com pg_resolver.resolver
+(trigramas sem acento, por empresa, com ambiguidade) numa tabela semeada com 1M de funcionários.
+
+Cria o schema bench_resolver (e a função public.busca_normalizada da migração) no banco informado;
+use um banco de testes. Uso (a partir da raiz do repositório):
+    python -m benchmarks.resolver_nomes --dsn postgresql://localhost/codcoz_bench
+    python -m benchmarks.resolver_nomes --linhas 200000 --manter      # mantém o schema ao final
+"""
+import os
+import re
+import time
+import argparse
+import statistics
+import psycopg2
+from dotenv import load_dotenv
+
+from pg_resolver import resolver
+
+load_dotenv()
+
+SCHEMA = "bench_resolver"
+MIGRACAO = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "migrations", "0001_busca_aproximada.sql")
+
+NOMES = ["Ana", "Bruno", "Carlos", "Daniela", "Eduardo", "Fernanda", "Gabriel", "Helena", "Igor", "Juliana",
+         "João", "Larissa", "Marcos", "Natália", "Otávio", "Patrícia", "Rafael", "Sérgio", "Tatiana", "Vinícius",
+         "Amanda", "Beatriz", "Caio", "Débora", "Emerson", "Flávia", "Gustavo", "Heloísa", "Isabela", "Jéssica",
+         "Lucas", "Mariana", "Nicolas", "Olívia", "Paulo", "Renata", "Samuel", "Thiago", "Vanessa", "Wagner"]
+SOBRENOMES = ["Silva", "Santos", "Oliveira", "Souza", "Rodrigues", "Ferreira", "Alves", "Pereira", "Lima", "Gomes",
+              "Costa", "Ribeiro", "Martins", "Carvalho", "Araújo", "Melo", "Barbosa", "Cardoso", "Rocha", "Dias",
+              "Nascimento", "Andrade", "Moreira", "Nunes", "Marques", "Machado", "Mendes", "Freitas", "Cavalcanti", "Monteiro",
+              "Conceição", "Galvão", "Brandão", "Calixto", "Tavares", "Pinheiro", "Assunção", "Figueiredo", "Guimarães", "Sampaio"]
+
+# (empresa, nome, sobrenome) inseridos depois da semente; as consultas abaixo sabem quem deveriam achar
+ALVOS = [
+    (7, "Gabriel", "Koji Tanaka"),
+    (7, "Raíssa", "Casale"),
+    (7, "Bruno", "Galvão"),
+    (7, "Bruno", "Galvão Sampaio"),
+]
+CONSULTAS = [
+    # (empresa, texto, índice esperado em ALVOS, ou "ambiguo")
+    (7, "Gabriel Koji", 0),
+    (7, "gabriel koji tanaka", 0),
+    (7, "Raissa Casale", 1),
+    (7, "raíssa", 1),
+    (7, "Bruno Galvão", "ambiguo"),
+    (7, "bruno galvao sampaio", 3),
+]
+
+
+def executar_migracao(cur, caminho=MIGRACAO):
+    with open(caminho, encoding="utf-8") as f:
+        sql = re.sub(r"--.*", "", f.read())
+    for comando in sql.split(";\n"):
+        if comando.strip():
+            cur.execute(comando)
+
+
+def semear(cur, linhas, empresas):
+    cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+    cur.execute(f"CREATE SCHEMA {SCHEMA}")
+    cur.execute(f"SET search_path = {SCHEMA}, public")
+    cur.execute("CREATE TABLE funcionario (id bigserial PRIMARY KEY, empresa_id int NOT NULL, nome text NOT NULL, sobrenome text)")
+    cur.execute("CREATE TABLE ingrediente (id bigserial PRIMARY KEY, empresa_id int NOT NULL, nome text NOT NULL)")
+    cur.execute("CREATE TABLE tipo_tarefa (id bigserial PRIMARY KEY, nome text NOT NULL, descricao text)")
+    cur.execute(
+        """
+        INSERT INTO funcionario (empresa_id, nome, sobrenome)
+        SELECT 1 + g %% %(empresas)s,
+               (%(nomes)s::text[])[1 + g %% %(n_nomes)s],
+               (%(sobrenomes)s::text[])[1 + (g / %(n_nomes)s) %% %(n_sobrenomes)s] || ' ' ||
+               (%(sobrenomes)s::text[])[1 + (g / (%(n_nomes)s * %(n_sobrenomes)s)) %% %(n_sobrenomes)s]
+          FROM generate_series(1, %(linhas)s) g
+        """,
+        {"empresas": empresas, "nomes": NOMES, "sobrenomes": SOBRENOMES, "n_nomes": len(NOMES),
+         "n_sobrenomes": len(SOBRENOMES), "linhas": linhas},
+    )
+    ids = []
+    for empresa, nome, sobrenome in ALVOS:
+        cur.execute("INSERT INTO funcionario (empresa_id, nome, sobrenome) VALUES (%s, %s, %s) RETURNING id", (empresa, nome, sobrenome))
+        ids.append(cur.fetchone()[0])
+    cur.execute("ANALYZE funcionario")
+    return ids
+
+
+def busca_antiga(cur, empresa_id, texto):
+    # get_responsavel_id antes da migração
+    padrao = f"%{texto.replace(' ', '%')}%"
+    cur.execute("SELECT id FROM funcionario WHERE nome ILIKE %s OR concat(nome, ' ', sobrenome) ILIKE %s LIMIT 1", (padrao, padrao))
+    row = cur.fetchone()
+    return {"id": row[0] if row else None, "ambiguo": False}
+
+
+def busca_nova(cur, empresa_id, texto):
+    return resolver(cur, "funcionario", texto, empresa_id)
+
+
+def medir(cur, busca, ids, repeticoes):
+    tempos, acertos = [], 0
+    for empresa, texto, esperado in CONSULTAS:
+        for _ in range(repeticoes):
+            inicio = time.perf_counter()
+            resultado = busca(cur, empresa, texto)
+            tempos.append((time.perf_counter() - inicio) * 1000)
+        if esperado == "ambiguo":
+            acertos += resultado["ambiguo"]
+        else:
+            acertos += resultado["id"] == ids[esperado]
+    tempos.sort()
+    return {
+        "p50_ms": statistics.median(tempos),
+        "p95_ms": tempos[int(len(tempos) * 0.95) - 1],
+        "acertos": f"{acertos}/{len(CONSULTAS)}",
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dsn", default=os.getenv("SQL_URL"))
+    parser.add_argument("--linhas", type=int, default=1_000_000)
+    parser.add_argument("--empresas", type=int, default=1000)
+    parser.add_argument("--repeticoes", type=int, default=20)
+    parser.add_argument("--manter", action="store_true", help="não remove o schema bench_resolver ao final")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(args.dsn)
+    conn.autocommit = True  # CREATE INDEX CONCURRENTLY não roda dentro de transação
+    try:
+        with conn.cursor() as cur:
+            inicio = time.perf_counter()
+            ids = semear(cur, args.linhas, args.empresas)
+            print(f"{args.linhas} funcionários em {args.empresas} empresas semeados em {time.perf_counter() - inicio:.1f}s")
+
+            inicio = time.perf_counter()
+            executar_migracao(cur)
+            cur.execute("ANALYZE funcionario")
+            print(f"migração (extensões, função e índices) em {time.perf_counter() - inicio:.1f}s")
+            resultados = {
+                "ILIKE (antes)": medir(cur, busca_antiga, ids, args.repeticoes),
+                "resolver, com índice": medir(cur, busca_nova, ids, args.repeticoes),
+            }
+
+            # mesma consulta sem o índice GIN (varredura sequencial da empresa inteira)
+            cur.execute("DROP INDEX funcionario_busca_trgm_idx")
+            resultados["resolver, sem índice"] = medir(cur, busca_nova, ids, max(1, args.repeticoes // 10))
+
+            print(f"\n{'busca':<24}{'p50 (ms)':>10}{'p95 (ms)':>10}{'acertos':>10}")
+            for nome, r in resultados.items():
+                print(f"{nome:<24}{r['p50_ms']:>10.2f}{r['p95_ms']:>10.2f}{r['acertos']:>10}")
+
+            if not args.manter:
+                cur.execute(f"DROP SCHEMA {SCHEMA} CASCADE")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
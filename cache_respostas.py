@@ -0,0 +1,250 @@
+"""
+Cache semântico, por empresa, das respostas da rota de receitas. Perguntas como "Que massa eu posso
+fazer hoje?" se repetem muito dentro de uma empresa; quando o embedding da nova pergunta tem cosseno
+>= RESPOSTAS_CACHE_MIN_SIMILARIDADE com uma já respondida, o JSON do especialista e a resposta final
+guardados são reaproveitados sem roteador, agente de receitas nem orquestrador (nenhuma chamada ao LLM).
+
+Desligado por padrão (RESPOSTAS_CACHE=true liga). O app só consulta e grava a primeira pergunta de uma
+conversa: a chave é a empresa + a pergunta, sem o histórico da sessão, então perguntas que dependem do
+contexto não podem ser compartilhadas. O embedding da pergunta vem do cache de embeddings quando o
+pré-roteador já o calculou; nos demais casos a consulta custa uma chamada ao modelo de embedding.
+
+As respostas expiram por TTL e, com RESPOSTAS_CACHE_WATCH, são invalidadas pelo change stream da
+collection de receitas (precisa de replica set, como no Atlas) assim que as receitas da empresa mudam.
+"""
+import os
+import time
+import threading
+from array import array
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+from embeddings import get_embedder, embed_query, aembed_query
+from orquestrador import extrair_json
+from mongo_client import get_db
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+load_dotenv()
+
+RESPOSTAS_CACHE = os.getenv("RESPOSTAS_CACHE", "false").lower() == "true"
+RESPOSTAS_CACHE_MIN_SIMILARIDADE = float(os.getenv("RESPOSTAS_CACHE_MIN_SIMILARIDADE", "0.92"))
+RESPOSTAS_CACHE_TTL = float(os.getenv("RESPOSTAS_CACHE_TTL", "1800"))              # segundos
+RESPOSTAS_CACHE_POR_EMPRESA = int(os.getenv("RESPOSTAS_CACHE_POR_EMPRESA", "256"))  # perguntas guardadas por empresa
+RESPOSTAS_CACHE_EMPRESAS = int(os.getenv("RESPOSTAS_CACHE_EMPRESAS", "500"))        # empresas em memória (LRU)
+RESPOSTAS_CACHE_WATCH = os.getenv("RESPOSTAS_CACHE_WATCH", "false").lower() == "true"
+COLLECTION_RECEITAS = "receitas"
+
+
+def _normalizado(vetor):
+    norma = sum(x * x for x in vetor) ** 0.5 or 1.0
+    return [x / norma for x in vetor]
+
+
+class RespostaGuardada:
+    __slots__ = ("pergunta", "especialista", "resposta", "expira_em")
+
+    def __init__(self, pergunta, especialista, resposta, expira_em):
+        self.pergunta = pergunta
+        self.especialista = especialista
+        self.resposta = resposta
+        self.expira_em = expira_em
+
+
+class RespostasEmpresa:
+    """
+    Respostas guardadas de uma empresa, com os vetores (normalizados: produto escalar = cosseno) numa
+    única array float32 contígua, na mesma ordem. Não é alterada depois de montada: cada gravação monta
+    outra, então a busca pega a referência sob o lock e calcula as similaridades fora dele.
+    """
+    __slots__ = ("modelo", "dim", "respostas", "vetores")
+
+    def __init__(self, modelo, dim, respostas, vetores):
+        self.modelo = modelo        # vetores de modelos diferentes não são comparáveis
+        self.dim = dim
+        self.respostas = respostas
+        self.vetores = vetores
+
+    def compativel(self, modelo, vetor):
+        return self.modelo == modelo and self.dim == len(vetor)
+
+    def similaridades(self, vetor):
+        if np is not None:
+            matriz = np.frombuffer(self.vetores, dtype=np.float32).reshape(-1, self.dim)
+            return (matriz @ np.asarray(vetor, dtype=np.float32)).tolist()
+        d = self.dim
+        return [sum(a * b for a, b in zip(vetor, self.vetores[i * d:(i + 1) * d])) for i in range(len(self.respostas))]
+
+
+class CacheRespostas:
+    def __init__(self, min_similaridade=RESPOSTAS_CACHE_MIN_SIMILARIDADE, ttl=RESPOSTAS_CACHE_TTL,
+                 por_empresa=RESPOSTAS_CACHE_POR_EMPRESA, empresas=RESPOSTAS_CACHE_EMPRESAS, watch=RESPOSTAS_CACHE_WATCH):
+        self.min_similaridade = min_similaridade
+        self.ttl = ttl
+        self.por_empresa = por_empresa
+        self.max_empresas = empresas
+        self.watch = watch
+        self.pid = os.getpid()
+        self._empresas = OrderedDict()  # empresa -> RespostasEmpresa (respostas mais antigas primeiro)
+        self._lock = threading.Lock()
+        self._observador = None
+        self._parar = threading.Event()
+        self.contagem = {"hits": 0, "misses": 0, "gravacoes": 0, "invalidacoes": 0, "notificacoes": 0}
+
+    @staticmethod
+    def _chave(empresa_id):
+        # empresa_id chega como str pelo JSON do /chat e como int do Mongo
+        return str(empresa_id)
+
+    def _procurar(self, empresa_id, vetor, modelo):
+        self._iniciar_observador()
+        vetor = _normalizado(vetor)
+        with self._lock:
+            entradas = self._empresas.get(self._chave(empresa_id))
+        melhor, similaridade = None, self.min_similaridade
+        if entradas and entradas.compativel(modelo, vetor):
+            agora = time.monotonic()
+            for resposta, score in zip(entradas.respostas, entradas.similaridades(vetor)):
+                if score >= similaridade and resposta.expira_em > agora:
+                    melhor, similaridade = resposta, score
+        with self._lock:
+            self.contagem["hits" if melhor else "misses"] += 1
+        if melhor is None:
+            return None
+        return {"pergunta": melhor.pergunta, "especialista": melhor.especialista, "resposta": melhor.resposta,
+                "similaridade": round(similaridade, 4)}
+
+    def buscar(self, empresa_id, pergunta):
+        """Resposta guardada para uma pergunta equivalente da mesma empresa, ou None."""
+        embedder = get_embedder()
+        return self._procurar(empresa_id, embed_query(pergunta, embedder), embedder.model_id)
+
+    async def abuscar(self, empresa_id, pergunta):
+        embedder = get_embedder()
+        return self._procurar(empresa_id, await aembed_query(pergunta, embedder), embedder.model_id)
+
+    def guardar(self, empresa_id, pergunta, especialista, resposta):
+        # Pedidos de esclarecimento dependem da conversa; só respostas completas são reaproveitadas
+        dados = extrair_json(especialista)
+        if not resposta or not dados or dados.get("esclarecer"):
+            return False
+        embedder = get_embedder()
+        vetor = _normalizado(embed_query(pergunta, embedder))  # já memorizado pela busca
+        nova = RespostaGuardada(pergunta, especialista, resposta, time.monotonic() + self.ttl)
+        chave = self._chave(empresa_id)
+        while True:
+            with self._lock:
+                atuais = self._empresas.get(chave)
+            entradas = self._com_nova(atuais, nova, vetor, embedder.model_id)  # cópia montada fora do lock
+            with self._lock:
+                if self._empresas.get(chave) is not atuais:
+                    continue  # outra gravação (ou invalidação) da empresa entrou antes: refaz sobre ela
+                self._empresas.pop(chave, None)
+                self._empresas[chave] = entradas
+                while len(self._empresas) > self.max_empresas:
+                    self._empresas.popitem(last=False)
+                self.contagem["gravacoes"] += 1
+            return True
+
+    def _com_nova(self, atuais, nova, vetor, modelo):
+        # Mantém as respostas válidas que não são equivalentes à nova (a nova as substitui), até por_empresa
+        manter = []
+        if atuais and atuais.compativel(modelo, vetor):
+            agora = time.monotonic()
+            manter = [
+                i for i, (resposta, score) in enumerate(zip(atuais.respostas, atuais.similaridades(vetor)))
+                if resposta.expira_em > agora and score < self.min_similaridade
+            ]
+        manter = manter[-(self.por_empresa - 1):] if self.por_empresa > 1 else []
+        dim = len(vetor)
+        vetores = array("f")
+        for i in manter:
+            vetores.extend(atuais.vetores[i * dim:(i + 1) * dim])
+        vetores.extend(vetor)
+        return RespostasEmpresa(modelo, dim, [atuais.respostas[i] for i in manter] + [nova], vetores)
+
+    def invalidar(self, empresa_id=None):
+        with self._lock:
+            self.contagem["invalidacoes"] += 1
+            if empresa_id is None:
+                self._empresas.clear()
+            else:
+                self._empresas.pop(self._chave(empresa_id), None)
+
+    def _iniciar_observador(self):
+        if not self.watch or self._observador is not None:
+            return
+        with self._lock:
+            if self._observador is None:
+                self._observador = threading.Thread(target=self._observar, name="respostas-watch", daemon=True)
+                self._observador.start()
+
+    def _observar(self):
+        # Ao (re)abrir o change stream tudo é invalidado: alterações feitas enquanto estava fechado se perderam.
+        espera = 1
+        while not self._parar.is_set():
+            try:
+                collection = get_db()[COLLECTION_RECEITAS]
+                with collection.watch(full_document="updateLookup", max_await_time_ms=5000) as stream:
+                    self.invalidar()
+                    espera = 1
+                    while not self._parar.is_set() and stream.alive:
+                        evento = stream.try_next()
+                        if evento is None:
+                            continue
+                        with self._lock:
+                            self.contagem["notificacoes"] += 1
+                        # remoções não trazem o documento: sem saber a empresa, limpa tudo
+                        empresa_id = (evento.get("fullDocument") or {}).get("empresaId")
+                        self.invalidar(empresa_id)
+            except Exception as e:
+                print(f"Change stream de {COLLECTION_RECEITAS} interrompido: {e}")
+                self._parar.wait(espera)
+                espera = min(espera * 2, 60)
+
+    def fechar(self):
+        self._parar.set()
+
+    def stats(self):
+        with self._lock:
+            total = self.contagem["hits"] + self.contagem["misses"]
+            return {
+                **self.contagem,
+                "empresas": len(self._empresas),
+                "respostas": sum(len(e.respostas) for e in self._empresas.values()),
+                "hit_rate": self.contagem["hits"] / total if total else 0.0,
+                "watch": self._observador is not None,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache_respostas() -> CacheRespostas:
+    # Um cache por processo; o observador (thread + change stream) não sobrevive a fork
+    global _cache
+    if _cache is None or _cache.pid != os.getpid():
+        with _cache_lock:
+            if _cache is None or _cache.pid != os.getpid():
+                _cache = CacheRespostas()
+    return _cache
+
+
+def _reset_apos_fork():
+    global _cache, _cache_lock
+    _cache_lock = threading.Lock()
+    _cache = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_apos_fork)
+
+
+def respostas_stats() -> dict:
+    if not RESPOSTAS_CACHE or _cache is None or _cache.pid != os.getpid():
+        return {}
+    return _cache.stats()
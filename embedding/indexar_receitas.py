@@ -0,0 +1,323 @@
+"""
+Gera/atualiza os embeddings das receitas em lote (substitui o loop do receita_embedding.ipynb).
+
+Cada receita guarda, junto do vetor, o hash do texto de gerar_texto_embedding (embeddingHash) e o
+modelo usado (embeddingModelo): receitas cujo texto e modelo não mudaram são puladas.
+
+Uso (a partir da raiz do repositório):
+    python -m embedding.indexar_receitas --collection receitas2
+    python -m embedding.indexar_receitas --somente-faltantes        # {"embedding": {"$exists": False}}
+    python -m embedding.indexar_receitas --reiniciar                # ignora o checkpoint salvo
+    python -m embedding.indexar_receitas --forcar                   # recalcula mesmo sem alteração
+    python -m embedding.indexar_receitas --continuo                 # acompanha o change stream
+    python -m embedding.indexar_receitas --criar-indices            # cria/atualiza os índices vetorial e de texto
+"""
+import os
+import time
+import argparse
+import threading
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pymongo import UpdateOne
+from bson import json_util
+
+from embeddings import get_embedder, gerar_texto_embedding, hash_texto_embedding
+from mongo_client import get_db
+from mongo_tools import garantir_indices_busca
+
+PROJECAO = {"nome": 1, "descricao": 1, "ingredientes": 1, "modoPreparo": 1, "embeddingHash": 1, "embeddingModelo": 1}
+
+
+def segundos_retry_after(valor):
+    # Retry-After vem em segundos ou como data HTTP (RFC 9110); valor ilegível é ignorado
+    if not valor:
+        return 0.0
+    try:
+        return max(0.0, float(valor))
+    except (TypeError, ValueError):
+        pass
+    try:
+        data = parsedate_to_datetime(valor)
+    except (TypeError, ValueError):
+        return 0.0
+    if data.tzinfo is None:
+        data = data.replace(tzinfo=timezone.utc)
+    return max(0.0, (data - datetime.now(timezone.utc)).total_seconds())
+
+
+class RateLimiter:
+    """
+    Controle adaptativo de ritmo (AIMD): o intervalo entre requisições cai pela metade a cada
+    sucesso e dobra quando a API sinaliza limite (429/503), respeitando o Retry-After.
+    """
+
+    def __init__(self, minimo=0.0, inicial=0.0, maximo=60.0):
+        self.minimo = minimo
+        self.maximo = maximo
+        self.intervalo = inicial
+        self._proxima = 0.0
+        self._lock = threading.Lock()  # compartilhado entre as threads de embedding
+
+    def aguardar(self):
+        # reserva o próximo horário livre e dorme fora do lock
+        with self._lock:
+            agora = time.monotonic()
+            horario = max(agora, self._proxima)
+            self._proxima = horario + self.intervalo
+        if horario > agora:
+            time.sleep(horario - agora)
+
+    def sucesso(self):
+        with self._lock:
+            self.intervalo = max(self.minimo, self.intervalo / 2)
+
+    def limite(self, retry_after=None):
+        with self._lock:
+            self.intervalo = min(self.maximo, max(self.intervalo * 2, 1.0, segundos_retry_after(retry_after)))
+            self._proxima = time.monotonic() + self.intervalo
+
+
+def _status_http(erro):
+    resposta = getattr(erro, "response", None)
+    return getattr(resposta, "status_code", None), getattr(resposta, "headers", {}) or {}
+
+
+def embed_lote(embedder, textos, limiter, tentativas=5):
+    for tentativa in range(1, tentativas + 1):
+        limiter.aguardar()
+        try:
+            vetores = embedder.embed(textos)
+            limiter.sucesso()
+            return vetores
+        except Exception as e:
+            status, headers = _status_http(e)
+            if tentativa == tentativas or (status is not None and status not in (429, 500, 502, 503, 504)):
+                raise
+            limiter.limite(headers.get("Retry-After") if status in (429, 503) else None)
+
+
+def preparar_operacoes(lote, embedder, limiter, forcar=False):
+    """
+    Gera os UpdateOne do lote, embedando apenas as receitas cujo texto/modelo mudou.
+    Retorna (operacoes, inalterados).
+    """
+    pendentes = []
+    inalterados = 0
+    for doc in lote:
+        texto = gerar_texto_embedding(doc)
+        if not texto:
+            continue
+        hash_texto = hash_texto_embedding(texto)
+        if not forcar and doc.get("embeddingHash") == hash_texto and doc.get("embeddingModelo") == embedder.model_id:
+            inalterados += 1
+            continue
+        pendentes.append((doc, texto, hash_texto))
+
+    if not pendentes:
+        return [], inalterados
+
+    vetores = embed_lote(embedder, [t for _, t, _ in pendentes], limiter)
+    agora = datetime.now(timezone.utc)
+    operacoes = [
+        UpdateOne(
+            {"_id": doc["_id"]},
+            {"$set": {
+                "embedding": vetor,
+                "embeddingHash": hash_texto,
+                "embeddingModelo": embedder.model_id,
+                "embeddingAtualizadoEm": agora,
+            }},
+        )
+        for (doc, _, hash_texto), vetor in zip(pendentes, vetores)
+    ]
+    return operacoes, inalterados
+
+
+def ler_checkpoint(caminho):
+    if not caminho or not os.path.exists(caminho):
+        return None
+    with open(caminho) as f:
+        return json_util.loads(f.read())
+
+
+def salvar_checkpoint(caminho, dados):
+    if not caminho:
+        return
+    tmp = f"{caminho}.tmp"
+    with open(tmp, "w") as f:
+        f.write(json_util.dumps(dados))
+    os.replace(tmp, caminho)  # escrita atômica: um crash nunca deixa o checkpoint pela metade
+
+
+def lotes(cursor, tamanho):
+    lote = []
+    for doc in cursor:
+        lote.append(doc)
+        if len(lote) == tamanho:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+
+def indexar(collection, filtro=None, batch_size=32, concorrencia=4, checkpoint=None, reiniciar=False,
+            forcar=False, embedder=None, limiter=None):
+    embedder = embedder or get_embedder()
+    limiter = limiter or RateLimiter()
+    filtro = dict(filtro or {})
+
+    estado = None if reiniciar else ler_checkpoint(checkpoint)
+    if estado and estado.get("collection") == collection.name and estado.get("filtro") == filtro and estado.get("ultimo_id") is not None:
+        print(f"Retomando após _id {estado['ultimo_id']} ({estado['processados']} já processados)")
+    else:
+        estado = {"collection": collection.name, "filtro": filtro, "ultimo_id": None, "processados": 0, "inalterados": 0, "erros": 0}
+
+    consulta = dict(filtro)
+    if estado["ultimo_id"] is not None:
+        consulta = {"$and": [filtro, {"_id": {"$gt": estado["ultimo_id"]}}]}
+
+    # Ordenado por _id para que o checkpoint (último _id gravado) seja suficiente para retomar
+    cursor = collection.find(consulta, PROJECAO, no_cursor_timeout=True).sort("_id", 1).batch_size(batch_size * concorrencia)
+
+    def processar(lote):
+        try:
+            operacoes, inalterados = preparar_operacoes(lote, embedder, limiter, forcar)
+            return lote, operacoes, inalterados, None
+        except Exception as e:
+            return lote, [], 0, e
+
+    inicio = time.monotonic()
+    try:
+        with ThreadPoolExecutor(max_workers=concorrencia) as executor:
+            pendentes = deque()
+            for lote in lotes(cursor, batch_size):
+                pendentes.append(executor.submit(processar, lote))
+                if len(pendentes) < concorrencia:
+                    continue
+                _gravar(collection, pendentes.popleft(), estado, checkpoint, inicio)
+            while pendentes:
+                _gravar(collection, pendentes.popleft(), estado, checkpoint, inicio)
+    finally:
+        cursor.close()
+
+    # Execução completa: o próximo run recomeça do início (e pula o que não mudou)
+    estado["ultimo_id"] = None
+    salvar_checkpoint(checkpoint, estado)
+    print(f"Concluído: {estado['processados']} embeddings gerados, {estado['inalterados']} inalterados, "
+          f"{estado['erros']} com erro, {time.monotonic() - inicio:.1f}s")
+    return estado
+
+
+def _gravar(collection, futuro, estado, checkpoint, inicio):
+    # Os lotes são consumidos na ordem em que foram submetidos, então o checkpoint só avança
+    # depois que todos os lotes anteriores foram gravados.
+    lote, operacoes, inalterados, erro = futuro.result()
+    if erro is None and operacoes:
+        try:
+            collection.bulk_write(operacoes, ordered=False)
+        except Exception as e:
+            erro = e
+
+    if erro is not None:
+        # O lote que falhou é pulado (fica sem embedding); uma execução com --somente-faltantes o reprocessa.
+        print(f"Erro no lote {lote[0]['_id']}..{lote[-1]['_id']}: {erro}")
+        estado["erros"] += len(lote)
+    else:
+        estado["processados"] += len(operacoes)
+        estado["inalterados"] += inalterados
+
+    estado["ultimo_id"] = lote[-1]["_id"]
+    salvar_checkpoint(checkpoint, estado)
+    taxa = estado["processados"] / max(time.monotonic() - inicio, 1e-9)
+    print(f"Embeddings salvos: {estado['processados']} ({taxa:.1f}/s), inalterados: {estado['inalterados']} - último: {lote[-1].get('nome')}")
+
+
+def acompanhar(collection, batch_size=32, espera_max=1.0, checkpoint=None, embedder=None, limiter=None):
+    """
+    Indexação contínua via change stream (requer replica set/Atlas): receitas inseridas ou editadas
+    são embedadas em micro-lotes de até `batch_size` documentos ou `espera_max` segundos.
+    O resume token fica no checkpoint e só avança depois que o micro-lote foi gravado: um lote com
+    erro é mantido e tentado de novo (espera exponencial), então nem um restart nem uma falha perdem alterações.
+    """
+    embedder = embedder or get_embedder()
+    limiter = limiter or RateLimiter()
+
+    estado = ler_checkpoint(checkpoint) or {}
+    token = estado.get("resume_token") if estado.get("collection") == collection.name else None
+    estado = {**estado, "collection": collection.name}
+
+    pipeline = [
+        {"$match": {"operationType": {"$in": ["insert", "update", "replace"]}}},
+        {"$project": {"fullDocument.embedding": 0}},  # o vetor não é necessário para comparar o hash
+    ]
+    print(f"Acompanhando alterações em '{collection.name}'...")
+    with collection.watch(pipeline, full_document="updateLookup", resume_after=token, max_await_time_ms=500) as stream:
+        pendentes = {}
+        prazo = None
+        espera = 1
+        while stream.alive:
+            mudanca = stream.try_next()
+            if mudanca is not None and mudanca.get("fullDocument"):
+                doc = mudanca["fullDocument"]
+                pendentes[doc["_id"]] = doc  # várias edições do mesmo documento viram uma só
+                prazo = prazo or time.monotonic() + espera_max
+
+            if pendentes and (len(pendentes) >= batch_size or time.monotonic() >= prazo):
+                try:
+                    # Nossas próprias gravações também chegam pelo stream, mas são puladas pelo hash.
+                    operacoes, _ = preparar_operacoes(list(pendentes.values()), embedder, limiter)
+                    if operacoes:
+                        collection.bulk_write(operacoes, ordered=False)
+                        print(f"Embeddings atualizados: {len(operacoes)}")
+                except Exception as e:
+                    # o lote fica em `pendentes` e o resume token não avança até ele ser gravado
+                    print(f"Erro ao indexar alterações, nova tentativa em {espera}s: {e}")
+                    time.sleep(espera)
+                    espera = min(espera * 2, 60)
+                    continue
+                pendentes, prazo, espera = {}, None, 1
+
+            if not pendentes and stream.resume_token is not None:
+                estado["resume_token"] = stream.resume_token
+                salvar_checkpoint(checkpoint, estado)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Gera embeddings das receitas em lote.")
+    parser.add_argument("--collection", default="receitas")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--concorrencia", type=int, default=4)
+    parser.add_argument("--somente-faltantes", action="store_true", help='apenas documentos sem "embedding"')
+    parser.add_argument("--filtro", default=None, help="filtro extra em JSON (Extended JSON do Mongo)")
+    parser.add_argument("--checkpoint", default=None, help="arquivo de checkpoint (padrão: .indexar_<collection>.json)")
+    parser.add_argument("--reiniciar", action="store_true", help="ignora o checkpoint existente")
+    parser.add_argument("--forcar", action="store_true", help="recalcula mesmo receitas com hash/modelo iguais")
+    parser.add_argument("--continuo", action="store_true", help="após a carga inicial, acompanha o change stream")
+    parser.add_argument("--criar-indices", action="store_true", help="cria/atualiza os índices de busca (mongo_tools.INDICES_BUSCA) antes de indexar")
+    args = parser.parse_args(argv)
+
+    filtro = json_util.loads(args.filtro) if args.filtro else {}
+    if args.somente_faltantes:
+        filtro["embedding"] = {"$exists": False}
+
+    collection = get_db()[args.collection]
+    checkpoint = args.checkpoint or f".indexar_{args.collection}.json"
+    if args.criar_indices:
+        garantir_indices_busca(collection)
+    indexar(
+        collection,
+        filtro=filtro,
+        batch_size=args.batch_size,
+        concorrencia=args.concorrencia,
+        checkpoint=checkpoint,
+        reiniciar=args.reiniciar,
+        forcar=args.forcar,
+    )
+    if args.continuo:
+        acompanhar(collection, batch_size=args.batch_size, checkpoint=checkpoint)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,404 @@
+import os
+import math
+import asyncio
+import hashlib
+import threading
+import unicodedata
+import requests
+from abc import ABC, abstractmethod
+from array import array
+from dotenv import load_dotenv
+from cache import TTLCache
+from telemetria import medir
+
+load_dotenv()
+
+model_name = "paraphrase-multilingual-MiniLM-L12-v2"
+EMBEDDING_DIM = 384
+EMBEDDER = os.getenv("EMBEDDER", "http")  # http | local | stub
+HUGGING_FACE_TOKEN = os.getenv("HUGGING_FACE_TOKEN")
+API_URL = f"https://router.huggingface.co/hf-inference/models/sentence-transformers/{model_name}/pipeline/feature-extraction"
+EMBEDDING_HTTP_TIMEOUT = float(os.getenv("EMBEDDING_HTTP_TIMEOUT", "30"))
+EMBEDDING_WAIT_FOR_MODEL = os.getenv("EMBEDDING_WAIT_FOR_MODEL", "true").lower() == "true"
+EMBEDDING_LOCAL_BACKEND = os.getenv("EMBEDDING_LOCAL_BACKEND", "torch")  # torch | onnx
+EMBEDDING_QUANTIZE = os.getenv("EMBEDDING_QUANTIZE", "false").lower() == "true"  # int8 (apenas onnx)
+EMBEDDING_ONNX_FILE = os.getenv("EMBEDDING_ONNX_FILE", "onnx/model_quint8_avx2.onnx")
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "2048"))
+EMBEDDING_CACHE_TTL = float(os.getenv("EMBEDDING_CACHE_TTL", "86400"))
+EMBEDDING_CACHE_REDIS_URL = os.getenv("EMBEDDING_CACHE_REDIS_URL")  # opcional: cache compartilhado entre workers
+
+
+def gerar_texto_embedding(doc):
+    # Mesmo texto usado para gerar os embeddings já salvos nas receitas (ver embedding/receita_embedding.ipynb)
+    partes = []
+
+    # nome
+    if "nome" in doc and doc["nome"]:
+        partes.append(f"Nome: {doc['nome']}.")
+
+    # descrição
+    if "descricao" in doc and doc["descricao"]:
+        partes.append(f"Descrição: {doc['descricao']}.")
+
+    # ingredientes
+    if "ingredientes" in doc and isinstance(doc["ingredientes"], list) and doc["ingredientes"]:
+        nomes_ingredientes = [i.get("nome") for i in doc["ingredientes"] if i.get("nome")]
+        if nomes_ingredientes:
+            partes.append(f"Ingrediente(s): {', '.join(nomes_ingredientes)}.")
+
+    # modo de preparo
+    if "modoPreparo" in doc and isinstance(doc["modoPreparo"], list) and doc["modoPreparo"]:
+        passos = [p.get('passo', '') for p in doc.get('modoPreparo', [])]
+        if passos:
+            partes.append(f"Modo de preparo: {' '.join(passos)}")
+
+    # montar texto final
+    texto = "\n".join(partes).strip()
+    return texto or None  # retorna None se nada aproveitável existir
+
+
+def hash_texto_embedding(texto):
+    # Hash do texto que gerou o embedding: se não mudou, o vetor salvo continua válido
+    return hashlib.sha256(texto.encode("utf-8")).hexdigest()
+
+
+class Embedder(ABC):
+    """
+    Interface dos backends de embedding. `embed` recebe uma string (retorna um vetor)
+    ou uma lista de strings (retorna uma lista de vetores), como a API de feature-extraction.
+    Backends implementam pelo menos `embed_batch`.
+    """
+    name = "base"
+    model = model_name
+    dim = EMBEDDING_DIM
+
+    @property
+    def model_id(self):
+        # Identifica a versão dos vetores gravados nas receitas (embeddingModelo)
+        return self.model
+
+    @abstractmethod
+    def embed_batch(self, texts: list[str]) -> list[list[float]]:
+        ...
+
+    def embed(self, texts):
+        if isinstance(texts, str):
+            return self.embed_batch([texts])[0]
+        return self.embed_batch(list(texts))
+
+    async def aembed_batch(self, texts: list[str]) -> list[list[float]]:
+        # Padrão: roda o backend síncrono numa thread para não bloquear o event loop
+        return await asyncio.to_thread(self.embed_batch, texts)
+
+    async def aembed(self, texts):
+        if isinstance(texts, str):
+            return (await self.aembed_batch([texts]))[0]
+        return await self.aembed_batch(list(texts))
+
+    async def aclose(self):
+        pass
+
+
+class HttpEmbedder(Embedder):
+    """Hugging Face Inference (router), o backend original."""
+    name = "http"
+
+    def __init__(self, url=API_URL, token=HUGGING_FACE_TOKEN, timeout=EMBEDDING_HTTP_TIMEOUT,
+                 wait_for_model=EMBEDDING_WAIT_FOR_MODEL):
+        self.url = url
+        self.timeout = timeout
+        self.wait_for_model = wait_for_model
+        self.session = requests.Session()  # reaproveita a conexão TLS entre chamadas
+        self.session.headers.update({"Authorization": f"Bearer {token}"})
+        self._headers = {"Authorization": f"Bearer {token}"}
+        self._asessoes = {}  # event loop -> (aiohttp.ClientSession, guardião); uma sessão só funciona no seu loop
+        self._asessoes_lock = threading.Lock()
+
+    def embed_batch(self, texts):
+        #wait_for_model espera pelo modelo caso ele esteja sobrecarregado, ao invés de retornar um erro
+        response = self.session.post(
+            self.url,
+            json={"inputs": texts, "options": {"wait_for_model": self.wait_for_model}},
+            timeout=self.timeout,
+        )
+        if response.status_code != 200:
+            print(f"{response.status_code} - {response.reason}: {response.text}")
+        response.raise_for_status()
+        return response.json()
+
+    async def aembed_batch(self, texts):
+        import aiohttp
+
+        loop = asyncio.get_running_loop()
+        atual = self._asessoes.get(loop)
+        if atual is None or atual[0].closed:
+            sessao = aiohttp.ClientSession(headers=self._headers, timeout=aiohttp.ClientTimeout(total=self.timeout))
+            guardiao = _fechar_no_fim_do_loop(sessao)
+            await guardiao.__anext__()
+            with self._asessoes_lock:
+                # loops já fechados tiveram a sessão fechada pelo guardião; só sai a referência
+                for antigo in [l for l in self._asessoes if l.is_closed()]:
+                    del self._asessoes[antigo]
+                self._asessoes[loop] = atual = (sessao, guardiao)
+        payload = {"inputs": texts, "options": {"wait_for_model": self.wait_for_model}}
+        async with atual[0].post(self.url, json=payload) as response:
+            if response.status != 200:
+                print(f"{response.status} - {response.reason}: {await response.text()}")
+            response.raise_for_status()
+            return await response.json()
+
+    async def aclose(self):
+        # Cada sessão é fechada no próprio loop; loops de outras threads recebem o fechamento agendado
+        loop = asyncio.get_running_loop()
+        with self._asessoes_lock:
+            sessoes, self._asessoes = self._asessoes, {}
+        for dono, (_, guardiao) in sessoes.items():
+            if dono is loop:
+                await guardiao.aclose()
+            elif dono.is_running() and not dono.is_closed():
+                await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(guardiao.aclose(), dono))
+
+
+async def _fechar_no_fim_do_loop(sessao):
+    # Gerador assíncrono mantido suspenso enquanto a sessão é usada: asyncio.run() (e o uvicorn) chamam
+    # loop.shutdown_asyncgens() antes de fechar o loop, o que executa o finally ainda dentro dele.
+    # Sem isso, a sessão de um loop que terminou (ex.: um asyncio.run por lote) ficaria aberta para sempre.
+    try:
+        yield
+    finally:
+        await sessao.close()
+
+
+class LocalEmbedder(Embedder):
+    """
+    Modelo carregado em CPU dentro do processo (sentence-transformers, opcionalmente via ONNX Runtime).
+    Sem normalização, igual ao pipeline de feature-extraction usado para gerar os vetores do Mongo.
+    """
+    name = "local"
+
+    def __init__(self, backend=EMBEDDING_LOCAL_BACKEND, quantize=EMBEDDING_QUANTIZE, onnx_file=EMBEDDING_ONNX_FILE):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError as e:
+            raise RuntimeError("EMBEDDER=local requer o pacote 'sentence-transformers' (e 'optimum[onnxruntime]' para onnx).") from e
+
+        kwargs = {"device": "cpu"}
+        if backend == "onnx":
+            kwargs["backend"] = "onnx"
+            if quantize:
+                # pesos int8 publicados no repositório do modelo
+                kwargs["model_kwargs"] = {"file_name": onnx_file}
+        self.backend = backend
+        self.quantize = quantize
+        self.model_st = SentenceTransformer(f"sentence-transformers/{model_name}", **kwargs)
+
+    @property
+    def model_id(self):
+        return f"{self.model}-int8" if self.backend == "onnx" and self.quantize else self.model
+
+    def embed_batch(self, texts):
+        vetores = self.model_st.encode(texts, batch_size=32, normalize_embeddings=False, convert_to_numpy=True)
+        return vetores.tolist()
+
+
+def _normalizar_token(token):
+    token = unicodedata.normalize("NFKD", token.lower())
+    return "".join(c for c in token if c.isalnum())
+
+
+class StubEmbedder(Embedder):
+    """
+    Backend determinístico e offline (feature hashing das palavras) para testes e benchmarks.
+    Textos com palavras em comum geram vetores próximos; não é compatível com os vetores do Mongo.
+    """
+    name = "stub"
+    model = "stub-hashing"
+
+    def _vetor(self, texto):
+        vetor = [0.0] * self.dim
+        for token in (texto or "").split():
+            token = _normalizar_token(token)
+            if not token:
+                continue
+            h = hashlib.blake2b(token.encode(), digest_size=8).digest()
+            idx = int.from_bytes(h[:4], "little") % self.dim
+            vetor[idx] += 1.0 if h[4] & 1 else -1.0
+        norma = math.sqrt(sum(v * v for v in vetor)) or 1.0
+        return [v / norma for v in vetor]
+
+    def embed_batch(self, texts):
+        return [self._vetor(t) for t in texts]
+
+
+BACKENDS = {
+    "http": HttpEmbedder,
+    "local": LocalEmbedder,
+    "stub": StubEmbedder,
+}
+
+# Um embedder por processo (o modelo local é carregado uma única vez por worker)
+_embedder = None
+_embedder_lock = threading.Lock()
+
+
+def get_embedder() -> Embedder:
+    global _embedder
+    if _embedder is None:
+        with _embedder_lock:
+            if _embedder is None:
+                if EMBEDDER not in BACKENDS:
+                    raise ValueError(f"EMBEDDER inválido: '{EMBEDDER}'. Opções: {', '.join(BACKENDS)}")
+                _embedder = BACKENDS[EMBEDDER]()
+    return _embedder
+
+
+def set_embedder(embedder: Embedder):
+    # Permite trocar o backend em tempo de execução (ex.: testes offline com StubEmbedder)
+    global _embedder
+    _embedder = embedder
+
+
+def normalizar_texto_busca(texto):
+    # "Nome: Hambúrguer  " e "nome: hambúrguer" viram a mesma chave (memo das tools de busca)
+    return " ".join(unicodedata.normalize("NFC", texto).lower().split())
+
+
+def texto_para_embedding(texto):
+    # Texto exatamente como vai ao modelo e à chave do cache de embeddings: só espaços e forma Unicode
+    # normalizados. A caixa é mantida porque o modelo a distingue.
+    return " ".join(unicodedata.normalize("NFC", texto).split())
+
+
+class EmbeddingCache:
+    """
+    Cache dos embeddings de consulta: LRU+TTL em memória e, opcionalmente, Redis compartilhado
+    entre os workers. Vetores ficam como float32 compactos (array('f')), não listas de float.
+    """
+
+    def __init__(self, maxsize=EMBEDDING_CACHE_SIZE, ttl=EMBEDDING_CACHE_TTL, redis_url=EMBEDDING_CACHE_REDIS_URL):
+        self.ttl = ttl
+        self.local = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.shared_hits = 0
+        self.shared_errors = 0
+        self.redis = None
+        if redis_url:
+            try:
+                import redis
+            except ImportError as e:
+                raise RuntimeError("EMBEDDING_CACHE_REDIS_URL requer o pacote 'redis'.") from e
+            # timeouts curtos: o cache nunca pode ficar mais lento que gerar o embedding
+            self.redis = redis.Redis.from_url(redis_url, socket_timeout=0.2, socket_connect_timeout=0.2)
+
+    def chave(self, texto, model):
+        # `texto` já preparado por texto_para_embedding: a chave é do texto que gerou o vetor
+        digest = hashlib.blake2b(texto.encode(), digest_size=16).hexdigest()
+        return f"chefia:emb2:{model}:{digest}"
+
+    def get(self, chave):
+        vetor = self.local.get(chave)
+        if vetor is not None or self.redis is None:
+            return vetor
+        try:
+            dados = self.redis.get(chave)
+        except Exception:
+            self.shared_errors += 1
+            return None
+        if dados is None:
+            return None
+        vetor = array("f")
+        vetor.frombytes(dados)
+        self.shared_hits += 1
+        self.local.set(chave, vetor)
+        return vetor
+
+    def set(self, chave, vetor):
+        vetor = array("f", vetor)
+        self.local.set(chave, vetor)
+        if self.redis is not None:
+            try:
+                self.redis.set(chave, vetor.tobytes(), ex=int(self.ttl))
+            except Exception:
+                self.shared_errors += 1
+        return vetor
+
+    def stats(self):
+        stats = self.local.stats()
+        stats["shared"] = self.redis is not None
+        stats["shared_hits"] = self.shared_hits
+        stats["shared_errors"] = self.shared_errors
+        return stats
+
+
+_embedding_cache = None
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    global _embedding_cache
+    if _embedding_cache is None:
+        with _embedder_lock:
+            if _embedding_cache is None:
+                _embedding_cache = EmbeddingCache()
+    return _embedding_cache
+
+
+def embed_query(texto, embedder: Embedder = None) -> list[float]:
+    # Embedding de um texto de busca, memorizado pelo mesmo texto que é enviado ao modelo
+    embedder = embedder or get_embedder()
+    cache = get_embedding_cache()
+    texto = texto_para_embedding(texto)
+    chave = cache.chave(texto, embedder.model)
+    vetor = cache.get(chave)
+    if vetor is None:
+        with medir("embedding", backend=embedder.name):
+            vetor = cache.set(chave, embedder.embed(texto))
+    return vetor.tolist()
+
+
+async def aembed_query(texto, embedder: Embedder = None) -> list[float]:
+    # Versão async de embed_query (usada pelo modo ASGI)
+    embedder = embedder or get_embedder()
+    cache = get_embedding_cache()
+    texto = texto_para_embedding(texto)
+    chave = cache.chave(texto, embedder.model)
+    vetor = cache.get(chave)
+    if vetor is None:
+        with medir("embedding", backend=embedder.name):
+            vetor = cache.set(chave, await embedder.aembed(texto))
+    return vetor.tolist()
+
+
+def cosseno(a, b):
+    num = sum(x * y for x, y in zip(a, b))
+    den = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return num / den if den else 0.0
+
+
+def verificar_compatibilidade(collection, embedder: Embedder = None, amostras=20, minimo=0.99):
+    """
+    Compara o embedding gerado pelo backend com o já salvo em `amostras` receitas da collection.
+    Retorna a menor similaridade encontrada e se todas ficaram acima de `minimo`.
+    """
+    embedder = embedder or get_embedder()
+    docs = [d for d in collection.find({"embedding": {"$exists": True}}).limit(amostras) if gerar_texto_embedding(d)]
+    if not docs:
+        return {"ok": False, "amostras": 0, "min_cosseno": None}
+
+    vetores = embedder.embed([gerar_texto_embedding(d) for d in docs])
+    similaridades = [cosseno(v, d["embedding"]) for v, d in zip(vetores, docs)]
+    return {
+        "ok": min(similaridades) >= minimo,
+        "amostras": len(docs),
+        "min_cosseno": min(similaridades),
+        "media_cosseno": sum(similaridades) / len(similaridades),
+    }
+
+
+if __name__ == "__main__":
+    # python embeddings.py [collection] -> checa se o backend configurado reproduz os vetores salvos
+    import sys
+    from mongo_client import get_db
+
+    nome_collection = sys.argv[1] if len(sys.argv) > 1 else "receitas"
+    resultado = verificar_compatibilidade(get_db()[nome_collection])
+    print(f"Backend '{get_embedder().name}': {resultado}")
+    sys.exit(0 if resultado["ok"] else 1)
@@ -0,0 +1,140 @@
+"""
+Execução especulativa da rota de receitas (ESPECULACAO_RECEITAS): enquanto o roteador LLM decide a rota,
+o embedding da mensagem e a busca de receitas candidatas já rodam em paralelo. Se a rota for receitas,
+as candidatas entram no CONTEXTO do especialista, que pode responder sem chamar query_receitas; se não,
+o resultado é descartado. Cada pré-busca termina com um desfecho (usada, descartada, expirada, falha)
+e a sua duração vai para chefia_especulacao_duracao_segundos: o que não foi usado é trabalho desperdiçado.
+"""
+import os
+import json
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout
+from dotenv import load_dotenv
+
+from mongo_tools import pre_buscar_receitas, apre_buscar_receitas
+from telemetria import registrar_especulacao, registrar_espera_especulacao
+
+load_dotenv()
+
+ESPECULACAO_RECEITAS = os.getenv("ESPECULACAO_RECEITAS", "false").lower() == "true"
+ESPECULACAO_TIMEOUT = float(os.getenv("ESPECULACAO_TIMEOUT", "2"))        # espera máxima depois da decisão de rota
+ESPECULACAO_THREADS = int(os.getenv("ESPECULACAO_THREADS", "4"))
+ESPECULACAO_CANDIDATAS = int(os.getenv("ESPECULACAO_CANDIDATAS", "5"))
+SEM_CANDIDATAS = "(não consultadas)"
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    # Threads não sobrevivem a fork: um pool por processo
+    global _executor, _executor_pid
+    if _executor is None or _executor_pid != os.getpid():
+        with _executor_lock:
+            if _executor is None or _executor_pid != os.getpid():
+                _executor = ThreadPoolExecutor(max_workers=ESPECULACAO_THREADS, thread_name_prefix="especulacao")
+                _executor_pid = os.getpid()
+    return _executor
+
+
+def formatar_candidatas(receitas):
+    return json.dumps(receitas, ensure_ascii=False) if receitas else "(nenhuma encontrada)"
+
+
+class PreBusca:
+    """Pré-busca em andamento (Future de thread ou Task asyncio) e o registro do seu desfecho."""
+
+    def __init__(self, futuro):
+        self.futuro = futuro
+        self.inicio = time.perf_counter()
+        self.duracao = None
+        self.desfecho = None
+        self._registrada = False
+        self._lock = threading.Lock()
+        futuro.add_done_callback(self._terminou)
+
+    @staticmethod
+    def _empresa(empresa_id):
+        # empresa_id chega como str pelo JSON do /chat; o filtro do Mongo é numérico
+        try:
+            return int(empresa_id)
+        except (TypeError, ValueError):
+            return None
+
+    @classmethod
+    def iniciar(cls, empresa_id, pergunta):
+        empresa = cls._empresa(empresa_id)
+        if empresa is None:
+            return None
+        return cls(_get_executor().submit(pre_buscar_receitas, pergunta, empresa, ESPECULACAO_CANDIDATAS))
+
+    @classmethod
+    def ainiciar(cls, empresa_id, pergunta):
+        empresa = cls._empresa(empresa_id)
+        if empresa is None:
+            return None
+        return cls(asyncio.ensure_future(apre_buscar_receitas(pergunta, empresa, ESPECULACAO_CANDIDATAS)))
+
+    def _terminou(self, futuro):
+        self.duracao = time.perf_counter() - self.inicio
+        if not futuro.cancelled():
+            futuro.exception()  # marca a exceção como vista (descartadas nunca são aguardadas)
+        self._registrar()
+
+    def _decidir(self, desfecho):
+        self.desfecho = desfecho
+        self._registrar()
+
+    def _registrar(self):
+        # a duração só é conhecida quando a busca termina, que pode ser antes ou depois da decisão
+        with self._lock:
+            if self._registrada or self.desfecho is None or self.duracao is None:
+                return
+            self._registrada = True
+        registrar_especulacao(self.desfecho, self.duracao)
+
+    def _resultado(self, receitas):
+        self._decidir("usada")
+        return formatar_candidatas(receitas)
+
+    def _falhou(self, desfecho, erro=None):
+        if erro is not None:
+            print(f"Pré-busca de receitas falhou: {erro}")
+        self._decidir(desfecho)
+        return SEM_CANDIDATAS
+
+    def usar(self):
+        """Candidatas formatadas para o CONTEXTO do especialista (espera até ESPECULACAO_TIMEOUT)."""
+        inicio = time.perf_counter()
+        try:
+            receitas = self.futuro.result(timeout=ESPECULACAO_TIMEOUT)
+        except FuturesTimeout:
+            return self._falhou("expirada")
+        except Exception as e:
+            return self._falhou("falha", e)
+        finally:
+            registrar_espera_especulacao(time.perf_counter() - inicio)
+        return self._resultado(receitas)
+
+    async def ausar(self):
+        inicio = time.perf_counter()
+        try:
+            receitas = await asyncio.wait_for(self.futuro, ESPECULACAO_TIMEOUT)  # cancela a task se expirar
+        except asyncio.TimeoutError:
+            return self._falhou("expirada")
+        except Exception as e:
+            return self._falhou("falha", e)
+        finally:
+            registrar_espera_especulacao(time.perf_counter() - inicio)
+        return self._resultado(receitas)
+
+    def descartar(self):
+        # rota diferente de receitas ou fluxo interrompido; a Task asyncio é cancelada, a thread termina a
+        # busca e é contabilizada. Sem efeito se a pré-busca já tem desfecho (usada ou descartada).
+        if self.desfecho is not None:
+            return
+        self.futuro.cancel()
+        self._decidir("descartada")
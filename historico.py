@@ -0,0 +1,337 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from langchain_core.chat_history import BaseChatMessageHistory, InMemoryChatMessageHistory
+from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
+
+load_dotenv()
+
+HISTORICO_BACKEND = os.getenv("HISTORICO_BACKEND", "memoria")  # memoria | redis
+HISTORICO_REDIS_URL = os.getenv("HISTORICO_REDIS_URL", os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+HISTORICO_MAX_SESSOES = int(os.getenv("HISTORICO_MAX_SESSOES", "1000"))       # sessões em memória por worker
+HISTORICO_MAX_MENSAGENS = int(os.getenv("HISTORICO_MAX_MENSAGENS", "40"))     # mensagens guardadas por sessão
+HISTORICO_TTL = int(os.getenv("HISTORICO_TTL", "3600"))                       # segundos ociosa até expirar
+HISTORICO_RESUMO_MIN_NOVAS = int(os.getenv("HISTORICO_RESUMO_MIN_NOVAS", "4"))  # mensagens fora da janela até atualizar o resumo
+
+# Histórico entregue a cada etapa: últimas N interações (turnos) dentro de um orçamento de tokens.
+# O que fica fora da maior janela entra no resumo acumulado da conversa.
+HISTORICO_JANELAS = {
+    "roteador": {"turnos": 2, "tokens": 600},
+    "receitas": {"turnos": 6, "tokens": 2000},
+    "tarefas": {"turnos": 6, "tokens": 2000},
+    "orquestrador": {"turnos": 1, "tokens": 400},
+}
+HISTORICO_JANELAS.update(json.loads(os.getenv("HISTORICO_JANELAS", "{}")))
+# Só a entrada do roteador é a mensagem do usuário; as das demais etapas (encaminhamento ao especialista,
+# JSON ao orquestrador) são internas. As mensagens gravadas por ela são marcadas e cada uma abre um turno.
+ETAPA_ENTRADA = "roteador"
+
+
+def inicia_turno(mensagem):
+    return isinstance(mensagem, HumanMessage) and bool(mensagem.additional_kwargs.get("turno"))
+
+
+def marcar_turno(mensagem):
+    return mensagem.model_copy(update={"additional_kwargs": {**mensagem.additional_kwargs, "turno": True}})
+
+
+def _aparar(mensagens, maximo):
+    # Mantém só as últimas `maximo` mensagens, começando sempre no início de um turno
+    if len(mensagens) <= maximo:
+        return mensagens
+    mensagens = mensagens[-maximo:]
+    for i, mensagem in enumerate(mensagens):
+        if inicia_turno(mensagem):
+            return mensagens[i:]
+    return []
+
+
+class HistoricoLimitado(InMemoryChatMessageHistory):
+    """Histórico em memória que descarta as mensagens mais antigas acima de `max_mensagens`."""
+    max_mensagens: int = HISTORICO_MAX_MENSAGENS
+    resumo: str = ""
+    resumo_marcador: str = ""  # identifica a última mensagem já incluída no resumo
+
+    def add_message(self, message):
+        super().add_message(message)
+        if len(self.messages) > self.max_mensagens:
+            self.messages = _aparar(self.messages, self.max_mensagens)
+
+    def get_resumo(self):
+        return self.resumo, self.resumo_marcador
+
+    def set_resumo(self, resumo, marcador):
+        self.resumo, self.resumo_marcador = resumo, marcador
+
+
+class HistoricoMemoria:
+    """
+    Sessões em memória do worker: LRU limitado a `max_sessoes`, com expiração por inatividade.
+    O uso de memória fica estável mesmo com tráfego contínuo.
+    """
+
+    def __init__(self, max_sessoes=HISTORICO_MAX_SESSOES, max_mensagens=HISTORICO_MAX_MENSAGENS, ttl=HISTORICO_TTL):
+        self.max_sessoes = max_sessoes
+        self.max_mensagens = max_mensagens
+        self.ttl = ttl
+        self._sessoes = OrderedDict()  # session_id -> (historico, ultimo_acesso)
+        self._lock = threading.Lock()
+        self.removidas = 0
+
+    def get(self, session_id) -> BaseChatMessageHistory:
+        agora = time.monotonic()
+        with self._lock:
+            item = self._sessoes.pop(session_id, None)
+            historico = item[0] if item and agora - item[1] <= self.ttl else HistoricoLimitado(max_mensagens=self.max_mensagens)
+            self._sessoes[session_id] = (historico, agora)
+            self._expirar(agora)
+        return historico
+
+    def _expirar(self, agora):
+        # as menos usadas ficam no início: remove as ociosas e o excedente
+        while self._sessoes:
+            session_id, (_, ultimo_acesso) = next(iter(self._sessoes.items()))
+            if len(self._sessoes) <= self.max_sessoes and agora - ultimo_acesso <= self.ttl:
+                break
+            del self._sessoes[session_id]
+            self.removidas += 1
+
+    def __contains__(self, session_id):
+        return session_id in self._sessoes
+
+    def __getitem__(self, session_id):
+        return self._sessoes[session_id][0]
+
+    def stats(self):
+        return {"backend": "memoria", "sessoes": len(self._sessoes), "max_sessoes": self.max_sessoes, "removidas": self.removidas}
+
+
+TIPOS = {"h": HumanMessage, "a": AIMessage, "s": SystemMessage}
+TIPOS_REVERSO = {"human": "h", "ai": "a", "system": "s"}
+
+
+class HistoricoRedis(BaseChatMessageHistory):
+    """
+    Histórico de uma sessão numa lista do Redis, compartilhado entre workers. Cada mensagem é
+    gravada como ["h"|"a"|"s", conteúdo] (mais os additional_kwargs, se houver, como a marca de turno);
+    a lista é aparada e a expiração renovada a cada escrita.
+    """
+
+    def __init__(self, redis, chave, max_mensagens=HISTORICO_MAX_MENSAGENS, ttl=HISTORICO_TTL):
+        self.redis = redis
+        self.chave = chave
+        self.max_mensagens = max_mensagens
+        self.ttl = ttl
+
+    @property
+    def messages(self):
+        mensagens = []
+        for item in self.redis.lrange(self.chave, 0, -1):
+            tipo, conteudo, *extras = json.loads(item)
+            mensagens.append(TIPOS[tipo](content=conteudo, additional_kwargs=extras[0] if extras else {}))
+        return _aparar(mensagens, self.max_mensagens)
+
+    def add_messages(self, messages):
+        itens = [
+            json.dumps([TIPOS_REVERSO.get(m.type, "a"), m.content, *([m.additional_kwargs] if m.additional_kwargs else [])],
+                       ensure_ascii=False, separators=(",", ":"))
+            for m in messages
+        ]
+        if not itens:
+            return
+        pipe = self.redis.pipeline()
+        pipe.rpush(self.chave, *itens)
+        pipe.ltrim(self.chave, -self.max_mensagens, -1)
+        pipe.expire(self.chave, self.ttl)
+        pipe.execute()
+
+    def add_message(self, message):
+        self.add_messages([message])
+
+    def clear(self):
+        self.redis.delete(self.chave, f"{self.chave}:resumo")
+
+    def get_resumo(self):
+        dados = self.redis.hmget(f"{self.chave}:resumo", "texto", "marcador")
+        return tuple((v or b"").decode("utf-8") for v in dados)
+
+    def set_resumo(self, resumo, marcador):
+        pipe = self.redis.pipeline()
+        pipe.hset(f"{self.chave}:resumo", mapping={"texto": resumo, "marcador": marcador})
+        pipe.expire(f"{self.chave}:resumo", self.ttl)
+        pipe.execute()
+
+
+class HistoricoRedisStore:
+    def __init__(self, url=HISTORICO_REDIS_URL, max_mensagens=HISTORICO_MAX_MENSAGENS, ttl=HISTORICO_TTL):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("HISTORICO_BACKEND=redis requer o pacote 'redis'.") from e
+        self.redis = redis.Redis.from_url(url, socket_timeout=1, socket_connect_timeout=1)
+        self.max_mensagens = max_mensagens
+        self.ttl = ttl
+
+    def get(self, session_id) -> BaseChatMessageHistory:
+        return HistoricoRedis(self.redis, f"chefia:historico:{session_id}", self.max_mensagens, self.ttl)
+
+    def __contains__(self, session_id):
+        return bool(self.redis.exists(f"chefia:historico:{session_id}"))
+
+    def __getitem__(self, session_id):
+        return self.get(session_id)
+
+    def stats(self):
+        return {"backend": "redis", "ttl": self.ttl, "max_mensagens": self.max_mensagens}
+
+
+def estimar_tokens(mensagem):
+    # Aproximação de ~4 caracteres por token, suficiente para o orçamento da janela
+    conteudo = mensagem.content if isinstance(mensagem.content, str) else json.dumps(mensagem.content, ensure_ascii=False)
+    return len(conteudo) // 4 + 1
+
+
+def inicio_janela(mensagens, turnos):
+    # Índice da mensagem que abre o N-ésimo turno do usuário, contando do fim
+    if turnos <= 0:
+        return len(mensagens)
+    vistos = 0
+    for i in range(len(mensagens) - 1, -1, -1):
+        if inicia_turno(mensagens[i]):
+            vistos += 1
+            if vistos == turnos:
+                return i
+    return 0
+
+
+def janela(mensagens, turnos, tokens):
+    selecionadas = mensagens[inicio_janela(mensagens, turnos):]
+    total = sum(estimar_tokens(m) for m in selecionadas)
+    while len(selecionadas) > 1 and total > tokens:
+        total -= estimar_tokens(selecionadas[0])
+        selecionadas = selecionadas[1:]
+    if selecionadas and total > tokens and isinstance(selecionadas[0].content, str):
+        # uma única mensagem acima do orçamento: mantém só o final dela
+        ultima = selecionadas[0]
+        selecionadas = [ultima.model_copy(update={"content": ultima.content[-tokens * 4:]})]
+    return selecionadas
+
+
+def marcador(mensagem):
+    conteudo = mensagem.content if isinstance(mensagem.content, str) else json.dumps(mensagem.content, ensure_ascii=False)
+    return hashlib.blake2b(f"{mensagem.type}:{conteudo}".encode(), digest_size=8).hexdigest()
+
+
+class JanelaHistorico(BaseChatMessageHistory):
+    """
+    Visão do histórico de uma sessão para uma etapa específica: a leitura devolve só a janela da etapa;
+    a escrita vai para o histórico completo e pode disparar a atualização do resumo.
+    """
+
+    def __init__(self, gerenciador, session_id, etapa):
+        self.gerenciador = gerenciador
+        self.session_id = session_id
+        self.etapa = etapa
+
+    @property
+    def messages(self):
+        return self.gerenciador.mensagens_da_etapa(self.session_id, self.etapa)
+
+    def add_messages(self, messages):
+        if self.etapa == ETAPA_ENTRADA:
+            messages = [marcar_turno(m) if isinstance(m, HumanMessage) else m for m in messages]
+        self.gerenciador.store.get(self.session_id).add_messages(messages)
+        self.gerenciador.agendar_resumo(self.session_id)
+
+    def add_message(self, message):
+        self.add_messages([message])
+
+    def clear(self):
+        self.gerenciador.store.get(self.session_id).clear()
+
+
+class GerenciadorHistorico:
+    """
+    Aplica as janelas por etapa (HISTORICO_JANELAS) sobre o store de sessões e mantém um resumo
+    acumulado das mensagens mais antigas. O resumo é gerado por `resumidor(resumo_atual, novas_mensagens)`
+    em segundo plano, fora do caminho da resposta; até ficar pronto, o resumo anterior é usado.
+    """
+
+    def __init__(self, store, resumidor=None, janelas=None, min_novas=HISTORICO_RESUMO_MIN_NOVAS):
+        self.store = store
+        self.resumidor = resumidor
+        self.janelas = janelas or HISTORICO_JANELAS
+        self.min_novas = min_novas
+        self.turnos_resumo = max(j["turnos"] for j in self.janelas.values())
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="resumo-historico")
+        self._em_andamento = set()
+        self._lock = threading.Lock()
+
+    def historico(self, session_id, etapa) -> BaseChatMessageHistory:
+        return JanelaHistorico(self, session_id, etapa)
+
+    def mensagens_da_etapa(self, session_id, etapa):
+        config = self.janelas[etapa]
+        return janela(self.store.get(session_id).messages, config["turnos"], config["tokens"])
+
+    def tem_historico(self, session_id, etapa="roteador"):
+        # A etapa veria mensagens anteriores da conversa (decisões locais devem considerar o contexto)
+        return bool(self.mensagens_da_etapa(session_id, etapa))
+
+    def resumo(self, session_id):
+        texto, _ = self.store.get(session_id).get_resumo()
+        return texto or "(sem mensagens anteriores)"
+
+    def agendar_resumo(self, session_id):
+        if self.resumidor is None:
+            return
+        historico = self.store.get(session_id)
+        mensagens = historico.messages
+        antigas = mensagens[:inicio_janela(mensagens, self.turnos_resumo)]
+        if not antigas:
+            return
+
+        resumo, ultimo = historico.get_resumo()
+        # mensagens antigas posteriores à última já resumida (se ela foi aparada, todas entram)
+        novas = antigas
+        for i in range(len(antigas) - 1, -1, -1):
+            if marcador(antigas[i]) == ultimo:
+                novas = antigas[i + 1:]
+                break
+        if len(novas) < self.min_novas:
+            return
+
+        with self._lock:
+            if session_id in self._em_andamento:
+                return
+            self._em_andamento.add(session_id)
+        self._executor.submit(self._atualizar_resumo, session_id, historico, resumo, novas)
+
+    def _atualizar_resumo(self, session_id, historico, resumo, novas):
+        try:
+            historico.set_resumo(self.resumidor(resumo, novas), marcador(novas[-1]))
+        except Exception as e:
+            print(f"Erro ao resumir histórico: {e}")
+        finally:
+            with self._lock:
+                self._em_andamento.discard(session_id)
+
+
+def criar_store_historico():
+    if HISTORICO_BACKEND == "redis":
+        return HistoricoRedisStore()
+    if HISTORICO_BACKEND != "memoria":
+        raise ValueError(f"HISTORICO_BACKEND inválido: '{HISTORICO_BACKEND}'. Opções: memoria, redis")
+    return HistoricoMemoria()
+
+
+def session_id_da_requisicao(data):
+    # Sessão enviada pelo cliente; sem ela, uma conversa por gestor. Sempre separada por empresa.
+    empresa_id = data.get("empresa_id", "")
+    session_id = data.get("session_id") or f"gestor-{data.get('gestor_id', '')}"
+    return f"{empresa_id}:{session_id}"
@@ -0,0 +1,24 @@
+-- Busca aproximada (sem acento, por trigramas) de funcionário, ingrediente e tipo de tarefa.
+-- Usada por pg_resolver.py. Os índices são criados com CONCURRENTLY: rode fora de transação
+-- (psql -f sem --single-transaction), por exemplo:
+--     psql "$SQL_URL" -f migrations/0001_busca_aproximada.sql
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm WITH SCHEMA public;
+CREATE EXTENSION IF NOT EXISTS unaccent WITH SCHEMA public;
+CREATE EXTENSION IF NOT EXISTS btree_gin WITH SCHEMA public;
+
+-- unaccent() é STABLE (depende do dicionário do search_path) e não pode ser usada em índice;
+-- fixando o dicionário, a função pode ser declarada IMMUTABLE.
+CREATE OR REPLACE FUNCTION public.busca_normalizada(texto text) RETURNS text
+    LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT
+    AS $$ SELECT lower(public.unaccent('public.unaccent'::regdictionary, texto)) $$;
+
+-- As expressões abaixo precisam ser idênticas às de pg_resolver.ENTIDADES para o índice ser usado.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS funcionario_busca_trgm_idx
+    ON funcionario USING gin (empresa_id, public.busca_normalizada(nome || ' ' || coalesce(sobrenome, '')) public.gin_trgm_ops);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ingrediente_busca_trgm_idx
+    ON ingrediente USING gin (empresa_id, public.busca_normalizada(nome) public.gin_trgm_ops);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS tipo_tarefa_busca_trgm_idx
+    ON tipo_tarefa USING gin (public.busca_normalizada(nome || ' ' || coalesce(descricao, '')) public.gin_trgm_ops);
@@ -0,0 +1,38 @@
+-- Notifica alterações em funcionário, ingrediente e tipo de tarefa no canal "referencias_alteradas",
+-- usado pelo cache em memória de referencias.py (REFERENCIAS_LISTEN=true) para invalidar só a
+-- tabela/empresa alterada. Payload: "<tabela>:<empresa_id>" ou "<tabela>" para catálogos sem empresa.
+--     psql "$SQL_URL" -f migrations/0002_notificar_referencias.sql
+
+CREATE OR REPLACE FUNCTION public.notificar_referencia() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+DECLARE
+    linha record;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        linha := OLD;
+    ELSE
+        linha := NEW;
+    END IF;
+    -- payloads iguais na mesma transação são entregues uma vez só
+    IF TG_NARGS > 0 AND TG_ARGV[0] = 'por_empresa' THEN
+        PERFORM pg_notify('referencias_alteradas', TG_TABLE_NAME || ':' || linha.empresa_id);
+    ELSE
+        PERFORM pg_notify('referencias_alteradas', TG_TABLE_NAME);
+    END IF;
+    RETURN NULL;
+END $$;
+
+DROP TRIGGER IF EXISTS funcionario_notificar_referencia ON funcionario;
+CREATE TRIGGER funcionario_notificar_referencia
+    AFTER INSERT OR UPDATE OR DELETE ON funcionario
+    FOR EACH ROW EXECUTE FUNCTION public.notificar_referencia('por_empresa');
+
+DROP TRIGGER IF EXISTS ingrediente_notificar_referencia ON ingrediente;
+CREATE TRIGGER ingrediente_notificar_referencia
+    AFTER INSERT OR UPDATE OR DELETE ON ingrediente
+    FOR EACH ROW EXECUTE FUNCTION public.notificar_referencia('por_empresa');
+
+DROP TRIGGER IF EXISTS tipo_tarefa_notificar_referencia ON tipo_tarefa;
+CREATE TRIGGER tipo_tarefa_notificar_referencia
+    AFTER INSERT OR UPDATE OR DELETE ON tipo_tarefa
+    FOR EACH ROW EXECUTE FUNCTION public.notificar_referencia();
@@ -0,0 +1,10 @@
+-- Índices para os filtros de tarefa usados por consultar_tarefas e cancel_tarefas (pg_tools.py):
+-- empresa + intervalo de data limite (+ situação), e empresa + responsável por data limite.
+-- Criados com CONCURRENTLY: rode fora de transação, por exemplo:
+--     psql "$SQL_URL" -f migrations/0003_indices_tarefa.sql
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS tarefa_empresa_limite_situacao_idx
+    ON tarefa (empresa_id, data_limite, situacao);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS tarefa_empresa_responsavel_limite_idx
+    ON tarefa (empresa_id, responsavel_id, data_limite);
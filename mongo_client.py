@@ -0,0 +1,102 @@
+import os
+import threading
+import atexit
+from pymongo import MongoClient, AsyncMongoClient
+from dotenv import load_dotenv
+
+load_dotenv()
+
+MONGO_URL = os.getenv("MONGO_URL")
+MONGO_DB = os.getenv("MONGO_DB", "dbCodCoz")
+MONGO_POOL_MAX = int(os.getenv("MONGO_POOL_MAX", "20"))
+MONGO_POOL_MIN = int(os.getenv("MONGO_POOL_MIN", "0"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "15000"))
+MONGO_MAX_IDLE_MS = int(os.getenv("MONGO_MAX_IDLE_MS", "300000"))
+
+# Um MongoClient por processo: o client já mantém o próprio pool de conexões e o monitoramento
+# da topologia, então criá-lo a cada consulta refaz descoberta de servidores e handshake.
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+_async_client = None
+_async_client_pid = None
+
+
+def _opcoes_client():
+    return dict(
+        appname="codcoz-chefia",
+        maxPoolSize=MONGO_POOL_MAX,
+        minPoolSize=MONGO_POOL_MIN,
+        maxIdleTimeMS=MONGO_MAX_IDLE_MS,
+        serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+        socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+        retryReads=True,
+    )
+
+
+def _criar_client() -> MongoClient:
+    return MongoClient(MONGO_URL, **_opcoes_client())
+
+
+def get_client() -> MongoClient:
+    global _client, _client_pid
+    if _client is None or _client_pid != os.getpid():
+        with _client_lock:
+            # MongoClient não é fork-safe: um client herdado do processo pai é descartado (sem fechar)
+            if _client is None or _client_pid != os.getpid():
+                _client = _criar_client()
+                _client_pid = os.getpid()
+    return _client
+
+
+def get_db():
+    return get_client()[MONGO_DB]
+
+
+def get_async_client() -> AsyncMongoClient:
+    # Client do driver async do pymongo para o modo ASGI; mesmas opções de pool/timeouts
+    global _async_client, _async_client_pid
+    if _async_client is None or _async_client_pid != os.getpid():
+        with _client_lock:
+            if _async_client is None or _async_client_pid != os.getpid():
+                _async_client = AsyncMongoClient(MONGO_URL, **_opcoes_client())
+                _async_client_pid = os.getpid()
+    return _async_client
+
+
+def get_async_db():
+    return get_async_client()[MONGO_DB]
+
+
+def _reset_apos_fork():
+    global _client, _client_pid, _client_lock, _async_client, _async_client_pid
+    _client_lock = threading.Lock()
+    _client = None
+    _client_pid = None
+    _async_client = None
+    _async_client_pid = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_apos_fork)
+
+
+@atexit.register
+def close_client():
+    global _client, _client_pid
+    if _client is not None and _client_pid == os.getpid():
+        _client.close()
+    _client = None
+    _client_pid = None
+
+
+async def aclose_client():
+    # Chamado no shutdown do servidor ASGI
+    global _async_client, _async_client_pid
+    if _async_client is not None and _async_client_pid == os.getpid():
+        await _async_client.close()
+    _async_client = None
+    _async_client_pid = None
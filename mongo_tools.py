@@ -1,18 +1,20 @@
 import os
+import time
+import asyncio
 from dotenv import load_dotenv
-from pymongo import MongoClient
 from typing import Optional, List
 from langchain.tools import tool
 from pydantic import BaseModel, Field
-import requests
+from pymongo.errors import OperationFailure
+from pymongo.collation import Collation
+from pymongo.operations import SearchIndexModel
+from mongo_client import get_db, get_async_db
+from embeddings import get_embedder, embed_query, aembed_query, normalizar_texto_busca, EMBEDDING_DIM
+from cache import TTLCache
+from telemetria import medir
 
 load_dotenv()
 
-model_name = "paraphrase-multilingual-MiniLM-L12-v2"
-HUGGING_FACE_TOKEN = os.getenv("HUGGING_FACE_TOKEN")
-API_URL = f"https://router.huggingface.co/hf-inference/models/sentence-transformers/{model_name}/pipeline/feature-extraction"
-headers = {"Authorization": f"Bearer {HUGGING_FACE_TOKEN}"}
-
 # Embedding
 def gerar_texto_embedding_receita(nome_receita, ingrediente, descricao, modo_preparo):
     partes = []
@@ -36,22 +38,72 @@ def gerar_texto_embedding_receita(nome_receita, ingrediente, descricao, modo_pre
     return texto or None  # retorna None se nada aproveitável existir
 
 def embed_text_api(texts):
-    response = requests.post(API_URL, headers=headers, json={"inputs": texts, "options":{"wait_for_model": True}}) #wait_for_model espera pelo modelo caso ele esteja sobrecarregado, ao invés de retornar um erro
+    # Backend configurável via EMBEDDER (http | local | stub), ver embeddings.py
+    return get_embedder().embed(texts)
 
-    print(f"{response.status_code} - {response.reason}")
-    
-    if response.status_code != 200:
-        print(response.text)
+def get_collection():
+    # Reaproveita o MongoClient do processo (ver mongo_client.py)
+    return get_db()["receitas"]
 
-    return response.json() 
+RECEITAS_INDICE_VETORIAL = os.getenv("RECEITAS_INDICE_VETORIAL", "receita_embedding_index")
+RECEITAS_INDICE_TEXTO = os.getenv("RECEITAS_INDICE_TEXTO", "receita_texto_index")
+RECEITAS_BUSCA_LEXICA = os.getenv("RECEITAS_BUSCA_LEXICA", "true").lower() == "true"  # perna $search (Atlas Search)
+RECEITAS_LIMITE = int(os.getenv("RECEITAS_LIMITE", "3"))                       # receitas devolvidas por padrão
+RECEITAS_LIMITE_MAX = int(os.getenv("RECEITAS_LIMITE_MAX", "10"))
+RECEITAS_PROFUNDIDADE_FUSAO = int(os.getenv("RECEITAS_PROFUNDIDADE_FUSAO", "4"))  # cada perna traz limite x N para a fusão
+RECEITAS_CANDIDATOS_FATOR = int(os.getenv("RECEITAS_CANDIDATOS_FATOR", "15"))     # numCandidates = resultados x fator
+RECEITAS_CANDIDATOS_MIN = int(os.getenv("RECEITAS_CANDIDATOS_MIN", "50"))
+RECEITAS_CANDIDATOS_MAX = int(os.getenv("RECEITAS_CANDIDATOS_MAX", "2000"))       # o Atlas aceita até 10000
+RRF_K = int(os.getenv("RRF_K", "60"))
+# atlas: $vectorSearch; local: índice em processo (ann_receitas.py); auto: Atlas, e local se o servidor
+# não tiver Vector Search (ex.: MongoDB local sem Atlas). A busca local não tem a perna léxica.
+RECEITAS_VETORIAL = os.getenv("RECEITAS_VETORIAL", "atlas")
+# Resultados de query_receitas memorizados por alguns minutos: o agente repete a busca com variações
+# (caixa, espaços, ordem dos ingredientes) no mesmo turno e nos seguintes. 0 desliga.
+RECEITAS_MEMO_TTL = float(os.getenv("RECEITAS_MEMO_TTL", "120"))
+RECEITAS_MEMO_MAX = int(os.getenv("RECEITAS_MEMO_MAX", "2048"))
+RECEITAS_DESCRICAO_MAX = int(os.getenv("RECEITAS_DESCRICAO_MAX", "160"))  # caracteres da descrição no resumo
 
-MONGO_URL = os.getenv("MONGO_URL")
+# Definições dos índices do Atlas usados por montar_pipeline_receitas. empresaId é campo de filtro
+# do índice vetorial, então o $vectorSearch já busca só entre as receitas da empresa.
+INDICES_BUSCA = {
+    RECEITAS_INDICE_VETORIAL: {
+        "type": "vectorSearch",
+        "definition": {"fields": [
+            {"type": "vector", "path": "embedding", "numDimensions": EMBEDDING_DIM, "similarity": "cosine"},
+            {"type": "filter", "path": "empresaId"},
+        ]},
+    },
+    RECEITAS_INDICE_TEXTO: {
+        "type": "search",
+        "definition": {"mappings": {"dynamic": False, "fields": {
+            "empresaId": {"type": "number"},
+            "nome": {"type": "string", "analyzer": "lucene.portuguese"},
+            "ingredientes": {"type": "document", "fields": {"nome": {"type": "string", "analyzer": "lucene.portuguese"}}},
+        }}},
+    },
+}
 
-def get_collection():
-    client = MongoClient(MONGO_URL)
-    db = client["dbCodCoz"]
-    coll = db["receitas"]
-    return coll
+def garantir_indices_busca(collection, esperar=False, timeout=600):
+    """Cria (ou atualiza) os índices de INDICES_BUSCA na collection; com `esperar`, aguarda ficarem consultáveis."""
+    existentes = {i["name"]: i for i in collection.list_search_indexes()}
+    for nome, indice in INDICES_BUSCA.items():
+        if nome not in existentes:
+            collection.create_search_index(SearchIndexModel(definition=indice["definition"], name=nome, type=indice["type"]))
+        elif existentes[nome].get("latestDefinition") != indice["definition"]:
+            collection.update_search_index(nome, indice["definition"])
+    limite = time.monotonic() + timeout
+    while esperar:
+        prontos = {i["name"] for i in collection.list_search_indexes() if i.get("queryable") and i.get("status") == "READY"}
+        if prontos >= set(INDICES_BUSCA):
+            return
+        if time.monotonic() > limite:
+            raise TimeoutError(f"Índices de busca não ficaram prontos em {timeout}s")
+        time.sleep(2)
+
+class DetalharReceitaModel (BaseModel):
+    nome_receita: str = Field(..., description="Nome exato da receita, como retornado por query_receitas.")
+    empresa_id: int = Field(..., description="ID da empresa para filtrar as receitas.")
 
 class QueryReceitasModel (BaseModel):
     nome_receita: Optional[str] = Field(default=None, description="Nome da receita a ser pesquisada.")
@@ -59,6 +111,198 @@ class QueryReceitasModel (BaseModel):
     descricao: Optional[str] = Field(default=None, description="Descrição básica ou apresentação da receita.")
     modo_preparo: Optional[str] = Field(default=None, description="Detalhes sobre o modo de preparo.")
     empresa_id: int = Field(..., description="ID da empresa para filtrar as receitas.")
+    limite: Optional[int] = Field(default=None, description=f"Quantidade de receitas desejada (padrão {RECEITAS_LIMITE}, máximo {RECEITAS_LIMITE_MAX}). Use só se o usuário pedir mais opções.")
+
+def texto_lexico_receita(nome_receita, ingrediente):
+    # A perna léxica só olha nome e ingredientes; descrição e modo de preparo ficam com a vetorial
+    texto = " ".join(p for p in (nome_receita, ingrediente) if p)
+    return texto.replace(",", " ").strip() or None
+
+def _numero_candidatos(resultados):
+    return max(RECEITAS_CANDIDATOS_MIN, min(RECEITAS_CANDIDATOS_MAX, resultados * RECEITAS_CANDIDATOS_FATOR))
+
+def _estagio_vetorial(embedding_vector, empresa_id, resultados):
+    return {
+        "$vectorSearch": {
+            "queryVector": embedding_vector,
+            "path": "embedding",
+            "filter": {"empresaId": empresa_id},
+            "numCandidates": _numero_candidatos(resultados),
+            "limit": resultados,
+            "index": RECEITAS_INDICE_VETORIAL,
+        }
+    }
+
+def _estagios_lexicos(texto, empresa_id, resultados):
+    return [
+        {
+            "$search": {
+                "index": RECEITAS_INDICE_TEXTO,
+                "compound": {
+                    "filter": [{"equals": {"path": "empresaId", "value": empresa_id}}],
+                    "should": [
+                        {"text": {"query": texto, "path": "nome", "fuzzy": {"maxEdits": 1}, "score": {"boost": {"value": 2}}}},
+                        {"text": {"query": texto, "path": "ingredientes.nome", "fuzzy": {"maxEdits": 1}}},
+                    ],
+                    "minimumShouldMatch": 1,
+                },
+            }
+        },
+        {"$limit": resultados},
+    ]
+
+def _ranquear(perna):
+    # posição de cada documento na perna -> 1 / (k + posição), a contribuição dele no RRF
+    return [
+        {"$group": {"_id": None, "docs": {"$push": "$$ROOT"}}},
+        {"$unwind": {"path": "$docs", "includeArrayIndex": "posicao"}},
+        {"$project": {"_id": "$docs._id", "doc": "$docs", perna: {"$divide": [1, {"$add": ["$posicao", RRF_K + 1]}]}}},
+    ]
+
+PROJECAO_RECEITA = {"_id": 0, "nome": 1, "ingredientes": 1, "modoPreparo": 1, "descricao": 1}
+
+def montar_pipeline_receitas(embedding_vector, empresa_id, texto_lexico=None, limite=RECEITAS_LIMITE, collection="receitas"):
+    """
+    Pipeline de busca de receitas da empresa. Com vetor e texto, as duas pernas ($vectorSearch e $search)
+    rodam no mesmo aggregate ($unionWith) e são combinadas por reciprocal rank fusion; com só uma delas,
+    a perna disponível é usada diretamente. numCandidates acompanha a quantidade pedida.
+    """
+    lexica = texto_lexico if RECEITAS_BUSCA_LEXICA else None
+
+    if embedding_vector and lexica:
+        profundidade = limite * RECEITAS_PROFUNDIDADE_FUSAO
+        return [
+            _estagio_vetorial(embedding_vector, empresa_id, profundidade),
+            *_ranquear("score_vetorial"),
+            {"$unionWith": {"coll": collection, "pipeline": [
+                *_estagios_lexicos(lexica, empresa_id, profundidade),
+                *_ranquear("score_lexico"),
+            ]}},
+            {"$group": {
+                "_id": "$_id",
+                "doc": {"$first": "$doc"},
+                "score_vetorial": {"$max": "$score_vetorial"},
+                "score_lexico": {"$max": "$score_lexico"},
+            }},
+            {"$addFields": {"score": {"$add": [{"$ifNull": ["$score_vetorial", 0]}, {"$ifNull": ["$score_lexico", 0]}]}}},
+            {"$sort": {"score": -1, "_id": 1}},
+            {"$limit": limite},
+            {"$replaceRoot": {"newRoot": {"$mergeObjects": ["$doc", {"score": "$score"}]}}},
+            {"$project": {**PROJECAO_RECEITA, "score": 1}},
+        ]
+
+    if embedding_vector:
+        return [
+            _estagio_vetorial(embedding_vector, empresa_id, limite),
+            {"$project": {**PROJECAO_RECEITA, "score": {"$meta": "vectorSearchScore"}}},  # retorna a similaridade
+        ]
+
+    if lexica:
+        return [
+            *_estagios_lexicos(lexica, empresa_id, limite),
+            {"$project": {**PROJECAO_RECEITA, "score": {"$meta": "searchScore"}}},
+        ]
+
+    return [{"$match": {"empresaId": empresa_id}}, {"$limit": limite}, {"$project": PROJECAO_RECEITA}]
+
+def formatar_receita(doc):
+    return {
+        "nome": doc.get("nome"),
+        "descricao": doc.get("descricao"),
+        "ingredientes": ', '.join([i.get("nome") for i in doc.get("ingredientes", []) if i.get("nome")]),
+        "modo_preparo": ' '.join(p.get('passo', '') for p in doc.get('modoPreparo', []))
+    }
+
+def resumir_receita(doc):
+    # Formato de query_receitas: sem o modo de preparo, que fica para detalhar_receita
+    descricao = (doc.get("descricao") or "").strip()
+    if len(descricao) > RECEITAS_DESCRICAO_MAX:
+        descricao = descricao[:RECEITAS_DESCRICAO_MAX].rsplit(" ", 1)[0] + "…"
+    return {
+        "nome": doc.get("nome"),
+        "descricao": descricao,
+        "ingredientes": ', '.join([i.get("nome") for i in doc.get("ingredientes", []) if i.get("nome")]),
+        "passos": len(doc.get("modoPreparo") or []),
+    }
+
+_memo_consultas = TTLCache(maxsize=RECEITAS_MEMO_MAX, ttl=RECEITAS_MEMO_TTL)  # (empresa, argumentos) -> (limite, docs)
+_memo_receitas = TTLCache(maxsize=RECEITAS_MEMO_MAX, ttl=RECEITAS_MEMO_TTL)   # (empresa, nome) -> doc completo
+
+def _normalizar_argumento(texto):
+    return normalizar_texto_busca(texto) if texto else ""
+
+def chave_consulta(empresa_id, nome_receita, ingrediente, descricao, modo_preparo):
+    # "Alface, arroz" e "arroz,alface" são a mesma consulta
+    ingredientes = sorted(filter(None, (_normalizar_argumento(i) for i in (ingrediente or "").split(","))))
+    return (str(empresa_id), _normalizar_argumento(nome_receita), ", ".join(ingredientes),
+            _normalizar_argumento(descricao), _normalizar_argumento(modo_preparo))
+
+def consulta_memorizada(chave, limite):
+    item = _memo_consultas.get(chave) if RECEITAS_MEMO_TTL > 0 else None
+    if item is None:
+        return None
+    limite_buscado, docs = item
+    # uma busca com limite maior (ou que já trouxe todas as receitas da empresa) atende limites menores
+    if limite_buscado >= limite or len(docs) < limite_buscado:
+        return docs[:limite]
+    return None
+
+def memorizar_receitas(empresa_id, docs):
+    # documentos completos, para detalhar_receita não voltar ao Mongo
+    if RECEITAS_MEMO_TTL <= 0:
+        return
+    for doc in docs:
+        if doc.get("nome"):
+            _memo_receitas.set((str(empresa_id), _normalizar_argumento(doc["nome"])), doc)
+
+def memorizar_consulta(chave, limite, docs):
+    if RECEITAS_MEMO_TTL <= 0:
+        return
+    _memo_consultas.set(chave, (limite, docs))
+    memorizar_receitas(chave[0], docs)
+
+def memo_receitas_stats() -> dict:
+    return {**_memo_consultas.stats(), "receitas": len(_memo_receitas)} if RECEITAS_MEMO_TTL > 0 else {}
+
+_atlas_sem_busca = False
+
+def _usar_busca_local(embedding_vector):
+    return embedding_vector is not None and (RECEITAS_VETORIAL == "local" or (RECEITAS_VETORIAL == "auto" and _atlas_sem_busca))
+
+def _sem_busca_atlas(erro, embedding_vector):
+    # Servidor sem Atlas Search: "Unrecognized pipeline stage name: '$vectorSearch'" (e '$search')
+    global _atlas_sem_busca
+    if RECEITAS_VETORIAL != "auto" or embedding_vector is None or "Unrecognized pipeline stage" not in str(erro):
+        return False
+    print(f"Vector Search indisponível no MongoDB, usando a busca local: {erro}")
+    _atlas_sem_busca = True
+    return True
+
+def buscar_receitas(embedding_vector, empresa_id, texto_lexico, limite):
+    if not _usar_busca_local(embedding_vector):
+        try:
+            with medir("mongo_aggregate", hibrida=bool(embedding_vector and texto_lexico)):
+                return list(get_collection().aggregate(montar_pipeline_receitas(embedding_vector, empresa_id, texto_lexico, limite)))
+        except OperationFailure as e:
+            if not _sem_busca_atlas(e, embedding_vector):
+                raise
+    from ann_receitas import get_indice_local
+    with medir("busca_local"):
+        return get_indice_local().buscar(empresa_id, embedding_vector, limite)
+
+async def abuscar_receitas(embedding_vector, empresa_id, texto_lexico, limite):
+    if not _usar_busca_local(embedding_vector):
+        try:
+            with medir("mongo_aggregate", hibrida=bool(embedding_vector and texto_lexico)):
+                cursor = await get_async_db()["receitas"].aggregate(montar_pipeline_receitas(embedding_vector, empresa_id, texto_lexico, limite))
+                return [doc async for doc in cursor]
+        except OperationFailure as e:
+            if not _sem_busca_atlas(e, embedding_vector):
+                raise
+    from ann_receitas import get_indice_local
+    # a busca é CPU (sub-milissegundo), mas a primeira carga da empresa lê o Mongo pelo driver síncrono
+    with medir("busca_local"):
+        return await asyncio.to_thread(get_indice_local().buscar, empresa_id, embedding_vector, limite)
 
 @tool("query_receitas", args_schema=QueryReceitasModel)
 def query_receitas(
@@ -66,56 +310,102 @@ def query_receitas(
     ingrediente: Optional[str] = None,
     descricao: Optional[str] =  None,
     modo_preparo: Optional[str] = None,
-    empresa_id: int = None
+    empresa_id: int = None,
+    limite: Optional[int] = None,
 ) -> list[dict]:
     """
     Consulta receitas na collection 'receitas' do MongoDB com filtro obrigatório de empresa_id e os opcionais: nome da receita, ingrediente(s), descrição mínima ou detalhes sobre o modo de preparo.
+    Retorna um resumo de cada receita (nome, descrição, ingredientes e quantidade de passos); o modo de preparo completo vem de detalhar_receita.
     """
+    if not empresa_id:
+        return {"status": "error", "data": "", "count": 0, "message": "ID da empresa não informado"}
 
-    coll = get_collection()
-    query = []
+    limite = max(1, min(limite or RECEITAS_LIMITE, RECEITAS_LIMITE_MAX))
+    chave = chave_consulta(empresa_id, nome_receita, ingrediente, descricao, modo_preparo)
+    docs = consulta_memorizada(chave, limite)
+    if docs is None:
+        texto_embedding = gerar_texto_embedding_receita(nome_receita, ingrediente, descricao, modo_preparo)
+        try:
+            embedding_vector = embed_query(texto_embedding) if texto_embedding else None
+        except Exception as e:
+            return {"status": "error", "data": "", "count": 0, "message": f"Falha ao gerar embedding: {e}"}
 
-    texto_embedding = gerar_texto_embedding_receita(nome_receita, ingrediente, descricao, modo_preparo)
-    embedding_vector = embed_text_api(texto_embedding)
+        docs = buscar_receitas(embedding_vector, empresa_id, texto_lexico_receita(nome_receita, ingrediente), limite)
+        memorizar_consulta(chave, limite, docs)
+    receitas = [resumir_receita(doc) for doc in docs]
 
-    if embedding_vector:
-        query.append({
-            "$vectorSearch": {
-                "queryVector": embedding_vector,
-                "path": "embedding",
-                "numCandidates": 100,
-                "limit": 3,
-                "index": "receita_embedding_index"
-            }
-        })
+    return {"status": "success", "data": receitas, "count": len(receitas)}
 
-    if empresa_id:
-        query.append({"$match": {"empresaId": empresa_id}})
-    else:
+async def aquery_receitas(
+    nome_receita: Optional[str] = None,
+    ingrediente: Optional[str] = None,
+    descricao: Optional[str] =  None,
+    modo_preparo: Optional[str] = None,
+    empresa_id: int = None,
+    limite: Optional[int] = None,
+) -> list[dict]:
+    # Mesma consulta com embedding via HTTP async e driver async do Mongo (modo ASGI)
+    if not empresa_id:
         return {"status": "error", "data": "", "count": 0, "message": "ID da empresa não informado"}
 
-    # (Opcional) projetar campos desejados
-    query.append({
-        "$project": {
-            "_id": 0,
-            "nome": 1,
-            "ingredientes": 1,
-            "modoPreparo": 1,
-            "descricao": 1,
-            "score": {"$meta": "vectorSearchScore"}  # retorna a similaridade
-        }
-    })
-
-    receitas = []
+    limite = max(1, min(limite or RECEITAS_LIMITE, RECEITAS_LIMITE_MAX))
+    chave = chave_consulta(empresa_id, nome_receita, ingrediente, descricao, modo_preparo)
+    docs = consulta_memorizada(chave, limite)
+    if docs is None:
+        texto_embedding = gerar_texto_embedding_receita(nome_receita, ingrediente, descricao, modo_preparo)
+        try:
+            embedding_vector = await aembed_query(texto_embedding) if texto_embedding else None
+        except Exception as e:
+            return {"status": "error", "data": "", "count": 0, "message": f"Falha ao gerar embedding: {e}"}
 
-    for doc in coll.aggregate(query):
-        receitas.append({
-            "nome": doc.get("nome"),
-            "descricao": doc.get("descricao"),
-            "ingredientes": {', '.join([i.get("nome") for i in doc.get("ingredientes", []) if i.get("nome")])},
-            "modo_preparo": {' '.join(p.get('passo', '') for p in doc.get('modoPreparo', []))}
-        })
+        docs = await abuscar_receitas(embedding_vector, empresa_id, texto_lexico_receita(nome_receita, ingrediente), limite)
+        memorizar_consulta(chave, limite, docs)
+    receitas = [resumir_receita(doc) for doc in docs]
 
     return {"status": "success", "data": receitas, "count": len(receitas)}
 
-RECEITAS_TOOLS = [query_receitas]
\ No newline at end of file
+# ainvoke do agente usa a coroutine; invoke continua usando a função síncrona
+query_receitas.coroutine = aquery_receitas
+
+def pre_buscar_receitas(pergunta, empresa_id, limite=RECEITAS_LIMITE):
+    """Receitas candidatas para a mensagem inteira do usuário (execução especulativa, ver especulacao.py)."""
+    docs = buscar_receitas(embed_query(pergunta), empresa_id, texto_lexico_receita(pergunta, None), limite)
+    memorizar_receitas(empresa_id, docs)
+    return [resumir_receita(doc) for doc in docs]
+
+async def apre_buscar_receitas(pergunta, empresa_id, limite=RECEITAS_LIMITE):
+    docs = await abuscar_receitas(await aembed_query(pergunta), empresa_id, texto_lexico_receita(pergunta, None), limite)
+    memorizar_receitas(empresa_id, docs)
+    return [resumir_receita(doc) for doc in docs]
+
+# Nome igual ignorando maiúsculas e acentos (o LLM nem sempre repete o nome exatamente)
+COLLATION_NOME = Collation(locale="pt", strength=1)
+
+def _resultado_detalhe(doc, nome_receita):
+    if not doc:
+        return {"status": "error", "data": "", "message": f"Receita '{nome_receita}' não encontrada. Use query_receitas para localizar o nome exato."}
+    return {"status": "success", "data": formatar_receita(doc)}
+
+@tool("detalhar_receita", args_schema=DetalharReceitaModel)
+def detalhar_receita(nome_receita: str, empresa_id: int) -> dict:
+    """
+    Retorna a receita completa (descrição, ingredientes e modo de preparo) pelo nome exato, com filtro obrigatório de empresa_id. Use quando o usuário pedir o passo a passo de uma receita já encontrada.
+    """
+    if not empresa_id:
+        return {"status": "error", "data": "", "message": "ID da empresa não informado"}
+    doc = _memo_receitas.get((str(empresa_id), _normalizar_argumento(nome_receita)))
+    if doc is None:
+        doc = get_collection().find_one({"empresaId": empresa_id, "nome": nome_receita}, PROJECAO_RECEITA, collation=COLLATION_NOME)
+    return _resultado_detalhe(doc, nome_receita)
+
+async def adetalhar_receita(nome_receita: str, empresa_id: int) -> dict:
+    if not empresa_id:
+        return {"status": "error", "data": "", "message": "ID da empresa não informado"}
+    doc = _memo_receitas.get((str(empresa_id), _normalizar_argumento(nome_receita)))
+    if doc is None:
+        doc = await get_async_db()["receitas"].find_one({"empresaId": empresa_id, "nome": nome_receita}, PROJECAO_RECEITA, collation=COLLATION_NOME)
+    return _resultado_detalhe(doc, nome_receita)
+
+detalhar_receita.coroutine = adetalhar_receita
+
+RECEITAS_TOOLS = [query_receitas, detalhar_receita]
\ No newline at end of file
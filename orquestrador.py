@@ -0,0 +1,125 @@
+import os
+import json
+from dotenv import load_dotenv
+
+load_dotenv()
+
+ORQUESTRADOR_LOCAL = os.getenv("ORQUESTRADOR_LOCAL", "true").lower() == "true"
+
+
+def texto_saida(saida):
+    # A saída do agente pode vir como string ou lista de partes de conteúdo (Gemini)
+    if isinstance(saida, list):
+        return "".join(p.get("text", "") if isinstance(p, dict) else str(p) for p in saida)
+    return saida if isinstance(saida, str) else str(saida or "")
+
+
+def extrair_json(saida):
+    """Extrai o objeto JSON do especialista, tolerando cercas ```json e quebras de linha nas strings."""
+    texto = texto_saida(saida).strip()
+    inicio, fim = texto.find("{"), texto.rfind("}")
+    if inicio == -1 or fim <= inicio:
+        return None
+    try:
+        dados = json.loads(texto[inicio:fim + 1], strict=False)
+    except ValueError:
+        return None
+    return dados if isinstance(dados, dict) else None
+
+
+def _campo(dados, chave):
+    valor = dados.get(chave)
+    return valor.strip() if isinstance(valor, str) else ""
+
+
+def renderizar_resposta(saida_especialista):
+    """
+    Monta a resposta final no FORMATO DE SAÍDA do orquestrador (ver system_prompt_orquestrador e
+    shots_orquestrador) direto dos campos do JSON do especialista. Retorna None se o JSON não puder
+    ser interpretado; nesse caso o orquestrador LLM é usado.
+    """
+    dados = extrair_json(saida_especialista)
+    if not dados:
+        return None
+
+    resposta = _campo(dados, "resposta")
+    if not resposta:
+        return None
+
+    esclarecer = _campo(dados, "esclarecer")
+    recomendacao = _campo(dados, "recomendacao")
+    if esclarecer and not recomendacao:
+        # só a pergunta de clarificação: vai junto da frase, sem seções (como no shot 3)
+        return f"{resposta} {esclarecer}"
+
+    linhas = [resposta]
+    if recomendacao:
+        linhas += ["- *Recomendação*:", recomendacao]
+
+    # esclarecer ocupa o lugar de acompanhamento (REGRAS do orquestrador)
+    acompanhamento = esclarecer or _campo(dados, "acompanhamento")
+    if acompanhamento:
+        linhas += ["- *Acompanhamento* (opcional):", acompanhamento]
+
+    return "\n".join(linhas)
+
+
+class ExtratorResposta:
+    """
+    Lê o JSON do especialista enquanto ele é gerado e devolve, incrementalmente, o texto do campo
+    "resposta" (a primeira linha da resposta final), permitindo transmiti-lo antes do JSON terminar.
+    """
+    ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+    def __init__(self):
+        self.buffer = ""
+        self.pos = None        # posição no buffer logo após a abertura de "resposta": "
+        self.terminado = False
+        self.texto = ""
+
+    def feed(self, trecho):
+        if self.terminado:
+            return ""
+        self.buffer += trecho
+        if self.pos is None:
+            inicio = self.buffer.find('"resposta"')
+            if inicio == -1:
+                return ""
+            dois_pontos = self.buffer.find(":", inicio + len('"resposta"'))
+            aspas = self.buffer.find('"', dois_pontos + 1) if dois_pontos != -1 else -1
+            if aspas == -1:
+                return ""
+            self.pos = aspas + 1
+
+        novo = []
+        i = self.pos
+        while i < len(self.buffer):
+            c = self.buffer[i]
+            if c == '"':
+                self.terminado = True
+                i += 1
+                break
+            if c == "\\":
+                if i + 1 >= len(self.buffer):
+                    break  # escape incompleto: espera o próximo trecho
+                seq = self.buffer[i + 1]
+                if seq == "u":
+                    if i + 6 > len(self.buffer):
+                        break
+                    try:
+                        novo.append(chr(int(self.buffer[i + 2:i + 6], 16)))
+                    except ValueError:
+                        pass
+                    i += 6
+                    continue
+                novo.append(self.ESCAPES.get(seq, seq))
+                i += 2
+                continue
+            novo.append(c)
+            i += 1
+        self.pos = i
+        parte = "".join(novo)
+        if not self.texto:
+            parte = parte.lstrip()
+        self.texto += parte
+        return parte
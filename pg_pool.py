@@ -0,0 +1,260 @@
+import os
+import threading
+import time
+import atexit
+import weakref
+from contextlib import contextmanager
+import psycopg2
+from psycopg2 import extensions, errors
+from dotenv import load_dotenv
+from telemetria import medir, registrar_postgres
+
+load_dotenv()
+
+SQL_URL = os.getenv("SQL_URL")
+PG_POOL_MIN = int(os.getenv("PG_POOL_MIN", "1"))               # conexões abertas ao criar o pool
+PG_POOL_MAX = int(os.getenv("PG_POOL_MAX", "5"))               # limite de conexões por processo (worker)
+PG_POOL_TIMEOUT = float(os.getenv("PG_POOL_TIMEOUT", "5"))     # segundos esperando uma conexão livre
+PG_POOL_CHECK_IDLE = float(os.getenv("PG_POOL_CHECK_IDLE", "30"))  # ociosa há mais que isso -> SELECT 1 antes de usar
+PG_POOL_MAX_IDLE = float(os.getenv("PG_POOL_MAX_IDLE", "300"))     # ociosas além do mínimo são fechadas após esse tempo
+PG_CONNECT_TIMEOUT = int(os.getenv("PG_CONNECT_TIMEOUT", "5"))
+
+
+class CursorMedido(extensions.cursor):
+    """Cursor que registra a duração de cada comando (métrica por tipo de comando e span por execução)."""
+
+    def execute(self, query, vars=None):
+        partes = (query.decode() if isinstance(query, bytes) else query).split(None, 2)
+        comando = partes[0].upper() if partes else ""
+        if comando in ("EXECUTE", "PREPARE") and len(partes) > 1:
+            comando = f"{comando} {partes[1].split('(')[0]}"  # nome do statement preparado
+        inicio = time.perf_counter()
+        try:
+            with medir("postgres", comando=comando):
+                return super().execute(query, vars)
+        finally:
+            registrar_postgres(comando, time.perf_counter() - inicio)
+
+
+class PoolTimeout(Exception):
+    """Nenhuma conexão ficou livre dentro de PG_POOL_TIMEOUT."""
+
+
+class PgPool:
+    """
+    Pool de conexões limitado e thread-safe. Conexões ociosas são reaproveitadas (LIFO)
+    e validadas antes do uso; conexões quebradas são descartadas e recriadas sob demanda.
+    """
+
+    def __init__(self, dsn, minconn=PG_POOL_MIN, maxconn=PG_POOL_MAX, timeout=PG_POOL_TIMEOUT,
+                 check_idle=PG_POOL_CHECK_IDLE, max_idle=PG_POOL_MAX_IDLE):
+        self.dsn = dsn
+        self.minconn = max(0, min(minconn, maxconn))
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.check_idle = check_idle
+        self.max_idle = max_idle
+        self.pid = os.getpid()
+
+        self._vagas = threading.BoundedSemaphore(maxconn)
+        self._lock = threading.Lock()
+        self._ociosas = []  # [(conn, ociosa_desde)]
+        self._stats = {
+            "criadas": 0,
+            "descartadas": 0,
+            "aquisicoes": 0,
+            "timeouts": 0,
+            "em_uso": 0,
+            "pico_em_uso": 0,
+            "espera_total_s": 0.0,
+            "espera_max_s": 0.0,
+        }
+
+        for _ in range(self.minconn):
+            self._ociosas.append((self._conectar(), time.monotonic()))
+
+    def _conectar(self):
+        conn = psycopg2.connect(self.dsn, connect_timeout=PG_CONNECT_TIMEOUT, cursor_factory=CursorMedido)
+        with self._lock:
+            self._stats["criadas"] += 1
+        return conn
+
+    def _descartar(self, conn):
+        with self._lock:
+            self._stats["descartadas"] += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _saudavel(self, conn, ociosa_desde):
+        if conn.closed or conn.info.transaction_status == extensions.TRANSACTION_STATUS_UNKNOWN:
+            return False
+        if time.monotonic() - ociosa_desde < self.check_idle:
+            return True
+        # Conexão parada há muito tempo pode ter sido derrubada pelo servidor/proxy
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1;")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def acquire(self):
+        inicio = time.monotonic()
+        if not self._vagas.acquire(timeout=self.timeout):
+            with self._lock:
+                self._stats["timeouts"] += 1
+            raise PoolTimeout(f"Nenhuma conexão livre no pool após {self.timeout}s")
+        espera = time.monotonic() - inicio
+
+        try:
+            conn = None
+            while conn is None:
+                with self._lock:
+                    item = self._ociosas.pop() if self._ociosas else None
+                if item is None:
+                    conn = self._conectar()
+                elif self._saudavel(*item):
+                    conn = item[0]
+                else:
+                    self._descartar(item[0])
+        except Exception:
+            self._vagas.release()
+            raise
+
+        with self._lock:
+            self._stats["aquisicoes"] += 1
+            self._stats["em_uso"] += 1
+            self._stats["pico_em_uso"] = max(self._stats["pico_em_uso"], self._stats["em_uso"])
+            self._stats["espera_total_s"] += espera
+            self._stats["espera_max_s"] = max(self._stats["espera_max_s"], espera)
+        return conn
+
+    def release(self, conn):
+        try:
+            if conn.closed or conn.info.transaction_status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                self._descartar(conn)
+            else:
+                if conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+                agora = time.monotonic()
+                with self._lock:
+                    self._ociosas.append((conn, agora))
+                    # fecha as ociosas mais antigas (início da lista) que passaram do limite, mantendo o mínimo
+                    expiradas = []
+                    while len(self._ociosas) > self.minconn and agora - self._ociosas[0][1] > self.max_idle:
+                        expiradas.append(self._ociosas.pop(0)[0])
+                for antiga in expiradas:
+                    self._descartar(antiga)
+        except psycopg2.Error:
+            self._descartar(conn)
+        finally:
+            with self._lock:
+                self._stats["em_uso"] -= 1
+            self._vagas.release()
+
+    def closeall(self):
+        with self._lock:
+            ociosas, self._ociosas = self._ociosas, []
+        for conn, _ in ociosas:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["ociosas"] = len(self._ociosas)
+        stats["min"] = self.minconn
+        stats["max"] = self.maxconn
+        stats["espera_media_s"] = stats["espera_total_s"] / stats["aquisicoes"] if stats["aquisicoes"] else 0.0
+        return stats
+
+
+# Um pool por processo: sob gunicorn cada worker cria o seu no primeiro uso.
+_pool = None
+_pool_lock = threading.Lock()
+# Conexões herdadas via fork nunca são fechadas no filho (fechar encerraria a sessão do processo pai),
+# apenas mantidas referenciadas para o GC não finalizá-las.
+_herdadas = []
+
+
+def get_pool() -> PgPool:
+    global _pool
+    if _pool is None or _pool.pid != os.getpid():
+        with _pool_lock:
+            if _pool is not None and _pool.pid != os.getpid():
+                _herdadas.append(_pool)
+                _pool = None
+            if _pool is None:
+                _pool = PgPool(SQL_URL)
+    return _pool
+
+
+def _reset_apos_fork():
+    global _pool, _pool_lock
+    _pool_lock = threading.Lock()
+    if _pool is not None:
+        _herdadas.append(_pool)
+        _pool = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_apos_fork)
+
+
+@atexit.register
+def close_pool():
+    if _pool is not None and _pool.pid == os.getpid():
+        _pool.closeall()
+
+
+@contextmanager
+def get_conn():
+    # Empresta uma conexão do pool; ela volta ao pool (com rollback se necessário) ao sair do bloco.
+    pool = get_pool()
+    conn = pool.acquire()
+    try:
+        yield conn
+    except Exception:
+        try:
+            conn.rollback()
+        except psycopg2.Error:
+            pass
+        raise
+    finally:
+        pool.release(conn)
+
+
+# Nomes dos statements já preparados em cada conexão (PREPARE vale para a sessão inteira no servidor)
+_preparados = weakref.WeakKeyDictionary()
+
+
+def executar_preparado(cur, nome, tipos, sql, params):
+    """
+    Executa `sql` (com parâmetros $1..$n dos `tipos` informados) como prepared statement: o PREPARE
+    é feito uma vez por conexão e as chamadas seguintes só enviam EXECUTE, reaproveitando o plano.
+    Deve abrir a transação: se o statement tiver sumido do servidor, ela é desfeita para prepará-lo de novo.
+    """
+    conn = cur.connection
+    preparados = _preparados.setdefault(conn, set())
+    execute = f"EXECUTE {nome}({', '.join(['%s'] * len(params))});"
+    if nome not in preparados:
+        cur.execute(f"PREPARE {nome}({', '.join(tipos)}) AS {sql}")
+        preparados.add(nome)
+    try:
+        cur.execute(execute, params)
+    except errors.InvalidSqlStatementName:
+        # a sessão no servidor foi reiniciada (ex.: DISCARD ALL de um proxy): prepara de novo
+        conn.rollback()
+        cur.execute(f"PREPARE {nome}({', '.join(tipos)}) AS {sql}")
+        cur.execute(execute, params)
+
+
+def pool_stats() -> dict:
+    if _pool is None or _pool.pid != os.getpid():
+        return {}
+    return _pool.stats()
@@ -0,0 +1,87 @@
+"""
+Resolve nomes citados pelo usuário (funcionário, ingrediente, tipo de tarefa) para IDs, ordenando os
+candidatos por similaridade de trigramas sem acento (índices em migrations/0001_busca_aproximada.sql).
+Quando dois candidatos ficam próximos demais, a resolução é marcada como ambígua em vez de escolher um.
+"""
+import os
+from dotenv import load_dotenv
+from pg_pool import executar_preparado
+
+load_dotenv()
+
+RESOLVER_MARGEM = float(os.getenv("RESOLVER_MARGEM", "0.1"))       # diferença mínima entre o 1º e o 2º candidato
+RESOLVER_CANDIDATOS = int(os.getenv("RESOLVER_CANDIDATOS", "5"))   # candidatos devolvidos na ambiguidade
+# O corte mínimo de similaridade é o do operador <% no servidor (pg_trgm.word_similarity_threshold, padrão 0.6)
+
+ENTIDADES = {
+    "funcionario": {
+        "tabela": "funcionario",
+        "texto": "{a}.nome || ' ' || coalesce({a}.sobrenome, '')",
+        "por_empresa": True,
+    },
+    "ingrediente": {
+        "tabela": "ingrediente",
+        "texto": "{a}.nome",
+        "por_empresa": True,
+    },
+    "tipo_tarefa": {
+        "tabela": "tipo_tarefa",
+        "texto": "{a}.nome || ' ' || coalesce({a}.descricao, '')",
+        "por_empresa": False,  # catálogo compartilhado entre empresas
+    },
+}
+
+
+def _candidatos_sql(entidade, param_texto, param_empresa, limite, alias="e"):
+    config = ENTIDADES[entidade]
+    texto = config["texto"].format(a=alias)
+    busca = f"public.busca_normalizada({texto})"  # mesma expressão do índice GIN
+    filtro_empresa = f"{alias}.empresa_id = {param_empresa} AND " if config["por_empresa"] else ""
+    return f"""
+        SELECT {alias}.id, {texto} AS rotulo,
+               word_similarity(public.busca_normalizada({param_texto}), {busca}) AS score
+          FROM {config["tabela"]} {alias}
+         WHERE {filtro_empresa}public.busca_normalizada({param_texto}) <% {busca}
+         ORDER BY score DESC, {alias}.id
+         LIMIT {limite}
+    """
+
+
+def subconsulta_id_unico(entidade, param_texto, param_empresa, param_margem):
+    """
+    Trecho SQL que devolve o ID do melhor candidato, ou NULL se não houver candidato ou se o 2º
+    estiver a menos de `param_margem` do 1º. Para compor comandos únicos (ex.: cancel_tarefas).
+    """
+    candidatos = _candidatos_sql(entidade, param_texto, param_empresa, 2, alias=f"r_{entidade}")
+    return f"""(
+        SELECT CASE WHEN count(*) = 1 OR max(c.score) - min(c.score) >= {param_margem}
+                    THEN (array_agg(c.id ORDER BY c.score DESC))[1] END
+          FROM ({candidatos}) c
+    )"""
+
+
+def resolver(cur, entidade, texto, empresa_id=None, margem=RESOLVER_MARGEM):
+    """
+    Retorna {"id", "ambiguo", "candidatos": [{"id", "nome", "score"}]}. "id" só é preenchido quando há
+    um único candidato ou o melhor supera o 2º por pelo menos `margem`.
+    """
+    if not texto:
+        return {"id": None, "ambiguo": False, "candidatos": []}
+
+    if ENTIDADES[entidade]["por_empresa"]:
+        sql = _candidatos_sql(entidade, "$1", "$2", RESOLVER_CANDIDATOS)
+        executar_preparado(cur, f"resolver_{entidade}", ("text", "int"), sql, (texto, empresa_id))
+    else:
+        sql = _candidatos_sql(entidade, "$1", None, RESOLVER_CANDIDATOS)
+        executar_preparado(cur, f"resolver_{entidade}", ("text",), sql, (texto,))
+
+    candidatos = [{"id": id_, "nome": rotulo.strip(), "score": round(float(score), 3)} for id_, rotulo, score in cur.fetchall()]
+    if not candidatos:
+        return {"id": None, "ambiguo": False, "candidatos": []}
+
+    unico = len(candidatos) == 1 or candidatos[0]["score"] - candidatos[1]["score"] >= margem
+    return {
+        "id": candidatos[0]["id"] if unico else None,
+        "ambiguo": not unico,
+        "candidatos": candidatos[:1] if unico else candidatos,
+    }
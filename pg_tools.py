@@ -1,14 +1,20 @@
 import os
+import itertools
+from datetime import date, timedelta
 from dotenv import load_dotenv
-import psycopg2
-from typing import Optional, List
+from typing import Optional, List, Literal
 from langchain.tools import tool
 from pydantic import BaseModel, Field
+from psycopg2.extras import execute_values
+from pg_pool import get_conn, executar_preparado
+from pg_resolver import resolver, subconsulta_id_unico, RESOLVER_MARGEM
+from referencias import get_referencias, REFERENCIAS_CACHE
 
 load_dotenv()
 
-def get_conn():
-    return psycopg2.connect(os.getenv("SQL_URL"))
+TAREFAS_LOTE_MAX = int(os.getenv("TAREFAS_LOTE_MAX", "500"))  # tarefas por chamada de add_tarefas_lote
+TAREFAS_PAGINA_MAX = int(os.getenv("TAREFAS_PAGINA_MAX", "50"))  # teto de linhas por página de consultar_tarefas
+TAREFAS_GRUPOS_MAX = int(os.getenv("TAREFAS_GRUPOS_MAX", "31"))  # teto de grupos por agregado (responsável, dia)
 
 # Essa classe garante que o objeto no Python passe todos esses campos
 class AddTarefaArgs(BaseModel):
@@ -36,34 +42,58 @@ class CancelTarefaArgs(BaseModel):
     data_fim_criacao: Optional[str] = Field(default=None, description="Data de criação final do filtro de tarefas, passe no formato 'YYYY-MM-DD'.") 
     data_criacao: Optional[str] = Field(default=None, description="Data de criação da tarefa, passe no formato 'YYYY-MM-DD'.")
 
-#Funções para garantir que os campos normalizados recebam IDs válidos
-def get_ingrediente_id(cursor, nome_ingrediente: Optional[str]) -> Optional[int]:
-    if not nome_ingrediente:
-        return None
-    cursor.execute(
-        "SELECT id FROM ingrediente WHERE nome ILIKE %s LIMIT 1;", 
-        (f"%{nome_ingrediente.replace(" ", "%")}%", )
-    )
-    row = cursor.fetchone()
-    return row[0] if row else None
-
-def get_tipo_tarefa_id(cursor, tipo_tarefa: Optional[str]) -> Optional[int]:
-    if not tipo_tarefa:
+class ConsultarTarefasArgs(BaseModel):
+    empresa_id: int = Field(..., description="ID da empresa para filtrar as tarefas.")
+    situacao: Optional[str] = Field(default=None, description="Situação da tarefa: 'PENDENTE' | 'CONCLUÍDA' | 'CANCELADA'. Se ausente, considera todas.")
+    responsavel: Optional[str] = Field(default=None, description="Nome ou nome completo da pessoa que realizou/irá realizar a tarefa.")
+    ingrediente: Optional[str] = Field(default=None, description="Ingrediente que será consultado na tarefa.")
+    pedido_id: Optional[int] = Field(default=None, description="ID do pedido associado a tarefa.")
+    tipo_tarefa: Optional[str] = Field(default=None, description="Tipo da tarefa que será realizada.")
+    data_inicio_limite: Optional[str] = Field(default=None, description="Data limite início do filtro de tarefas, passe no formato 'YYYY-MM-DD'.")
+    data_fim_limite: Optional[str] = Field(default=None, description="Data limite final do filtro de tarefas, passe no formato 'YYYY-MM-DD'.")
+    data_limite: Optional[str] = Field(default=None, description="Data limite para conclusão da tarefa, passe no formato 'YYYY-MM-DD'.")
+    data_inicio_criacao: Optional[str] = Field(default=None, description="Data de criação inicial do filtro de tarefas, passe no formato 'YYYY-MM-DD'.")
+    data_fim_criacao: Optional[str] = Field(default=None, description="Data de criação final do filtro de tarefas, passe no formato 'YYYY-MM-DD'.")
+    data_criacao: Optional[str] = Field(default=None, description="Data de criação da tarefa, passe no formato 'YYYY-MM-DD'.")
+    limite: int = Field(default=20, description=f"Quantidade de tarefas listadas por página (máximo {TAREFAS_PAGINA_MAX}).")
+    pagina: Optional[str] = Field(default=None, description="Valor de 'proxima_pagina' devolvido pela consulta anterior, para listar as tarefas seguintes (repita os mesmos filtros).")
+
+class RecorrenciaArgs(BaseModel):
+    inicio: str = Field(..., description="Primeira data possível, no formato 'YYYY-MM-DD'.")
+    fim: str = Field(..., description="Última data possível (inclusive), no formato 'YYYY-MM-DD'.")
+    frequencia: Literal["diaria", "semanal", "mensal"] = Field(default="semanal", description="Frequência da repetição.")
+    dias_semana: Optional[List[str]] = Field(default=None, description="Para 'semanal': dias da semana, ex.: ['segunda', 'quinta']. Se ausente, usa o dia da semana de 'inicio'.")
+    intervalo: int = Field(default=1, description="Repete a cada N dias/semanas/meses.")
+
+class AddTarefasLoteArgs(BaseModel):
+    empresa_id: int = Field(..., description="ID da empresa das tarefas.")
+    responsaveis: Optional[List[str]] = Field(default=None, description="Nomes das pessoas que irão realizar as tarefas (uma tarefa por pessoa).")
+    toda_equipe: bool = Field(default=False, description="Se verdadeiro, cria a tarefa para todos os funcionários da empresa (ignora 'responsaveis').")
+    situacao: str = Field(default="PENDENTE", description="Situação das tarefas: 'PENDENTE' | 'CONCLUÍDA' | 'CANCELADA'.")
+    tipo_tarefa: Optional[str] = Field(default=None, description="Tipo das tarefas que serão realizadas.")
+    ingredientes: Optional[List[str]] = Field(default=None, description="Ingredientes das tarefas (uma tarefa por ingrediente).")
+    datas_limite: Optional[List[str]] = Field(default=None, description="Datas limite, no formato 'YYYY-MM-DD' (uma tarefa por data).")
+    recorrencia: Optional[RecorrenciaArgs] = Field(default=None, description="Regra de repetição das datas limite, no lugar de 'datas_limite'.")
+    pedido_id: Optional[int] = Field(default=None, description="ID do pedido associado às tarefas.")
+    gestor_id: Optional[str] = Field(default=None, description="ID da pessoa que está atribuindo as tarefas.")
+
+# Campos das tools que citam cadastros por nome -> entidade em pg_resolver.ENTIDADES
+CAMPOS_RESOLVIDOS = {"responsavel": "funcionario", "ingrediente": "ingrediente", "tipo_tarefa": "tipo_tarefa"}
+
+def resolver_nomes(cursor, empresa_id: int, **nomes) -> dict:
+    # Resolução de cada nome informado, por campo: no cache em memória (referencias.py) ou no banco (pg_resolver)
+    resolver_nome = get_referencias().resolver if REFERENCIAS_CACHE else resolver
+    return {campo: resolver_nome(cursor, CAMPOS_RESOLVIDOS[campo], texto, empresa_id) for campo, texto in nomes.items() if texto}
+
+def resposta_ambigua(resolucoes: dict) -> Optional[dict]:
+    ambiguos = {campo: r["candidatos"] for campo, r in resolucoes.items() if r["ambiguo"]}
+    if not ambiguos:
         return None
-    cursor.execute(
-        "SELECT id FROM tipo_tarefa WHERE nome ILIKE %s OR descricao ILIKE %s LIMIT 1;", 
-        (f"%{tipo_tarefa.replace(" ", "%")}%", f"%{tipo_tarefa.replace(" ", "%")}%", )
-    )
-    row = cursor.fetchone()
-    return row[0] if row else 2 # tipo de tarefa 'padrão' 
-
-def get_responsavel_id(cursor, responsavel: str) -> int:
-    cursor.execute(
-        "SELECT id FROM funcionario WHERE nome ILIKE %s OR concat(nome, ' ', sobrenome) ILIKE %s LIMIT 1;",
-        (f"%{responsavel.replace(" ", "%")}%",f"%{responsavel.replace(" ", "%")}%" , )  
-    )
-    row = cursor.fetchone()
-    return row[0] if row else None
+    return {
+        "status": "ambiguo",
+        "candidatos": ambiguos,
+        "message": f"Mais de um cadastro corresponde a: {', '.join(ambiguos)}. Pergunte ao usuário qual deles.",
+    }
 
 @tool("add_tarefa", args_schema=AddTarefaArgs)
 def add_tarefa(
@@ -78,34 +108,66 @@ def add_tarefa(
     data_limite : Optional[str] = None,
 ) -> dict:
     """Adiciona/cria uma tarefa no banco de dados PostgreSQL.""" # docstring obrigatório da @tools do langchain (estranho, mas legal né?)
-    conn = get_conn()
-    cur = conn.cursor()
-
     try:
-        ingrediente_id = get_ingrediente_id(cur, ingrediente)
-        tipo_tarefa_id = get_tipo_tarefa_id(cur, tipo_tarefa)
-        responsavel_id = get_responsavel_id(cur, responsavel)
+        with get_conn() as conn, conn.cursor() as cur:
+            resolucoes = resolver_nomes(cur, empresa_id, responsavel=responsavel, ingrediente=ingrediente, tipo_tarefa=tipo_tarefa)
+            ambigua = resposta_ambigua(resolucoes)
+            if ambigua:
+                return ambigua
 
-        insert_tarefa = """
-        INSERT INTO tarefa ( empresa_id, tipo_tarefa_id, ingrediente_id, relator_id, responsavel_id, pedido_id, situacao, data_limite, data_conclusao, data_criacao)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, CURRENT_DATE) RETURNING id, data_criacao;        
-        """
+            ingrediente_id = resolucoes.get("ingrediente", {}).get("id")
+            responsavel_id = resolucoes.get("responsavel", {}).get("id")
+            tipo_tarefa_id = (resolucoes["tipo_tarefa"]["id"] or 2) if tipo_tarefa else None # tipo de tarefa 'padrão'
 
-        cur.execute(insert_tarefa, (empresa_id, tipo_tarefa_id, ingrediente_id, gestor_id, responsavel_id, pedido_id, situacao, data_limite, data_conclusao))
+            insert_tarefa = """
+            INSERT INTO tarefa ( empresa_id, tipo_tarefa_id, ingrediente_id, relator_id, responsavel_id, pedido_id, situacao, data_limite, data_conclusao, data_criacao)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, CURRENT_DATE) RETURNING id, data_criacao;        
+            """
 
-        new_id, occurred = cur.fetchone()
-        conn.commit()
-        return {"status": "ok", "id": new_id, "occurred_at": str(occurred)}
+            cur.execute(insert_tarefa, (empresa_id, tipo_tarefa_id, ingrediente_id, gestor_id, responsavel_id, pedido_id, situacao, data_limite, data_conclusao))
+
+            new_id, occurred = cur.fetchone()
+            conn.commit()
+            return {"status": "ok", "id": new_id, "occurred_at": str(occurred)}
 
     except Exception as e:
-        conn.rollback()
+        # get_conn() já desfaz a transação em caso de erro
         return {"status": "error", "message": str(e)}
-    finally:
-        try:
-            cur.close()
-            conn.close()
-        except Exception:
-            pass
+
+def resposta_nomes_invalidos(resolucoes: dict) -> Optional[dict]:
+    # Para filtros: nome ambíguo ou sem cadastro não pode virar "sem filtro"
+    ambigua = resposta_ambigua(resolucoes)
+    if ambigua:
+        return ambigua
+    nao_encontrados = [campo for campo, r in resolucoes.items() if r["id"] is None]
+    if nao_encontrados:
+        return {"status": "ok", "total": 0, "ids": [], "message": f"Nenhum cadastro encontrado para: {', '.join(nao_encontrados)}."}
+    return None
+
+# Cancelamento em um único comando: com o cache de referências os nomes já chegam resolvidos ($14-$16);
+# sem ele, tipo, responsável e ingrediente são resolvidos em subconsultas ($3-$5, mesmo ranking de
+# pg_resolver, que devolve NULL se o nome for ambíguo). Filtros ausentes chegam como NULL, então o texto
+# do SQL é sempre o mesmo e pode ser preparado uma vez por conexão.
+CANCELAR_TAREFAS_TIPOS = ("int", "unknown", "text", "text", "text", "int", "date", "date", "date", "date", "date", "date", "float8", "int", "int", "int")
+CANCELAR_TAREFAS_SQL = f"""
+    UPDATE tarefa t
+       SET situacao = $2
+     WHERE t.empresa_id = $1
+       AND ($3 IS NULL OR t.tipo_tarefa_id = {subconsulta_id_unico("tipo_tarefa", "$3", "$1", "$13")})
+       AND ($4 IS NULL OR t.responsavel_id = {subconsulta_id_unico("funcionario", "$4", "$1", "$13")})
+       AND ($5 IS NULL OR t.ingrediente_id = {subconsulta_id_unico("ingrediente", "$5", "$1", "$13")})
+       AND ($6 IS NULL OR t.pedido_id = $6)
+       AND ($7 IS NULL OR t.data_limite = $7)
+       AND ($8 IS NULL OR t.data_limite >= $8)
+       AND ($9 IS NULL OR t.data_limite <= $9)
+       AND ($10 IS NULL OR t.data_criacao = $10)
+       AND ($11 IS NULL OR t.data_criacao >= $11)
+       AND ($12 IS NULL OR t.data_criacao <= $12)
+       AND ($14 IS NULL OR t.tipo_tarefa_id = $14)
+       AND ($15 IS NULL OR t.responsavel_id = $15)
+       AND ($16 IS NULL OR t.ingrediente_id = $16)
+ RETURNING t.id
+"""
 
 @tool("cancel_tarefas", args_schema=CancelTarefaArgs)
 def cancel_tarefas(
@@ -126,63 +188,339 @@ def cancel_tarefas(
     Cancela as tarefas com filtros por responsável, gestor, tipo da tarefa, data de criação, data de limite e datas locais (America/Sao_Paulo).
     """
     try:
-        conn = get_conn()
-        cur = conn.cursor()
-                
-        sql_statement = f"""
-            UPDATE tarefa
-               SET situacao = '{situacao}'
-             WHERE empresa_id = {empresa_id} 
-        """
-
-        if tipo_tarefa:
-            tipo_tarefa_id = get_tipo_tarefa_id(cur, tipo_tarefa)
-            sql_statement += f" AND tipo_tarefa_id = {tipo_tarefa_id}"
-
-        if responsavel:
-            responsavel_id = get_responsavel_id(cur, responsavel)
-            sql_statement += f" AND responsavel_id = {responsavel_id}"
-
-        if ingrediente:
-            ingrediente_id = get_ingrediente_id(cur, ingrediente)
-            sql_statement += f" AND ingrediente_id = {ingrediente_id}"
-        
-        if pedido_id:
-            sql_statement += f" AND pedido_id = {pedido_id}"
-        
-        if data_limite:
-            sql_statement += f" AND data_limite = '{data_limite}'"
-
-        if data_inicio_limite:
-            sql_statement += f" AND data_limite >= '{data_inicio_limite}'"
-
-        if data_fim_limite:
-            sql_statement += f" AND data_limite <= '{data_fim_limite}'"
-
-        if data_criacao:
-            sql_statement += f" AND data_criacao = '{data_criacao}'"
-
-        if data_inicio_criacao:
-            sql_statement += f" AND data_criacao >= '{data_inicio_criacao}'"
-
-        if data_fim_criacao:
-            sql_statement += f" AND data_criacao <= '{data_fim_criacao}'"
-
-        sql_statement += ";"
-
-        cur.execute(sql_statement)
-        conn.commit()
-        
-        return {"status": "ok", "message": "Tarefas com os filtros especificados excluídas!"}
+        with get_conn() as conn, conn.cursor() as cur:
+            nomes = {"tipo_tarefa": tipo_tarefa, "responsavel": responsavel, "ingrediente": ingrediente}
+            ids_resolvidos = {}
+            if REFERENCIAS_CACHE:
+                # resolvidos em memória antes do UPDATE: ambíguo ou inexistente nem chega ao banco
+                resolucoes = resolver_nomes(cur, empresa_id, **nomes)
+                invalidos = resposta_nomes_invalidos(resolucoes)
+                if invalidos:
+                    return invalidos
+                ids_resolvidos = {campo: r["id"] for campo, r in resolucoes.items()}
+                nomes = {}
+
+            executar_preparado(cur, "cancelar_tarefas", CANCELAR_TAREFAS_TIPOS, CANCELAR_TAREFAS_SQL, (
+                empresa_id,
+                situacao,
+                nomes.get("tipo_tarefa"),
+                nomes.get("responsavel"),
+                nomes.get("ingrediente"),
+                pedido_id or None,
+                data_limite,
+                data_inicio_limite,
+                data_fim_limite,
+                data_criacao,
+                data_inicio_criacao,
+                data_fim_criacao,
+                RESOLVER_MARGEM,
+                ids_resolvidos.get("tipo_tarefa"),
+                ids_resolvidos.get("responsavel"),
+                ids_resolvidos.get("ingrediente"),
+            ))
+            ids = [row[0] for row in cur.fetchall()]
+            conn.commit()
+
+            if not ids and any(nomes.values()):
+                # nada cancelado: se algum nome foi ambíguo ou não existe, explica com os candidatos
+                invalidos = resposta_nomes_invalidos(resolver_nomes(cur, empresa_id, **nomes))
+                if invalidos:
+                    return invalidos
+            if not ids:
+                return {"status": "ok", "total": 0, "ids": [], "message": "Nenhuma tarefa encontrada com os filtros especificados."}
+            return {"status": "ok", "total": len(ids), "ids": ids, "message": f"{len(ids)} tarefa(s) atualizada(s) para '{situacao}'."}
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+
+# Filtros de consultar_tarefas, com os nomes já resolvidos para IDs. O texto é sempre o mesmo (filtro
+# ausente = NULL), então cada consulta é preparada uma vez por conexão. $2 é 'unknown' para assumir o
+# tipo da coluna situacao; a comparação vem antes do IS NULL para o tipo ser inferido dela.
+FILTROS_TAREFAS_TIPOS = ("int", "unknown", "int", "int", "int", "int", "date", "date", "date", "date", "date", "date")
+FILTROS_TAREFAS_SQL = """
+     WHERE t.empresa_id = $1
+       AND (t.situacao = $2 OR $2 IS NULL)
+       AND ($3 IS NULL OR t.tipo_tarefa_id = $3)
+       AND ($4 IS NULL OR t.responsavel_id = $4)
+       AND ($5 IS NULL OR t.ingrediente_id = $5)
+       AND ($6 IS NULL OR t.pedido_id = $6)
+       AND ($7 IS NULL OR t.data_limite = $7)
+       AND ($8 IS NULL OR t.data_limite >= $8)
+       AND ($9 IS NULL OR t.data_limite <= $9)
+       AND ($10 IS NULL OR t.data_criacao = $10)
+       AND ($11 IS NULL OR t.data_criacao >= $11)
+       AND ($12 IS NULL OR t.data_criacao <= $12)
+"""
+
+# Contagens por responsável, situação e dia (e o total) numa única varredura
+RESUMO_TAREFAS_SQL = f"""
+    SELECT GROUPING(t.responsavel_id), GROUPING(t.situacao), GROUPING(t.data_limite),
+           t.responsavel_id, trim(f.nome || ' ' || coalesce(f.sobrenome, '')), t.situacao, t.data_limite, count(*)
+      FROM tarefa t
+      LEFT JOIN funcionario f ON f.id = t.responsavel_id
+    {FILTROS_TAREFAS_SQL}
+     GROUP BY GROUPING SETS ((t.responsavel_id, f.nome, f.sobrenome), (t.situacao), (t.data_limite), ())
+"""
+
+# Página por keyset em (data_limite, id), com tarefas sem data limite no fim: $13/$14 são a última linha
+# da página anterior (ambos NULL na primeira página) e $15 o tamanho da página + 1, para saber se há mais.
+PAGINA_TAREFAS_TIPOS = FILTROS_TAREFAS_TIPOS + ("date", "int", "int")
+PAGINA_TAREFAS_SQL = f"""
+    SELECT t.id, t.data_limite, t.data_criacao, t.situacao, tt.nome,
+           trim(f.nome || ' ' || coalesce(f.sobrenome, '')), i.nome, t.pedido_id
+      FROM tarefa t
+      LEFT JOIN funcionario f ON f.id = t.responsavel_id
+      LEFT JOIN ingrediente i ON i.id = t.ingrediente_id
+      LEFT JOIN tipo_tarefa tt ON tt.id = t.tipo_tarefa_id
+    {FILTROS_TAREFAS_SQL}
+       AND ($14 IS NULL
+            OR ($13 IS NOT NULL AND (t.data_limite > $13 OR (t.data_limite = $13 AND t.id > $14) OR t.data_limite IS NULL))
+            OR ($13 IS NULL AND t.data_limite IS NULL AND t.id > $14))
+     ORDER BY t.data_limite NULLS LAST, t.id
+     LIMIT $15
+"""
+
+def _texto(valor) -> Optional[str]:
+    return str(valor) if valor is not None else None
+
+def resumir_tarefas(linhas) -> dict:
+    resumo = {"total": 0, "por_responsavel": [], "por_situacao": {}, "por_dia": []}
+    for sem_responsavel, sem_situacao, sem_dia, responsavel_id, responsavel, situacao, dia, total in linhas:
+        if sem_responsavel and sem_situacao and sem_dia:
+            resumo["total"] = total
+        elif not sem_responsavel:
+            resumo["por_responsavel"].append({"responsavel_id": responsavel_id, "responsavel": responsavel, "total": total})
+        elif not sem_situacao:
+            resumo["por_situacao"][situacao] = total
+        else:
+            resumo["por_dia"].append({"data": _texto(dia), "total": total})
+    resumo["por_responsavel"].sort(key=lambda g: (-g["total"], g["responsavel"] or ""))
+    resumo["por_dia"].sort(key=lambda g: (g["data"] is None, g["data"] or ""))
+    for campo in ("por_responsavel", "por_dia"):
+        if len(resumo[campo]) > TAREFAS_GRUPOS_MAX:
+            resumo[f"{campo}_omitidos"] = len(resumo[campo]) - TAREFAS_GRUPOS_MAX
+            resumo[campo] = resumo[campo][:TAREFAS_GRUPOS_MAX]
+    return resumo
+
+@tool("consultar_tarefas", args_schema=ConsultarTarefasArgs)
+def consultar_tarefas(
+    empresa_id: int,
+    situacao: Optional[str] = None,
+    responsavel: Optional[str] = None,
+    ingrediente: Optional[str] = None,
+    pedido_id: Optional[int] = None,
+    tipo_tarefa: Optional[str] = None,
+    data_inicio_limite: Optional[str] = None,
+    data_fim_limite: Optional[str] = None,
+    data_limite: Optional[str] = None,
+    data_inicio_criacao: Optional[str] = None,
+    data_fim_criacao: Optional[str] = None,
+    data_criacao: Optional[str] = None,
+    limite: int = 20,
+    pagina: Optional[str] = None,
+) -> dict:
+    """
+    Consulta/lista as tarefas com os mesmos filtros de cancel_tarefas. Devolve um resumo (total e contagens por
+    responsável, situação e dia) e uma página das tarefas, em ordem de data limite; use 'proxima_pagina' para continuar.
+    """
+    try:
+        limite = max(1, min(limite or 20, TAREFAS_PAGINA_MAX))
+        apos_data, apos_id = None, None
+        if pagina:
+            apos_data, _, apos_id = pagina.partition("|")
+            apos_data, apos_id = apos_data or None, int(apos_id)
+
+        with get_conn() as conn, conn.cursor() as cur:
+            resolucoes = resolver_nomes(cur, empresa_id, tipo_tarefa=tipo_tarefa, responsavel=responsavel, ingrediente=ingrediente)
+            invalidos = resposta_nomes_invalidos(resolucoes)
+            if invalidos:
+                return invalidos
+            ids = {campo: r["id"] for campo, r in resolucoes.items()}
+            filtros = (
+                empresa_id,
+                situacao,
+                ids.get("tipo_tarefa"),
+                ids.get("responsavel"),
+                ids.get("ingrediente"),
+                pedido_id or None,
+                data_limite,
+                data_inicio_limite,
+                data_fim_limite,
+                data_criacao,
+                data_inicio_criacao,
+                data_fim_criacao,
+            )
+
+            resumo = None
+            if not pagina:  # nas páginas seguintes o resumo já é conhecido
+                executar_preparado(cur, "resumo_tarefas", FILTROS_TAREFAS_TIPOS, RESUMO_TAREFAS_SQL, filtros)
+                resumo = resumir_tarefas(cur.fetchall())
+
+            executar_preparado(cur, "pagina_tarefas", PAGINA_TAREFAS_TIPOS, PAGINA_TAREFAS_SQL, filtros + (apos_data, apos_id, limite + 1))
+            linhas = cur.fetchall()
+            conn.commit()
+
+        tarefas = [
+            {
+                "id": id_,
+                "data_limite": _texto(limite_),
+                "data_criacao": _texto(criacao),
+                "situacao": situacao_,
+                "tipo_tarefa": tipo,
+                "responsavel": nome_responsavel,
+                "ingrediente": nome_ingrediente,
+                "pedido_id": pedido,
+            }
+            for id_, limite_, criacao, situacao_, tipo, nome_responsavel, nome_ingrediente, pedido in linhas[:limite]
+        ]
+        proxima = None
+        if len(linhas) > limite:
+            ultima = tarefas[-1]
+            proxima = f"{ultima['data_limite'] or ''}|{ultima['id']}"
+
+        resposta = {"status": "ok", "tarefas": tarefas, "proxima_pagina": proxima}
+        if resumo is not None:
+            resposta["resumo"] = resumo
+            resposta["message"] = f"{resumo['total']} tarefa(s) encontrada(s); {len(tarefas)} listada(s) nesta página."
+        else:
+            resposta["message"] = f"{len(tarefas)} tarefa(s) listada(s) nesta página."
+        return resposta
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+
+DIAS_SEMANA = {"segunda": 0, "terca": 1, "quarta": 2, "quinta": 3, "sexta": 4, "sabado": 5, "domingo": 6}
+
+def _dia_semana(nome: str) -> int:
+    chave = nome.lower().replace("ç", "c").replace("á", "a").replace("-feira", "").strip()
+    if chave not in DIAS_SEMANA:
+        raise ValueError(f"Dia da semana inválido: '{nome}'")
+    return DIAS_SEMANA[chave]
+
+def expandir_recorrencia(regra: dict, maximo: int = TAREFAS_LOTE_MAX) -> List[str]:
+    # Para assim que passar de `maximo` datas: um período longo (ex.: diária até 9999) não chega a ser gerado
+    inicio, fim = date.fromisoformat(regra["inicio"]), date.fromisoformat(regra["fim"])
+    intervalo = max(1, regra.get("intervalo") or 1)
+    frequencia = regra.get("frequencia") or "semanal"
+    datas = []
+
+    def adicionar(data):
+        datas.append(data)
+        if len(datas) > maximo:
+            raise ValueError(f"A recorrência gera mais de {maximo} datas; o limite por chamada é {maximo} tarefas. Peça um período menor.")
+
+    if frequencia == "diaria":
+        atual = inicio
+        while atual <= fim:
+            adicionar(atual)
+            atual += timedelta(days=intervalo)
+    elif frequencia == "semanal":
+        dias = {_dia_semana(d) for d in regra.get("dias_semana") or []} or {inicio.weekday()}
+        semana = inicio - timedelta(days=inicio.weekday())  # segunda-feira da 1ª semana
+        while semana <= fim:
+            for d in sorted(dias):
+                if inicio <= semana + timedelta(days=d) <= fim:
+                    adicionar(semana + timedelta(days=d))
+            semana += timedelta(weeks=intervalo)
+    else:
+        meses = 0
+        while True:
+            ano, mes = divmod(inicio.month - 1 + meses, 12)
+            if date(inicio.year + ano, mes + 1, 1) > fim:
+                break
+            meses += intervalo
+            try:
+                atual = inicio.replace(year=inicio.year + ano, month=mes + 1)
+            except ValueError:
+                continue  # mês sem esse dia (ex.: 31)
+            if atual > fim:
+                break
+            adicionar(atual)
+    return [d.isoformat() for d in datas]
+
+def ids_da_equipe(cursor, empresa_id: int) -> List[int]:
+    if REFERENCIAS_CACHE:
+        return sorted(get_referencias().indice(cursor, "funcionario", empresa_id).itens)
+    cursor.execute("SELECT id FROM funcionario WHERE empresa_id = %s ORDER BY id;", (empresa_id,))
+    return [row[0] for row in cursor.fetchall()]
+
+@tool("add_tarefas_lote", args_schema=AddTarefasLoteArgs)
+def add_tarefas_lote(
+    empresa_id: int,
+    responsaveis: Optional[List[str]] = None,
+    toda_equipe: bool = False,
+    situacao: str = "PENDENTE",
+    tipo_tarefa: Optional[str] = None,
+    ingredientes: Optional[List[str]] = None,
+    datas_limite: Optional[List[str]] = None,
+    recorrencia: Optional[dict] = None,
+    pedido_id: Optional[int] = None,
+    gestor_id: Optional[str] = None,
+) -> dict:
+    """
+    Cria várias tarefas de uma vez: uma para cada combinação de responsável x data limite x ingrediente.
+    Use para pedidos com vários responsáveis, várias datas ou repetição (ex.: toda segunda-feira do mês).
+    """
+    try:
+        if isinstance(recorrencia, BaseModel):
+            recorrencia = recorrencia.model_dump()
+        datas = expandir_recorrencia(recorrencia) if recorrencia else list(datas_limite or [None])
+        if not datas:
+            return {"status": "error", "message": "A recorrência informada não gera nenhuma data."}
+
+        with get_conn() as conn, conn.cursor() as cur:
+            # resolve todos os nomes antes de inserir qualquer coisa
+            ambiguos, nao_encontrados = {}, []
+            def ids_de(campo, nomes):
+                ids = []
+                for nome in nomes:
+                    r = resolver_nomes(cur, empresa_id, **{campo: nome})[campo]
+                    if r["ambiguo"]:
+                        ambiguos[nome] = r["candidatos"]
+                    elif r["id"] is None:
+                        nao_encontrados.append(nome)
+                    ids.append(r["id"])
+                return ids
+
+            responsavel_ids = ids_da_equipe(cur, empresa_id) if toda_equipe else ids_de("responsavel", responsaveis or [])
+            ingrediente_ids = ids_de("ingrediente", ingredientes) if ingredientes else [None]
+            tipo_tarefa_id = (resolver_nomes(cur, empresa_id, tipo_tarefa=tipo_tarefa)["tipo_tarefa"]["id"] or 2) if tipo_tarefa else None # tipo de tarefa 'padrão'
+
+            if ambiguos:
+                return {
+                    "status": "ambiguo",
+                    "candidatos": ambiguos,
+                    "message": f"Mais de um cadastro corresponde a: {', '.join(ambiguos)}. Pergunte ao usuário qual deles.",
+                }
+            if nao_encontrados:
+                return {"status": "error", "message": f"Nenhum cadastro encontrado para: {', '.join(nao_encontrados)}. Nenhuma tarefa foi criada."}
+            if not responsavel_ids:
+                return {"status": "error", "message": "Informe os responsáveis ou use toda_equipe."}
+
+            total = len(responsavel_ids) * len(datas) * len(ingrediente_ids)
+            if total > TAREFAS_LOTE_MAX:
+                return {"status": "error", "message": f"O pedido geraria {total} tarefas; o limite por chamada é {TAREFAS_LOTE_MAX}. Peça um período ou grupo menor."}
+
+            linhas = [
+                (empresa_id, tipo_tarefa_id, ingrediente_id, gestor_id, responsavel_id, pedido_id, situacao, data)
+                for responsavel_id, data, ingrediente_id in itertools.product(responsavel_ids, datas, ingrediente_ids)
+            ]
+            # um único INSERT com todas as linhas, na mesma transação
+            ids = execute_values(
+                cur,
+                """
+                INSERT INTO tarefa (empresa_id, tipo_tarefa_id, ingrediente_id, relator_id, responsavel_id, pedido_id, situacao, data_limite, data_criacao)
+                VALUES %s RETURNING id
+                """,
+                linhas,
+                template="(%s, %s, %s, %s, %s, %s, %s, %s, CURRENT_DATE)",
+                page_size=len(linhas),
+                fetch=True,
+            )
+            conn.commit()
+            return {"status": "ok", "total": len(ids), "ids": [row[0] for row in ids], "datas_limite": [d for d in datas if d]}
+
     except Exception as e:
-        conn.rollback()
+        # get_conn() já desfaz a transação em caso de erro
         return {"status": "error", "message": str(e)}
-    finally:
-        try:
-            cur.close()
-            conn.close()
-        except Exception:
-            pass
 
 # Exporta a lista de tools
-TAREFAS_TOOLS = [add_tarefa, cancel_tarefas]
\ No newline at end of file
+TAREFAS_TOOLS = [add_tarefa, add_tarefas_lote, consultar_tarefas, cancel_tarefas]
\ No newline at end of file
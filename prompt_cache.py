@@ -0,0 +1,151 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from dotenv import load_dotenv
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables import RunnableLambda
+from telemetria import registrar_tokens
+
+load_dotenv()
+
+# Cache de contexto explícito do Gemini para os prefixos estáticos (cobrado por armazenamento/hora).
+# Sem ele, os modelos 2.5 ainda aproveitam o cache implícito, que depende do prefixo idêntico byte a byte.
+PROMPT_CACHE_EXPLICITO = os.getenv("PROMPT_CACHE_EXPLICITO", "false").lower() == "true"
+PROMPT_CACHE_TTL = int(os.getenv("PROMPT_CACHE_TTL", "3600"))              # segundos de vida do cache no provedor
+PROMPT_CACHE_MIN_TOKENS = int(os.getenv("PROMPT_CACHE_MIN_TOKENS", "1024"))  # abaixo disso o provedor recusa o cache
+PROMPT_CACHE_ESPERA_ERRO = int(os.getenv("PROMPT_CACHE_ESPERA_ERRO", "600"))  # segundos sem tentar de novo após falha
+
+
+def _conteudo(mensagem):
+    return mensagem.content if isinstance(mensagem.content, str) else json.dumps(mensagem.content, ensure_ascii=False)
+
+
+class PrefixoEstatico:
+    """
+    Parte fixa de um prompt (system prompt + few-shots) renderizada uma única vez na inicialização.
+    As mensagens resultantes entram no template como mensagens prontas, então são enviadas idênticas
+    em todas as chamadas; data, empresa, resumo e entrada ficam no sufixo (mensagem do usuário).
+    """
+
+    def __init__(self, etapa, *mensagens_template):
+        self.etapa = etapa
+        # format_messages() falha se sobrar alguma variável: nada dinâmico entra no prefixo
+        self.mensagens = ChatPromptTemplate.from_messages(list(mensagens_template)).format_messages()
+        serializado = json.dumps([(m.type, _conteudo(m)) for m in self.mensagens], ensure_ascii=False)
+        self.assinatura = hashlib.sha256(serializado.encode("utf-8")).hexdigest()
+        self.tokens_estimados = len(serializado) // 4
+        self._cache_nome = None
+        self._cache_expira = 0.0
+        self._proxima_tentativa = 0.0
+        self._lock = threading.Lock()
+
+    def _criar_cache(self, llm):
+        from google.ai.generativelanguage_v1beta import CacheServiceClient, CachedContent
+        from google.protobuf import duration_pb2
+        from langchain_google_genai.chat_models import _parse_chat_history
+
+        client = CacheServiceClient(client_options={"api_key": llm.google_api_key.get_secret_value()})
+        system_instruction, contents = _parse_chat_history(self.mensagens)
+        cache = client.create_cached_content(cached_content=CachedContent(
+            model=llm.model,
+            display_name=f"chefia-{self.etapa}-{self.assinatura[:12]}",
+            system_instruction=system_instruction,
+            contents=contents,
+            ttl=duration_pb2.Duration(seconds=PROMPT_CACHE_TTL),
+        ))
+        return cache.name
+
+    def nome_cache(self, llm):
+        """Nome do cache explícito válido para este prefixo, criando-o se preciso; None se indisponível."""
+        if not PROMPT_CACHE_EXPLICITO or self.tokens_estimados < PROMPT_CACHE_MIN_TOKENS:
+            return None
+        agora = time.time()
+        # renova com 1 minuto de folga para não usar um cache que expira no meio da chamada
+        if self._cache_nome and agora < self._cache_expira - 60:
+            return self._cache_nome
+        if agora < self._proxima_tentativa:
+            return None
+        with self._lock:
+            if self._cache_nome and agora < self._cache_expira - 60:
+                return self._cache_nome
+            try:
+                self._cache_nome = self._criar_cache(llm)
+                self._cache_expira = agora + PROMPT_CACHE_TTL
+            except Exception as e:
+                print(f"Cache de contexto indisponível para '{self.etapa}': {e}")
+                self._cache_nome = None
+                self._proxima_tentativa = agora + PROMPT_CACHE_ESPERA_ERRO
+        return self._cache_nome
+
+    def llm(self, llm):
+        """
+        Envolve o LLM de uma chain sem tools: com cache explícito ativo, o prefixo é retirado das
+        mensagens e referenciado por `cached_content`; senão o prompt completo segue para o LLM.
+        """
+        def chamar(valor_prompt):
+            mensagens = valor_prompt.to_messages()
+            nome = self.nome_cache(llm)
+            if nome is None:
+                return llm
+            sufixo = mensagens[len(self.mensagens):]
+            return RunnableLambda(lambda _: sufixo) | llm.bind(cached_content=nome)
+        return RunnableLambda(chamar, name=f"llm_{self.etapa}")
+
+    def stats(self):
+        return {
+            "assinatura": self.assinatura[:12],
+            "tokens_estimados": self.tokens_estimados,
+            "cache_explicito": self._cache_nome,
+        }
+
+
+class UsoTokens:
+    """Soma, por etapa, os tokens de entrada lidos do cache do provedor e os enviados sem cache."""
+
+    def __init__(self):
+        self.etapas = {}
+        self._lock = threading.Lock()
+
+    def para(self, etapa):
+        return _UsoEtapa(self, etapa)
+
+    def registrar(self, etapa, uso):
+        entrada = uso.get("input_tokens", 0)
+        cacheados = (uso.get("input_token_details") or {}).get("cache_read", 0) or 0
+        with self._lock:
+            contagem = self.etapas.setdefault(etapa, {"chamadas": 0, "tokens_entrada": 0, "tokens_cacheados": 0, "tokens_saida": 0})
+            contagem["chamadas"] += 1
+            contagem["tokens_entrada"] += entrada
+            contagem["tokens_cacheados"] += cacheados
+            contagem["tokens_saida"] += uso.get("output_tokens", 0)
+        registrar_tokens(etapa, entrada, cacheados, uso.get("output_tokens", 0))
+
+    def stats(self):
+        with self._lock:
+            return {
+                etapa: {
+                    **c,
+                    "tokens_sem_cache": c["tokens_entrada"] - c["tokens_cacheados"],
+                    "proporcao_cacheada": c["tokens_cacheados"] / c["tokens_entrada"] if c["tokens_entrada"] else 0.0,
+                }
+                for etapa, c in self.etapas.items()
+            }
+
+
+class _UsoEtapa(BaseCallbackHandler):
+    def __init__(self, uso, etapa):
+        self.uso = uso
+        self.etapa = etapa
+
+    def on_llm_end(self, response, **kwargs):
+        for geracoes in response.generations:
+            for geracao in geracoes:
+                uso = getattr(getattr(geracao, "message", None), "usage_metadata", None)
+                if uso:
+                    self.uso.registrar(self.etapa, uso)
+
+
+uso_tokens = UsoTokens()
@@ -0,0 +1,264 @@
+"""
+Cache em memória, por empresa, dos cadastros citados por nome nas tools de tarefas (funcionário,
+ingrediente e tipo de tarefa). Cada tabela é carregada na primeira consulta da empresa e resolvida
+localmente por um índice de trigramas sem acento. O critério aproxima o de pg_resolver, mas não é
+idêntico: em vez do word_similarity do pg_trgm (trigramas em comum / trigramas da consulta), usa o
+Jaccard entre a consulta e o melhor trecho contínuo de palavras do cadastro, com a mesma margem para
+ambiguidade; perto do limite de similaridade os dois podem divergir. A invalidação é por TTL e, com
+REFERENCIAS_LISTEN, pelas notificações dos triggers de migrations/0002_notificar_referencias.sql.
+"""
+import os
+import re
+import time
+import select
+import threading
+import unicodedata
+import psycopg2
+from dotenv import load_dotenv
+
+from cache import TTLCache
+from pg_resolver import ENTIDADES, RESOLVER_MARGEM, RESOLVER_CANDIDATOS
+
+load_dotenv()
+
+SQL_URL = os.getenv("SQL_URL")
+REFERENCIAS_CACHE = os.getenv("REFERENCIAS_CACHE", "true").lower() == "true"
+REFERENCIAS_TTL = int(os.getenv("REFERENCIAS_TTL", "300"))                  # segundos até recarregar uma tabela
+REFERENCIAS_MAX = int(os.getenv("REFERENCIAS_MAX", "1500"))                 # tabelas (entidade, empresa) em memória
+REFERENCIAS_MIN_SIMILARIDADE = float(os.getenv("REFERENCIAS_MIN_SIMILARIDADE", "0.6"))  # padrão do pg_trgm.word_similarity_threshold
+REFERENCIAS_RECARGA_MIN = float(os.getenv("REFERENCIAS_RECARGA_MIN", "30"))  # intervalo mínimo entre recargas por nome não encontrado
+REFERENCIAS_LISTEN = os.getenv("REFERENCIAS_LISTEN", "false").lower() == "true"
+REFERENCIAS_LOCKS = 64  # faixas de chaves (lock de carga + geração): número fixo, não cresce com as empresas
+CANAL_REFERENCIAS = "referencias_alteradas"
+
+
+def normalizar(texto):
+    texto = unicodedata.normalize("NFKD", texto.lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    return re.sub(r"[^\w]+", " ", texto).split()
+
+
+def trigramas(palavra):
+    # mesma decomposição do pg_trgm: duas posições em branco antes e uma depois da palavra
+    texto = f"  {palavra} "
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+
+class IndiceFuzzy:
+    """Índice invertido trigrama -> cadastros de uma tabela, com similaridade por trecho de palavras."""
+
+    def __init__(self, linhas):
+        self.carregado_em = time.monotonic()
+        self.itens = {}     # id -> (rótulo, [trigramas de cada palavra])
+        self.indice = {}    # trigrama -> {id}
+        for id_, rotulo in linhas:
+            palavras = [trigramas(p) for p in normalizar(rotulo or "")]
+            self.itens[id_] = ((rotulo or "").strip(), palavras)
+            for conjunto in palavras:
+                for trigrama in conjunto:
+                    self.indice.setdefault(trigrama, set()).add(id_)
+
+    def __len__(self):
+        return len(self.itens)
+
+    @staticmethod
+    def _similaridade(consulta, palavras, max_palavras):
+        # melhor Jaccard entre os trigramas da consulta e um trecho contínuo de palavras do cadastro
+        melhor = 0.0
+        for inicio in range(len(palavras)):
+            trecho = set()
+            for fim in range(inicio, min(len(palavras), inicio + max_palavras)):
+                trecho |= palavras[fim]
+                melhor = max(melhor, len(consulta & trecho) / len(consulta | trecho))
+        return melhor
+
+    def buscar(self, texto, minimo=REFERENCIAS_MIN_SIMILARIDADE, limite=RESOLVER_CANDIDATOS):
+        palavras = normalizar(texto)
+        consulta = set().union(*(trigramas(p) for p in palavras)) if palavras else set()
+        if not consulta:
+            return []
+
+        comuns = {}
+        for trigrama in consulta:
+            for id_ in self.indice.get(trigrama, ()):
+                comuns[id_] = comuns.get(id_, 0) + 1
+
+        candidatos = []
+        for id_, total in comuns.items():
+            if total / len(consulta) < minimo:
+                continue  # nem o melhor trecho possível alcançaria o mínimo
+            rotulo, trigramas_palavras = self.itens[id_]
+            score = self._similaridade(consulta, trigramas_palavras, len(palavras) + 1)
+            if score >= minimo:
+                candidatos.append({"id": id_, "nome": rotulo, "score": round(score, 3)})
+        candidatos.sort(key=lambda c: (-c["score"], c["id"]))
+        return candidatos[:limite]
+
+
+class CacheReferencias:
+    def __init__(self, ttl=REFERENCIAS_TTL, maximo=REFERENCIAS_MAX, listen=REFERENCIAS_LISTEN):
+        self.cache = TTLCache(maxsize=maximo, ttl=ttl)
+        self.listen = listen
+        self.pid = os.getpid()
+        self._locks = [threading.Lock() for _ in range(REFERENCIAS_LOCKS)]
+        self._geracoes = [0] * REFERENCIAS_LOCKS  # incrementada a cada invalidação de uma chave da faixa
+        self._lock = threading.Lock()
+        self._ouvinte = None
+        self._parar = threading.Event()
+        self.contagem = {"cargas": 0, "recargas_nao_encontrado": 0, "invalidacoes": 0, "notificacoes": 0}
+
+    @staticmethod
+    def _chave(entidade, empresa_id):
+        return (entidade, empresa_id if ENTIDADES[entidade]["por_empresa"] else None)
+
+    def _faixa(self, chave):
+        return hash(chave) % len(self._locks)
+
+    def _carregar(self, cur, entidade, empresa_id):
+        config = ENTIDADES[entidade]
+        sql = f"SELECT e.id, {config['texto'].format(a='e')} FROM {config['tabela']} e"
+        if config["por_empresa"]:
+            cur.execute(sql + " WHERE e.empresa_id = %s", (empresa_id,))
+        else:
+            cur.execute(sql)
+        with self._lock:
+            self.contagem["cargas"] += 1
+        return IndiceFuzzy(cur.fetchall())
+
+    def indice(self, cur, entidade, empresa_id, recarregar=False):
+        self._iniciar_ouvinte()
+        chave = self._chave(entidade, empresa_id)
+        indice = None if recarregar else self.cache.get(chave)
+        if indice is not None:
+            return indice
+        faixa = self._faixa(chave)
+        with self._locks[faixa]:
+            # outra thread pode ter carregado enquanto esta esperava
+            indice = None if recarregar else self.cache.get(chave)
+            if indice is None:
+                with self._lock:
+                    geracao = self._geracoes[faixa]
+                indice = self._carregar(cur, entidade, empresa_id)
+                with self._lock:
+                    # invalidada durante a carga: o SELECT pode ter lido o cadastro antigo, então não vai
+                    # para o cache (esta consulta usa o que leu; a próxima recarrega)
+                    if self._geracoes[faixa] == geracao:
+                        self.cache.set(chave, indice)
+        return indice
+
+    def resolver(self, cur, entidade, texto, empresa_id=None, margem=RESOLVER_MARGEM):
+        """Mesmo retorno de pg_resolver.resolver: {"id", "ambiguo", "candidatos"}."""
+        if not texto:
+            return {"id": None, "ambiguo": False, "candidatos": []}
+
+        indice = self.indice(cur, entidade, empresa_id)
+        candidatos = indice.buscar(texto)
+        if not candidatos:
+            # cadastro novo ainda fora do cache: recarrega a tabela, no máximo a cada REFERENCIAS_RECARGA_MIN
+            if time.monotonic() - indice.carregado_em >= REFERENCIAS_RECARGA_MIN:
+                with self._lock:
+                    self.contagem["recargas_nao_encontrado"] += 1
+                candidatos = self.indice(cur, entidade, empresa_id, recarregar=True).buscar(texto)
+        if not candidatos:
+            return {"id": None, "ambiguo": False, "candidatos": []}
+
+        unico = len(candidatos) == 1 or candidatos[0]["score"] - candidatos[1]["score"] >= margem
+        return {
+            "id": candidatos[0]["id"] if unico else None,
+            "ambiguo": not unico,
+            "candidatos": candidatos[:1] if unico else candidatos,
+        }
+
+    def invalidar(self, entidade=None, empresa_id=None):
+        with self._lock:
+            self.contagem["invalidacoes"] += 1
+            if entidade is None:
+                self._geracoes = [g + 1 for g in self._geracoes]
+                self.cache.clear()
+            else:
+                chave = self._chave(entidade, empresa_id)
+                self._geracoes[self._faixa(chave)] += 1
+                self.cache.delete(chave)
+
+    def _aplicar(self, payload):
+        # payload "<tabela>" ou "<tabela>:<empresa_id>" (ver notificar_referencia() na migração)
+        tabela, _, empresa = payload.partition(":")
+        with self._lock:
+            self.contagem["notificacoes"] += 1
+        for entidade, config in ENTIDADES.items():
+            if config["tabela"] == tabela:
+                self.invalidar(entidade, int(empresa) if empresa else None)
+
+    def _iniciar_ouvinte(self):
+        if not self.listen or self._ouvinte is not None:
+            return
+        with self._lock:
+            if self._ouvinte is None:
+                self._ouvinte = threading.Thread(target=self._ouvir, name="referencias-listen", daemon=True)
+                self._ouvinte.start()
+
+    def _ouvir(self):
+        # Conexão dedicada (fora do pool) escutando o canal; ao (re)conectar tudo é invalidado,
+        # pois notificações enviadas enquanto estava desconectado se perderam.
+        espera = 1
+        while not self._parar.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(SQL_URL, connect_timeout=5)
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {CANAL_REFERENCIAS};")
+                self.invalidar()
+                espera = 1
+                while not self._parar.is_set():
+                    if select.select([conn], [], [], 5) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        self._aplicar(conn.notifies.pop(0).payload)
+            except Exception as e:
+                print(f"LISTEN {CANAL_REFERENCIAS} interrompido: {e}")
+                self._parar.wait(espera)
+                espera = min(espera * 2, 60)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+
+    def fechar(self):
+        self._parar.set()
+
+    def stats(self):
+        return {**self.cache.stats(), **self.contagem, "listen": self._ouvinte is not None}
+
+
+_referencias = None
+_referencias_lock = threading.Lock()
+
+
+def get_referencias() -> CacheReferencias:
+    # Um cache por processo; o ouvinte (thread + conexão) não sobrevive a fork
+    global _referencias
+    if _referencias is None or _referencias.pid != os.getpid():
+        with _referencias_lock:
+            if _referencias is None or _referencias.pid != os.getpid():
+                _referencias = CacheReferencias()
+    return _referencias
+
+
+def _reset_apos_fork():
+    global _referencias, _referencias_lock
+    _referencias_lock = threading.Lock()
+    _referencias = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_apos_fork)
+
+
+def referencias_stats() -> dict:
+    if not REFERENCIAS_CACHE or _referencias is None or _referencias.pid != os.getpid():
+        return {}
+    return _referencias.stats()
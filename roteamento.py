@@ -0,0 +1,178 @@
+import os
+import re
+import json
+import threading
+import unicodedata
+from collections import deque
+from dotenv import load_dotenv
+from embeddings import get_embedder, embed_query, cosseno
+
+load_dotenv()
+
+ROTEADOR_LOCAL = os.getenv("ROTEADOR_LOCAL", "true").lower() == "true"
+ROTEADOR_USAR_EMBEDDING = os.getenv("ROTEADOR_USAR_EMBEDDING", "true").lower() == "true"
+ROTEADOR_MIN_SIMILARIDADE = float(os.getenv("ROTEADOR_MIN_SIMILARIDADE", "0.55"))  # similaridade mínima com o centróide
+ROTEADOR_MIN_MARGEM = float(os.getenv("ROTEADOR_MIN_MARGEM", "0.12"))              # distância mínima para o 2º colocado
+ROTEADOR_LOG_PATH = os.getenv("ROTEADOR_LOG_PATH")  # JSONL com as decisões do roteador LLM (alimenta os centróides)
+ROTEADOR_LOG_MAX = int(os.getenv("ROTEADOR_LOG_MAX", "2000"))
+
+ROTAS = ("receitas", "tarefas")
+RESPOSTA_SAUDACAO = "Olá! Posso te ajudar com quais consultas hoje?"
+RESPOSTA_AGRADECIMENTO = "Por nada! Se precisar de mais alguma consulta, é só chamar."
+
+
+def normalizar(texto):
+    texto = unicodedata.normalize("NFKD", texto.lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    return " ".join(re.sub(r"[^\w\s]", " ", texto).split())
+
+
+# Mensagens compostas apenas por saudação/small talk; com agradecimento, a resposta é de encerramento
+SAUDACAO = re.compile(
+    r"^((oi+|ola|opa|eai|e ai|hey|bom dia|boa tarde|boa noite|tudo bem|tudo bom|como vai|"
+    r"chefia|chefe|obrigad[oa]|muito obrigad[oa]|valeu|brigad[oa])\s*)+$"
+)
+AGRADECIMENTO = re.compile(r"\b(obrigad[oa]|brigad[oa]|valeu)\b")
+
+PALAVRAS_CHAVE = {
+    "receitas": re.compile(
+        r"\b(receitas?|modo de preparo|passo a passo|pratos?|cozinhar|preparar|sobremesas?|"
+        r"cardapio|almoco|jantar|cafe da manha|lanches?)\b"
+    ),
+    "tarefas": re.compile(
+        r"\b(tarefas?|agend\w*|cancel\w*|responsavel|funcionari[oa]s?|conferencia de estoque|"
+        r"contagem de estoque|pendentes?|atribu\w*|equipe)\b"
+    ),
+}
+
+# Exemplos além dos few-shots do roteador, para compor os centróides
+EXEMPLOS_BASE = [
+    ("receitas", "Quais receitas de frango eu tenho?"),
+    ("receitas", "Que massa eu posso fazer hoje?"),
+    ("receitas", "Me mostra o modo de preparo do risoto"),
+    ("receitas", "Tem alguma sobremesa com chocolate?"),
+    ("receitas", "Quero um resumo dos tipos de receitas disponíveis"),
+    ("tarefas", "Cancele as tarefas da semana que vem para Gabriel Koji"),
+    ("tarefas", "Quais são as tarefas agendadas para amanhã?"),
+    ("tarefas", "Crie uma conferência de estoque de arroz para a Raissa"),
+    ("tarefas", "Quantas tarefas pendentes o Bruno tem?"),
+    ("conversa", "Obrigado pela ajuda!"),
+    ("conversa", "Qual a previsão do tempo?"),
+    ("conversa", "O que você sabe fazer?"),
+]
+
+
+class Decisao:
+    def __init__(self, rota=None, resposta=None, origem="llm", confianca=0.0):
+        self.rota = rota            # "receitas" | "tarefas" | None (sem decisão local)
+        self.resposta = resposta    # resposta direta (saudação), sem passar pelo LLM
+        self.origem = origem        # "saudacao" | "palavras_chave" | "embedding" | "llm"
+        self.confianca = confianca
+
+
+def rota_da_resposta(resp_roteador):
+    for rota in ROTAS:
+        if f"ROUTE={rota}" in resp_roteador:
+            return rota
+    return "conversa"
+
+
+def montar_encaminhamento(rota, pergunta):
+    # Mesmo protocolo textual que o roteador LLM envia aos especialistas
+    return f"ROUTE={rota}\nPERGUNTA_ORIGINAL={pergunta}\nPERSONA={{PERSONA_SISTEMA}}\nCLARIFY="
+
+
+class ClassificadorIntencao:
+    """
+    Pré-roteador local: saudações e mensagens com palavras-chave inequívocas são decididas na hora;
+    o resto passa por um classificador de centróide mais próximo sobre embeddings. Só quando nenhum
+    dos dois tem confiança suficiente a mensagem vai para o roteador LLM.
+    """
+
+    def __init__(self, exemplos, min_similaridade=ROTEADOR_MIN_SIMILARIDADE, min_margem=ROTEADOR_MIN_MARGEM,
+                 usar_embedding=ROTEADOR_USAR_EMBEDDING, log_path=ROTEADOR_LOG_PATH):
+        self.exemplos = list(exemplos)
+        self.min_similaridade = min_similaridade
+        self.min_margem = min_margem
+        self.usar_embedding = usar_embedding
+        self.log_path = log_path
+        self._centroides = None
+        self._lock = threading.Lock()
+        self.contagem = {"saudacao": 0, "palavras_chave": 0, "embedding": 0, "llm": 0}
+
+        if log_path and os.path.exists(log_path):
+            with open(log_path, encoding="utf-8") as f:
+                for linha in deque(f, maxlen=ROTEADOR_LOG_MAX):
+                    try:
+                        registro = json.loads(linha)
+                        self.exemplos.append((registro["rota"], registro["texto"]))
+                    except (ValueError, KeyError):
+                        continue
+
+    @classmethod
+    def from_shots(cls, shots, **kwargs):
+        exemplos = [(rota_da_resposta(s["ai"]), s["human"]) for s in shots] + EXEMPLOS_BASE
+        return cls(exemplos, **kwargs)
+
+    def _calcular_centroides(self):
+        embedder = get_embedder()
+        vetores = embedder.embed([texto for _, texto in self.exemplos])
+        somas = {}
+        for (rota, _), vetor in zip(self.exemplos, vetores):
+            soma = somas.setdefault(rota, [0.0] * len(vetor))
+            for i, v in enumerate(vetor):
+                soma[i] += v
+        return somas  # a soma tem a mesma direção da média, suficiente para o cosseno
+
+    def _por_embedding(self, pergunta):
+        if self._centroides is None:
+            with self._lock:
+                if self._centroides is None:
+                    self._centroides = self._calcular_centroides()
+        vetor = embed_query(pergunta)
+        ranking = sorted(((cosseno(vetor, c), rota) for rota, c in self._centroides.items()), reverse=True)
+        (melhor, rota), segundo = ranking[0], (ranking[1][0] if len(ranking) > 1 else 0.0)
+        if rota in ROTAS and melhor >= self.min_similaridade and melhor - segundo >= self.min_margem:
+            return Decisao(rota=rota, origem="embedding", confianca=melhor - segundo)
+        return None
+
+    def classificar(self, pergunta, com_historico=False):
+        """
+        Com `com_historico` (a sessão tem mensagens recentes), só saudações e agradecimentos são decididos
+        aqui: uma continuação como "e o passo a passo da segunda?" depende do contexto que o roteador LLM vê.
+        """
+        texto = normalizar(pergunta)
+        decisao = None
+
+        if SAUDACAO.match(texto):
+            resposta = RESPOSTA_AGRADECIMENTO if AGRADECIMENTO.search(texto) else RESPOSTA_SAUDACAO
+            decisao = Decisao(resposta=resposta, origem="saudacao", confianca=1.0)
+        elif com_historico:
+            pass
+        else:
+            acertos = [rota for rota, regex in PALAVRAS_CHAVE.items() if regex.search(texto)]
+            if len(acertos) == 1:
+                decisao = Decisao(rota=acertos[0], origem="palavras_chave", confianca=1.0)
+            elif self.usar_embedding:
+                try:
+                    decisao = self._por_embedding(pergunta)
+                except Exception as e:
+                    # sem embedding disponível, o roteador LLM decide
+                    print(f"Pré-roteador indisponível: {e}")
+
+        decisao = decisao or Decisao()
+        self.contagem[decisao.origem] += 1
+        return decisao
+
+    def registrar(self, pergunta, resp_roteador):
+        # Guarda a decisão do roteador LLM como exemplo rotulado para os próximos centróides
+        if not self.log_path:
+            return
+        registro = {"texto": pergunta, "rota": rota_da_resposta(resp_roteador)}
+        with self._lock, open(self.log_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(registro, ensure_ascii=False) + "\n")
+
+    def stats(self):
+        total = sum(self.contagem.values())
+        locais = total - self.contagem["llm"]
+        return {**self.contagem, "total": total, "hit_rate": locais / total if total else 0.0}
@@ -0,0 +1,369 @@
+"""
+Telemetria do pipeline do ChefIA: spans OpenTelemetry e métricas no formato texto do Prometheus (/metrics).
+
+Os spans usam a API do OpenTelemetry quando instalada (sem ela, `medir` só registra as métricas). Para
+exportar, rode com `opentelemetry-instrument` ou defina OTEL_EXPORTER_OTLP_ENDPOINT com o SDK e o
+exportador OTLP instalados. As métricas não dependem de nenhum pacote: cada worker expõe as suas.
+"""
+import os
+import time
+import asyncio
+import functools
+import threading
+from contextlib import contextmanager
+from langchain_core.callbacks import BaseCallbackHandler
+from dotenv import load_dotenv
+
+try:
+    from opentelemetry import trace
+except ImportError:
+    trace = None
+
+load_dotenv()
+
+TELEMETRIA = os.getenv("TELEMETRIA", "true").lower() == "true"
+OTEL_EXPORTER_OTLP_ENDPOINT = os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT")
+# segundos; cobre de consultas locais (ms) até respostas completas do agente
+BUCKETS_DURACAO = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40)
+
+
+def _escapar(valor):
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _rotulos(nomes, valores):
+    if not nomes:
+        return ""
+    return "{" + ",".join(f'{n}="{_escapar(v)}"' for n, v in zip(nomes, valores)) + "}"
+
+
+class Contador:
+    def __init__(self, nome, ajuda, rotulos=()):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.rotulos = tuple(rotulos)
+        self._valores = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *valores, quantidade=1):
+        with self._lock:
+            self._valores[valores] = self._valores.get(valores, 0) + quantidade
+
+    def valores(self):
+        with self._lock:
+            return dict(self._valores)
+
+    def zerar(self):
+        with self._lock:
+            self._valores.clear()
+
+    def exportar(self):
+        linhas = [f"# HELP {self.nome} {self.ajuda}", f"# TYPE {self.nome} counter"]
+        with self._lock:
+            for valores, total in sorted(self._valores.items()):
+                linhas.append(f"{self.nome}{_rotulos(self.rotulos, valores)} {total}")
+        return linhas
+
+
+class Histograma:
+    def __init__(self, nome, ajuda, rotulos=(), buckets=BUCKETS_DURACAO):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.rotulos = tuple(rotulos)
+        self.buckets = tuple(buckets)
+        self._series = {}  # valores dos rótulos -> [contagem por bucket..., soma, total]
+        self._lock = threading.Lock()
+
+    def observar(self, valor, *valores):
+        with self._lock:
+            serie = self._series.setdefault(valores, [0] * len(self.buckets) + [0.0, 0])
+            for i, limite in enumerate(self.buckets):
+                if valor <= limite:
+                    serie[i] += 1
+            serie[-2] += valor
+            serie[-1] += 1
+
+    def _quantil(self, serie, q):
+        # interpolação linear dentro do bucket, como o histogram_quantile do Prometheus
+        alvo = q * serie[-1]
+        anterior_limite, anterior_contagem = 0.0, 0
+        for limite, contagem in zip(self.buckets, serie):
+            if contagem >= alvo:
+                if contagem == anterior_contagem:
+                    return limite
+                return anterior_limite + (limite - anterior_limite) * (alvo - anterior_contagem) / (contagem - anterior_contagem)
+            anterior_limite, anterior_contagem = limite, contagem
+        return self.buckets[-1]
+
+    def resumo(self):
+        """{valores dos rótulos: {total, soma, media, p50, p95}} com quantis estimados pelos buckets."""
+        with self._lock:
+            series = {valores: list(serie) for valores, serie in self._series.items()}
+        return {
+            valores: {
+                "total": serie[-1],
+                "soma": serie[-2],
+                "media": serie[-2] / serie[-1] if serie[-1] else 0.0,
+                "p50": self._quantil(serie, 0.5),
+                "p95": self._quantil(serie, 0.95),
+            }
+            for valores, serie in series.items()
+        }
+
+    def zerar(self):
+        with self._lock:
+            self._series.clear()
+
+    def exportar(self):
+        linhas = [f"# HELP {self.nome} {self.ajuda}", f"# TYPE {self.nome} histogram"]
+        with self._lock:
+            for valores, serie in sorted(self._series.items()):
+                for limite, contagem in zip(self.buckets, serie):
+                    linhas.append(f"{self.nome}_bucket{_rotulos(self.rotulos + ('le',), valores + (limite,))} {contagem}")
+                linhas.append(f"{self.nome}_bucket{_rotulos(self.rotulos + ('le',), valores + ('+Inf',))} {serie[-1]}")
+                linhas.append(f"{self.nome}_sum{_rotulos(self.rotulos, valores)} {serie[-2]}")
+                linhas.append(f"{self.nome}_count{_rotulos(self.rotulos, valores)} {serie[-1]}")
+        return linhas
+
+
+class Registro:
+    def __init__(self):
+        self.metricas = []
+        self.coletores = []  # funções chamadas a cada scrape, para valores que já existem em outros stats
+
+    def contador(self, nome, ajuda, rotulos=()):
+        metrica = Contador(nome, ajuda, rotulos)
+        self.metricas.append(metrica)
+        return metrica
+
+    def histograma(self, nome, ajuda, rotulos=(), buckets=BUCKETS_DURACAO):
+        metrica = Histograma(nome, ajuda, rotulos, buckets)
+        self.metricas.append(metrica)
+        return metrica
+
+    def zerar(self):
+        for metrica in self.metricas:
+            metrica.zerar()
+
+    def coletor(self, funcao):
+        """`funcao()` devolve [(nome, ajuda, tipo, {rótulo: valor}, valor)]; registrado uma vez na inicialização."""
+        self.coletores.append(funcao)
+        return funcao
+
+    def exportar(self):
+        linhas = []
+        for metrica in self.metricas:
+            linhas += metrica.exportar()
+        vistos = set()
+        for coletor in self.coletores:
+            try:
+                amostras = coletor()
+            except Exception as e:
+                print(f"Coletor de métricas falhou: {e}")
+                continue
+            for nome, ajuda, tipo, rotulos, valor in amostras:
+                if nome not in vistos:
+                    vistos.add(nome)
+                    linhas += [f"# HELP {nome} {ajuda}", f"# TYPE {nome} {tipo}"]
+                linhas.append(f"{nome}{_rotulos(tuple(rotulos), tuple(rotulos.values()))} {valor}")
+        return "\n".join(linhas) + "\n"
+
+
+metricas = Registro()
+CONTENT_TYPE_METRICAS = "text/plain; version=0.0.4; charset=utf-8"
+
+DURACAO_ETAPA = metricas.histograma("chefia_etapa_duracao_segundos", "Duração de cada etapa do pipeline.", ("etapa",))
+ERROS_ETAPA = metricas.contador("chefia_etapa_erros_total", "Exceções por etapa do pipeline.", ("etapa",))
+DURACAO_TOOL = metricas.histograma("chefia_tool_duracao_segundos", "Duração de cada chamada de tool dos agentes.", ("tool",))
+ERROS_TOOL = metricas.contador("chefia_tool_erros_total", "Tools que lançaram exceção ou devolveram status 'error'.", ("tool",))
+ITERACOES_AGENTE = metricas.contador("chefia_agente_iteracoes_total", "Ações (chamadas de tool) decididas pelos agentes.", ("etapa",))
+TOKENS = metricas.contador("chefia_llm_tokens_total", "Tokens por etapa: entrada, cacheados (parte da entrada lida do cache) e saida.", ("etapa", "tipo"))
+CHAMADAS_LLM = metricas.contador("chefia_llm_chamadas_total", "Chamadas ao LLM por etapa.", ("etapa",))
+POSTGRES = metricas.histograma("chefia_postgres_duracao_segundos", "Duração dos comandos no Postgres.", ("comando",))
+ESPECULACAO = metricas.histograma("chefia_especulacao_duracao_segundos", "Duração das pré-buscas de receitas por desfecho; o que não é 'usada' foi trabalho desperdiçado.", ("desfecho",))
+ESPECULACAO_ESPERA = metricas.histograma("chefia_especulacao_espera_segundos", "Espera pela pré-busca depois da decisão de rota (0 = latência toda escondida pelo roteador).")
+
+
+def _configurar_tracing():
+    # Só configura o SDK se nada (ex.: opentelemetry-instrument) já tiver instalado um provider
+    if trace is None or not OTEL_EXPORTER_OTLP_ENDPOINT:
+        return
+    try:
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+    except ImportError as e:
+        raise RuntimeError("OTEL_EXPORTER_OTLP_ENDPOINT requer 'opentelemetry-sdk' e 'opentelemetry-exporter-otlp-proto-http'.") from e
+    if isinstance(trace.get_tracer_provider(), TracerProvider):
+        return
+    provider = TracerProvider(resource=Resource.create({"service.name": os.getenv("OTEL_SERVICE_NAME", "codcoz-chefia")}))
+    provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    trace.set_tracer_provider(provider)
+
+
+if TELEMETRIA:
+    _configurar_tracing()
+_tracer = trace.get_tracer("chefia") if trace is not None and TELEMETRIA else None
+
+
+class _SpanVazio:
+    def set_attribute(self, *args):
+        pass
+
+    def record_exception(self, *args):
+        pass
+
+
+@contextmanager
+def _span(nome, atributos, contexto):
+    if _tracer is None:
+        yield _SpanVazio()
+        return
+    atributos = {k: v for k, v in atributos.items() if v is not None}
+    if contexto:
+        with _tracer.start_as_current_span(nome, attributes=atributos) as span:
+            yield span
+        return
+    # sem virar o span corrente: seguro em geradores async, que podem retomar em outro contexto
+    span = _tracer.start_span(nome, attributes=atributos)
+    try:
+        yield span
+    except Exception as e:
+        span.record_exception(e)
+        raise
+    finally:
+        span.end()
+
+
+@contextmanager
+def medir(etapa, contexto=True, **atributos):
+    """
+    Span `chefia.<etapa>` + histograma de duração e contador de erros da etapa. Com `contexto=False`
+    o span não vira o corrente (use em geradores com yield dentro do bloco).
+    """
+    if not TELEMETRIA:
+        yield _SpanVazio()
+        return
+    inicio = time.perf_counter()
+    with _span(f"chefia.{etapa}", atributos, contexto) as span:
+        try:
+            yield span
+        except Exception:
+            ERROS_ETAPA.inc(etapa)
+            raise
+        finally:
+            DURACAO_ETAPA.observar(time.perf_counter() - inicio, etapa)
+
+
+def medido(etapa):
+    """Decorator de `medir` para funções síncronas e async."""
+    def decorar(funcao):
+        if asyncio.iscoroutinefunction(funcao):
+            @functools.wraps(funcao)
+            async def envolvida_async(*args, **kwargs):
+                with medir(etapa):
+                    return await funcao(*args, **kwargs)
+            return envolvida_async
+
+        @functools.wraps(funcao)
+        def envolvida(*args, **kwargs):
+            with medir(etapa):
+                return funcao(*args, **kwargs)
+        return envolvida
+    return decorar
+
+
+def registrar_postgres(comando, duracao):
+    if TELEMETRIA:
+        POSTGRES.observar(duracao, comando)
+
+
+def registrar_tokens(etapa, entrada, cacheados, saida):
+    if not TELEMETRIA:
+        return
+    CHAMADAS_LLM.inc(etapa)
+    TOKENS.inc(etapa, "entrada", quantidade=entrada)
+    TOKENS.inc(etapa, "cacheados", quantidade=cacheados)
+    TOKENS.inc(etapa, "saida", quantidade=saida)
+
+
+def registrar_especulacao(desfecho, duracao):
+    if TELEMETRIA:
+        ESPECULACAO.observar(duracao, desfecho)
+
+
+def registrar_espera_especulacao(espera):
+    if TELEMETRIA:
+        ESPECULACAO_ESPERA.observar(espera)
+
+
+class TelemetriaAgente(BaseCallbackHandler):
+    """
+    Callback dos agentes: um span por chamada de LLM e de tool (filhos do span da etapa quando o agente
+    roda dentro de `medir`), duração/erros de cada tool e iterações do agente.
+    """
+
+    def __init__(self, etapa):
+        self.etapa = etapa
+        self._abertos = {}  # run_id -> (span, início, nome da tool ou None)
+        self._lock = threading.Lock()
+
+    def _abrir(self, run_id, nome, tool=None, **atributos):
+        span = None
+        if _tracer is not None:
+            span = _tracer.start_span(nome, attributes={k: v for k, v in atributos.items() if v is not None})
+        with self._lock:
+            self._abertos[run_id] = (span, time.perf_counter(), tool)
+
+    def _fechar(self, run_id, erro=None, **atributos):
+        with self._lock:
+            span, inicio, tool = self._abertos.pop(run_id, (None, None, None))
+        if inicio is None:
+            return
+        if tool is not None:
+            DURACAO_TOOL.observar(time.perf_counter() - inicio, tool)
+            if erro is not None:
+                ERROS_TOOL.inc(tool)
+        if span is not None:
+            for chave, valor in atributos.items():
+                span.set_attribute(chave, valor)
+            if erro is not None:
+                span.set_attribute("error", True)
+                if isinstance(erro, BaseException):
+                    span.record_exception(erro)
+            span.end()
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._abrir(run_id, f"chefia.{self.etapa}.llm", mensagens=sum(len(m) for m in messages))
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        uso = {}
+        for geracoes in response.generations:
+            for geracao in geracoes:
+                uso = getattr(getattr(geracao, "message", None), "usage_metadata", None) or uso
+        self._fechar(
+            run_id,
+            tokens_entrada=uso.get("input_tokens", 0),
+            tokens_cacheados=(uso.get("input_token_details") or {}).get("cache_read", 0) or 0,
+            tokens_saida=uso.get("output_tokens", 0),
+        )
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._fechar(run_id, erro=error)
+
+    def on_agent_action(self, action, *, run_id, **kwargs):
+        ITERACOES_AGENTE.inc(self.etapa)
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        tool = (serialized or {}).get("name") or kwargs.get("name") or "desconhecida"
+        self._abrir(run_id, f"chefia.tool.{tool}", tool=tool)
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        # as tools devolvem {"status": "error", ...} em vez de lançar exceção
+        conteudo = getattr(output, "content", output)
+        status = conteudo.get("status") if isinstance(conteudo, dict) else None
+        self._fechar(run_id, erro="status error" if status == "error" else None, status=status or "ok")
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._fechar(run_id, erro=error)
@@ -0,0 +1,76 @@
+"""
+Janelas de histórico por turno do usuário, com um turno completo passando pelo fluxo (roteador,
+especialista de receitas e orquestrador). O Gemini é trocado pelo modelo roteirizado do benchmark
+ponta a ponta e a tool de receitas por uma resposta fixa; nenhum serviço externo é usado.
+Uso (a partir da raiz do repositório): python -m pytest tests
+"""
+import os
+
+os.environ.update({"EMBEDDER": "stub", "GEMINI_API_KEY": "teste", "HISTORICO_BACKEND": "memoria",
+                   "RESPOSTAS_CACHE": "false", "ESPECULACAO_RECEITAS": "false"})
+
+import langchain_google_genai
+import pytest
+from langchain_core.messages import HumanMessage
+
+from benchmarks.chat_e2e import criar_modelo_falso
+from historico import inicia_turno, inicio_janela
+from roteamento import Decisao, montar_encaminhamento
+
+langchain_google_genai.ChatGoogleGenerativeAI = criar_modelo_falso(0, 0)
+
+import app
+import mongo_tools
+
+PERGUNTA = "Que massa eu posso fazer hoje?"
+
+
+@pytest.fixture(autouse=True)
+def receitas_fixas(monkeypatch):
+    def consultar(**kwargs):
+        return {"status": "success", "data": [{"nome": "Ossobuco com nhoque"}], "count": 1}
+
+    monkeypatch.setattr(mongo_tools.query_receitas, "func", consultar)
+
+
+def executar(session_id, pergunta=PERGUNTA):
+    return app.executar_fluxo_chefia(pergunta, session_id, "1", "1")
+
+
+@pytest.mark.parametrize("pre_roteador", [False, True], ids=["roteador_llm", "pre_roteador"])
+def test_um_turno_completo_abre_um_unico_turno(monkeypatch, pre_roteador):
+    if pre_roteador:
+        monkeypatch.setattr(app, "classificar_rota", lambda session_id, pergunta: Decisao(rota="receitas", origem="embedding"))
+    else:
+        monkeypatch.setattr(app, "ROTEADOR_LOCAL", False)
+    session_id = f"1:turno-{pre_roteador}"
+
+    resposta = executar(session_id)
+
+    mensagens = app.store.get(session_id).messages
+    humanas = [m for m in mensagens if isinstance(m, HumanMessage)]
+    # o turno grava a pergunta, o encaminhamento ao especialista e o JSON ao orquestrador...
+    assert len(humanas) == 3
+    assert humanas[1].content == montar_encaminhamento("receitas", PERGUNTA)
+    # ...mas só a pergunta do usuário abre um turno
+    assert [m.content for m in mensagens if inicia_turno(m)] == [PERGUNTA]
+    assert mensagens[-1].content == resposta
+
+    # janelas de 1 turno trazem o turno inteiro, a começar pela pergunta do usuário
+    assert inicio_janela(mensagens, 1) == 0
+    janela_receitas = app.gerenciador_historico.mensagens_da_etapa(session_id, "receitas")
+    assert janela_receitas == mensagens
+    assert app.gerenciador_historico.tem_historico(session_id)
+
+
+def test_janela_conta_turnos_do_usuario(monkeypatch):
+    monkeypatch.setattr(app, "ROTEADOR_LOCAL", False)
+    session_id = "1:dois-turnos"
+    executar(session_id)
+    executar(session_id, "E uma sobremesa com chocolate?")
+
+    mensagens = app.store.get(session_id).messages
+    inicio = inicio_janela(mensagens, 1)
+    assert mensagens[inicio].content == "E uma sobremesa com chocolate?"
+    assert len(mensagens[inicio:]) == len(mensagens) // 2
+    assert inicio_janela(mensagens, 2) == 0